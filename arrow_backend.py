@@ -0,0 +1,283 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from constants import CONSUMER_CLASSES, load_biomass_coeffs
+from profiling import profile_stage
+from fish_and_inverts_shared_metrics import (
+    align_species_class_table,
+    build_species_class_table,
+    lookup_biomass_coeff_positions,
+)
+from fish_metrics import FISH_METRIC_COLUMNS
+from invert_metrics import INVERTS_METRIC_COLUMNS
+from subs_metrics import SUBS_METRIC_COLUMNS, classify_subs_categories
+from utils import PERIODS
+
+# The Arrow backend runs the same steps as create_group_daily_df, build_daily_cube,
+# count_dives and rollup_cube on pyarrow Tables with Arrow compute kernels, so
+# Site, Species and the other string keys are grouped and joined as Arrow strings
+# instead of Python objects. Results only become pandas DataFrames to be saved.
+
+# The columns create_daily_df groups by for each group
+DAILY_KEYS = {
+    "fish": ["Date", "Site", "Species", "Size"],
+    "inverts": ["Date", "Site", "Species", "Size"],
+    "subs": ["Date", "Site", "Group", "Status"],
+}
+
+
+def _plain_type(data_type: pa.DataType) -> pa.DataType:
+    # Categoricals convert to dictionaries, and depending on the pandas version strings
+    # convert to string or large_string, so settle on plain string to let tables from
+    # different sources be joined and sorted
+    if pa.types.is_dictionary(data_type):
+        data_type = data_type.value_type
+    return pa.string() if pa.types.is_large_string(data_type) else data_type
+
+
+def _from_pandas(survey_data_df: pd.DataFrame) -> pa.Table:
+    table = pa.Table.from_pandas(survey_data_df, preserve_index=False)
+    return table.cast(pa.schema([
+        pa.field(field.name, _plain_type(field.type)) for field in table.schema
+    ]))
+
+
+def _group_sum(table: pa.Table, keys: list, columns: list) -> pa.Table:
+    # Sum the columns per distinct key, keeping the column names and putting the keys first
+    summed = table.group_by(keys).aggregate([(column, "sum") for column in columns])
+    return summed.select(keys + [f"{column}_sum" for column in columns]).rename_columns(keys + columns)
+
+
+def _drop_null_keys(table: pa.Table, keys: list) -> pa.Table:
+    # pandas drops rows with missing keys when grouping, Arrow would keep them as a group
+    valid = pc.is_valid(table[keys[0]])
+    for key in keys[1:]:
+        valid = pc.and_(valid, pc.is_valid(table[key]))
+    return table.filter(valid)
+
+
+@profile_stage
+def create_daily_table(survey_data_df: pd.DataFrame, group: str) -> pa.Table:
+    """
+    Convert survey data to Arrow and aggregate it per day, like create_daily_df.
+
+    Parameters:
+    survey_data_df (pd.DataFrame): The pre-processed (or daily) survey data.
+    group (str): Either fish, inverts or subs.
+
+    Returns:
+    pa.Table: The summed Total per Date, Site and Species and Size (or Group and
+    Status for subs).
+    """
+    keys = DAILY_KEYS[group]
+    survey_table = _from_pandas(survey_data_df[keys + ["Total"]])
+    return _group_sum(_drop_null_keys(survey_table, keys), keys, ["Total"])
+
+
+@profile_stage
+def calculate_biomass_table(daily_table: pa.Table, biomass_coeffs_file_url: str) -> pa.Table:
+    """
+    Join the biomass coefficients onto the daily data and add the biomass of each
+    row, like calculate_biomass.
+
+    Parameters:
+    daily_table (pa.Table): The daily data from create_daily_table.
+    biomass_coeffs_file_url (str): Path to the biomass coefficients CSV file.
+
+    Returns:
+    pa.Table: The daily data with a Total Biomass column.
+    """
+    # Key the coefficients by the survey's spellings of the species, so aliases and
+    # parent fallbacks resolve like in calculate_biomass
+    species = pc.unique(daily_table["Species"])
+    coeff_positions = lookup_biomass_coeff_positions(species.to_pylist(), biomass_coeffs_file_url)
+    biomass_coeffs = load_biomass_coeffs(biomass_coeffs_file_url)
+    coeffs_table = pa.table({
+        "Species": species,
+        "Coeff_a": biomass_coeffs.coeff_a[coeff_positions],
+        "Coeff_b": biomass_coeffs.coeff_b[coeff_positions],
+    })
+    joined = daily_table.join(coeffs_table, "Species", join_type="left outer")
+
+    unit_biomass = pc.multiply(joined["Coeff_a"], pc.power(pc.cast(joined["Size"], pa.float64()), joined["Coeff_b"]))
+    total_biomass = pc.multiply(pc.cast(joined["Total"], pa.float64()), unit_biomass)
+    return joined.drop_columns(["Coeff_a", "Coeff_b"]).append_column("Total Biomass", total_biomass)
+
+
+@profile_stage
+def create_group_daily_table(survey_data_df: pd.DataFrame, group: str, include_biomass: bool = False) -> pa.Table:
+    """
+    Create a group's daily data as an Arrow table, like create_group_daily_df.
+
+    Parameters:
+    survey_data_df (pd.DataFrame): The pre-processed (or daily) survey data.
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to calculate invert biomass.
+
+    Returns:
+    pa.Table: The group's daily data, with Total Biomass for fish (and inverts when
+    include_biomass is True).
+    """
+    daily_table = create_daily_table(survey_data_df, group)
+    if group == "fish" or (group == "inverts" and include_biomass):
+        daily_table = calculate_biomass_table(daily_table, f"data/constants/biomass_coeffs_{group}.csv")
+    return daily_table
+
+
+def _weight_table(keys: pd.DataFrame, weights, columns: list) -> pa.Table:
+    # A lookup table of the weight each distinct key counts with in each metric
+    weight_table = _from_pandas(keys.reset_index(drop=True))
+    for position, column in enumerate(columns):
+        weight_table = weight_table.append_column(f"{column} Weight", pa.array(weights[:, position], pa.float64()))
+    return weight_table
+
+
+def _weighted_sum(
+    daily_table: pa.Table, weight_table: pa.Table, join_keys: list, value_columns: dict
+) -> pa.Table:
+    # Join the weights on and sum every (value x weight) column per Date and Site
+    joined = daily_table.join(weight_table, join_keys, join_type="left outer")
+    for column, (value_column, weight_column) in value_columns.items():
+        values = pc.cast(joined[value_column], pa.float64())
+        # pandas skips missing values (e.g. biomass without coefficients) when summing
+        values = pc.fill_null(pc.if_else(pc.is_nan(values), 0.0, values), 0.0)
+        if weight_column is not None:
+            values = pc.multiply(values, pc.fill_null(joined[weight_column], 0.0))
+        joined = joined.append_column(f"{column} Value", values)
+    summed = _group_sum(joined, ["Date", "Site"], [f"{column} Value" for column in value_columns])
+    return summed.rename_columns(["Date", "Site", *value_columns])
+
+
+@profile_stage
+def build_daily_cube_table(daily_table: pa.Table, group: str, include_biomass: bool = False) -> pa.Table:
+    """
+    Build the additive daily cube of a group as an Arrow table, like build_daily_cube.
+
+    Parameters:
+    daily_table (pa.Table): The group's daily data, from create_group_daily_table.
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to include invert biomass.
+
+    Returns:
+    pa.Table: One row per Date and Site with one column per metric numerator.
+    """
+    if group == "subs":
+        # Classify the distinct Group/Status combinations with the pandas rules, then
+        # join the weights onto every row
+        categories = daily_table.select(["Group", "Status"]).group_by(["Group", "Status"]).aggregate([]).to_pandas()
+        codes, category_weights = classify_subs_categories(categories)
+        weight_table = _weight_table(categories, category_weights[codes], SUBS_METRIC_COLUMNS)
+        return _weighted_sum(
+            daily_table,
+            weight_table,
+            ["Group", "Status"],
+            {metric: ("Total", f"{metric} Weight") for metric in SUBS_METRIC_COLUMNS},
+        )
+
+    if group == "fish":
+        species_class_table = build_species_class_table("fish", CONSUMER_CLASSES + ["commercial"])
+        metric_columns = FISH_METRIC_COLUMNS
+    else:
+        species_class_table = build_species_class_table("inverts", CONSUMER_CLASSES)
+        metric_columns = INVERTS_METRIC_COLUMNS + (["Total Biomass Density"] if include_biomass else [])
+
+    value_columns = {"Total Density": ("Total", None)}
+    for class_name in species_class_table.columns:
+        value_columns[f"{class_name} Density"] = ("Total", f"{class_name} Weight")
+    if "Total Biomass Density" in metric_columns:
+        value_columns["Total Biomass Density"] = ("Total Biomass", None)
+    if "Commercial Biomass Density" in metric_columns:
+        value_columns["Commercial Biomass Density"] = ("Total Biomass", "Commercial Weight")
+
+    # Key the weights by the survey's spellings of the species, like calculate_class_totals
+    species = pd.DataFrame({"Species": pc.unique(daily_table["Species"]).to_pylist()})
+    memberships = align_species_class_table(species_class_table, species["Species"])
+    weight_table = _weight_table(species, memberships.to_numpy(), list(species_class_table.columns))
+    daily_cube = _weighted_sum(daily_table, weight_table, "Species", value_columns)
+    for biomass_column in ["Total Biomass Density", "Commercial Biomass Density"]:
+        if biomass_column in metric_columns:
+            # Convert from g/ha^2 to g/m^2
+            daily_cube = daily_cube.set_column(
+                daily_cube.schema.get_field_index(biomass_column),
+                biomass_column,
+                pc.divide(daily_cube[biomass_column], 1000.0),
+            )
+    return daily_cube.select(["Date", "Site"] + metric_columns)
+
+
+def build_dives_table(survey_data_df: pd.DataFrame) -> pa.Table:
+    """
+    Extract the distinct dives (Date, Site, Survey_ID) as an Arrow table.
+
+    Parameters:
+    survey_data_df (pd.DataFrame): The dive effort index from build_dive_index, or
+    pre-processed survey data.
+
+    Returns:
+    pa.Table: One row per dive.
+    """
+    dives_table = _from_pandas(survey_data_df[["Date", "Site", "Survey_ID"]])
+    return dives_table.group_by(["Date", "Site", "Survey_ID"]).aggregate([])
+
+
+def period_ordinal_array(dates: pa.ChunkedArray, period: str) -> pa.ChunkedArray:
+    """
+    Map dates to integer period ordinals with Arrow kernels, like period_ordinals.
+
+    Parameters:
+    dates (pa.ChunkedArray): The dates (or timestamps) to map.
+    period (str): One of utils.PERIODS.
+
+    Returns:
+    pa.ChunkedArray: The int64 period ordinal of each date.
+    """
+    if period == "daily":
+        return pc.cast(pc.cast(pc.cast(dates, pa.date32()), pa.int32()), pa.int64())
+    years = pc.year(dates)
+    if period == "annual":
+        return years
+    months_since_year_zero = pc.add(pc.multiply(years, 12), pc.subtract(pc.month(dates), 1))
+    if period == "monthly":
+        return months_since_year_zero
+    elif period == "seasonal":
+        # Counting months from March puts each season's three months next to each
+        # other. Integer division truncates, which is a floor for years after 0
+        return pc.divide(pc.subtract(months_since_year_zero, 2), 3)
+    raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}.")
+
+
+@profile_stage
+def rollup_cube_table(daily_cube: pa.Table, dives_table: pa.Table, period: str) -> pa.Table:
+    """
+    Roll the daily cube up to any period with Arrow kernels, like rollup_cube.
+
+    Parameters:
+    daily_cube (pa.Table): The cube from build_daily_cube_table.
+    dives_table (pa.Table): The dives from build_dives_table.
+    period (str): One of utils.PERIODS.
+
+    Returns:
+    pa.Table: The metrics for each unique combination of Period (as ordinals) and
+    Site, ordered by Period and Site.
+    """
+    metric_columns = daily_cube.column_names[2:]
+    period_totals = _group_sum(
+        daily_cube.append_column("Period", period_ordinal_array(daily_cube["Date"], period)),
+        ["Period", "Site"],
+        metric_columns,
+    )
+    dives = (
+        dives_table.append_column("Period", period_ordinal_array(dives_table["Date"], period))
+        .group_by(["Period", "Site"])
+        .aggregate([("Survey_ID", "count_distinct")])
+        .select(["Period", "Site", "Survey_ID_count_distinct"])
+        .rename_columns(["Period", "Site", "Dives"])
+    )
+
+    period_results = period_totals.join(dives, ["Period", "Site"], join_type="left outer")
+    dive_numbers = pc.cast(period_results["Dives"], pa.float64())
+    for position, column in enumerate(metric_columns, start=2):
+        period_results = period_results.set_column(
+            position, column, pc.divide(period_results[column], dive_numbers)
+        )
+    return period_results.drop_columns("Dives").sort_by([("Period", "ascending"), ("Site", "ascending")])
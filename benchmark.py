@@ -0,0 +1,337 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from pre_processing import pre_process_data
+from pipeline import GROUPS, check_all_constants_exist, calculate_group_metrics
+from fish_and_inverts_shared_metrics import (
+    calculate_biomass,
+    calculate_total_count_and_density,
+    calculate_commercial_count_and_density,
+    calculate_total_biomass_and_density,
+    calculate_commercial_biomass,
+    calculate_corallivore_density,
+    calculate_detritivore_density,
+    calculate_omnivore_density,
+    calculate_carnivore_density,
+    calculate_herbivore_density,
+)
+from subs_metrics import (
+    calculate_rubber_cover,
+    calculate_fresh_algae_cover,
+    calculate_soft_coral_cover,
+    calculate_hard_coral_cover,
+    calculate_bleaching,
+)
+from rollup import build_daily_cube, rollup_cube
+from dive_effort import build_dive_index, count_dives
+from synthetic_data import write_synthetic_export
+from utils import (
+    create_daily_df,
+    determine_number_of_dives_per_period,
+    period_ordinals,
+    prepare_results_df,
+    save_site_dataframes,
+)
+
+BENCHMARK_DIR = "data/benchmarks"
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+# A stage counts as a regression when it is this much slower than the baseline
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def metric_functions(group: str, include_biomass: bool = False) -> dict:
+    """
+    List the individual metric functions of a group, each taking the daily data with
+    Period, the results DataFrame and the number of dives per Period and Site.
+
+    Parameters:
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to include the invert biomass metric.
+
+    Returns:
+    dict: The metric functions keyed by metric name.
+    """
+    if group == "subs":
+        return {
+            "Rubble Cover": calculate_rubber_cover,
+            "Fresh Algae Cover": calculate_fresh_algae_cover,
+            "Soft Coral Cover": calculate_soft_coral_cover,
+            "Hard Coral Cover": calculate_hard_coral_cover,
+            "Bleaching": calculate_bleaching,
+        }
+    functions = {
+        "Corallivore Density": partial(calculate_corallivore_density, group=group),
+        "Detritivore Density": partial(calculate_detritivore_density, group=group),
+        "Omnivore Density": partial(calculate_omnivore_density, group=group),
+        "Carnivore Density": partial(calculate_carnivore_density, group=group),
+        "Herbivore Density": partial(calculate_herbivore_density, group=group),
+        "Total Density": calculate_total_count_and_density,
+    }
+    if group == "fish":
+        functions["Commercial Density"] = calculate_commercial_count_and_density
+        functions["Total Biomass Density"] = calculate_total_biomass_and_density
+        functions["Commercial Biomass Density"] = calculate_commercial_biomass
+    elif include_biomass:
+        functions["Total Biomass Density"] = calculate_total_biomass_and_density
+    return functions
+
+
+def benchmark_group(
+    survey_data_file_url: str,
+    group: str,
+    period: str = "seasonal",
+    include_biomass: bool = False,
+    output_dir: str = None,
+) -> dict:
+    """
+    Time every stage of a group's pipeline on one survey export: reading, each
+    pre-processing and aggregation step, each individual metric, the combined metrics,
+    the rollup engine and saving the site files.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+    group (str): Either fish, inverts or subs.
+    period (str): The period to calculate metrics for.
+    include_biomass (bool): Whether to calculate invert biomass.
+    output_dir (str): Where to save the site files. A temporary directory if None.
+
+    Returns:
+    dict: The seconds taken by each stage.
+    """
+    stage_seconds = {}
+
+    def timed(stage: str, function, *args, **kwargs):
+        start_time = time.perf_counter()
+        result = function(*args, **kwargs)
+        stage_seconds[stage] = time.perf_counter() - start_time
+        return result
+
+    raw_df = timed("read_csv", pd.read_csv, survey_data_file_url)
+    pre_processed_df = timed("pre_process_data", pre_process_data, raw_df, group, verbose=False)
+    del raw_df
+    timed("check_constants", check_all_constants_exist, pre_processed_df, group, include_biomass)
+
+    timed(
+        "determine_number_of_dives_per_period",
+        determine_number_of_dives_per_period, pre_processed_df, period,
+    )
+    dive_index = timed("build_dive_index", build_dive_index, pre_processed_df)
+    dive_numbers = timed("count_dives", count_dives, dive_index, period)
+    daily_df = timed("create_daily_df", create_daily_df, pre_processed_df, group)
+    if group == "fish" or include_biomass:
+        daily_df = timed(
+            "calculate_biomass",
+            calculate_biomass, daily_df, f"data/constants/biomass_coeffs_{group}.csv",
+        )
+
+    daily_with_period_df = daily_df.assign(Period=period_ordinals(daily_df["Date"], period))
+    results_df = prepare_results_df(daily_with_period_df)
+    for metric, function in metric_functions(group, include_biomass).items():
+        timed(f"metric[{metric}]", function, daily_with_period_df, results_df, dive_numbers)
+
+    results_df = timed(
+        "calculate_metrics",
+        calculate_group_metrics,
+        pre_processed_df, dive_numbers, period, group, include_biomass, daily_df,
+    )
+    daily_cube = timed("build_daily_cube", build_daily_cube, daily_df, group, include_biomass)
+    timed("rollup_cube", rollup_cube, daily_cube, dive_index, period)
+
+    # Keep the per site "Saved ..." lines out of the benchmark output
+    with tempfile.TemporaryDirectory() as temporary_dir, contextlib.redirect_stdout(io.StringIO()):
+        timed(
+            "save_site_dataframes",
+            save_site_dataframes, results_df, period, group, output_dir=output_dir or temporary_dir,
+        )
+    return stage_seconds
+
+
+def run_benchmarks(
+    sizes: list = DEFAULT_SIZES,
+    groups: list = GROUPS,
+    period: str = "seasonal",
+    include_biomass: bool = False,
+    repeats: int = 1,
+    seed: int = 0,
+    output_file_url: str = None,
+) -> dict:
+    """
+    Benchmark every group on synthetic exports of each size and save the results as
+    JSON. With several repeats the fastest time of each stage is kept.
+
+    Parameters:
+    sizes (list): Number of rows of each synthetic export, e.g. [10_000, 1_000_000].
+    groups (list): The groups to benchmark.
+    period (str): The period to calculate metrics for.
+    include_biomass (bool): Whether to calculate invert biomass.
+    repeats (int): Number of times to run each benchmark.
+    seed (int): Seed of the synthetic data generator.
+    output_file_url (str): Path of the JSON file to write. Defaults to a timestamped
+    file in data/benchmarks.
+
+    Returns:
+    dict: The benchmark run, with the environment it ran in and the seconds per stage
+    of each group and size.
+    """
+    created = datetime.now(timezone.utc)
+    benchmark_run = {
+        "created": created.isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "period": period,
+        "include_biomass": include_biomass,
+        "repeats": repeats,
+        "seed": seed,
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        for group in groups:
+            for n_rows in sizes:
+                survey_data_file_url = f"{temporary_dir}/{group}_{n_rows}.csv"
+                start_time = time.perf_counter()
+                write_synthetic_export(survey_data_file_url, group, n_rows, seed)
+                generate_seconds = time.perf_counter() - start_time
+
+                stage_seconds = {}
+                for _ in range(repeats):
+                    for stage, seconds in benchmark_group(
+                        survey_data_file_url, group, period, include_biomass
+                    ).items():
+                        stage_seconds[stage] = min(seconds, stage_seconds.get(stage, seconds))
+                os.remove(survey_data_file_url)
+
+                benchmark_run["results"].append({
+                    "group": group,
+                    "rows": n_rows,
+                    "generate_seconds": generate_seconds,
+                    "total_seconds": sum(stage_seconds.values()),
+                    "stages": stage_seconds,
+                })
+                print(f"Benchmarked {group} at {n_rows} rows: {sum(stage_seconds.values()):.2f}s")
+
+    if output_file_url is None:
+        output_file_url = f"{BENCHMARK_DIR}/benchmark_{created.strftime('%Y%m%dT%H%M%SZ')}.json"
+    os.makedirs(os.path.dirname(output_file_url) or ".", exist_ok=True)
+    with open(output_file_url, "w") as output_file:
+        json.dump(benchmark_run, output_file, indent=2)
+    print(f"Saved {output_file_url}")
+    print_benchmark_results(benchmark_run)
+    return benchmark_run
+
+
+def print_benchmark_results(benchmark_run: dict) -> None:
+    """
+    Print the seconds per stage of a benchmark run, one column per group and size.
+
+    Parameters:
+    benchmark_run (dict): A benchmark run as returned by run_benchmarks.
+    """
+    results = benchmark_run["results"]
+    stages = list(dict.fromkeys(stage for result in results for stage in result["stages"]))
+    table = pd.DataFrame(
+        {(result["group"], result["rows"]): result["stages"] for result in results},
+        index=stages,
+    )
+    print(table.round(4).to_string(na_rep="-"))
+
+
+def compare_benchmarks(
+    baseline_file_url: str,
+    current_file_url: str,
+    threshold: float = DEFAULT_REGRESSION_THRESHOLD,
+) -> pd.DataFrame:
+    """
+    Compare two benchmark runs stage by stage and print the stages that got slower
+    by more than the threshold.
+
+    Parameters:
+    baseline_file_url (str): Path to the baseline benchmark JSON file.
+    current_file_url (str): Path to the benchmark JSON file to compare.
+    threshold (float): Relative slowdown counted as a regression, e.g. 0.1 for 10%.
+
+    Returns:
+    pd.DataFrame: The baseline and current seconds and their ratio, per group, rows and
+    stage found in both runs, with a Regression column.
+    """
+    def load_stage_seconds(file_url: str) -> pd.Series:
+        with open(file_url) as benchmark_file:
+            benchmark_run = json.load(benchmark_file)
+        return pd.Series({
+            (result["group"], result["rows"], stage): seconds
+            for result in benchmark_run["results"]
+            for stage, seconds in result["stages"].items()
+        })
+
+    comparison_df = pd.concat(
+        {"Baseline": load_stage_seconds(baseline_file_url), "Current": load_stage_seconds(current_file_url)},
+        axis=1,
+        join="inner",
+    )
+    comparison_df.index.names = ["Group", "Rows", "Stage"]
+    comparison_df["Ratio"] = comparison_df["Current"] / comparison_df["Baseline"]
+    comparison_df["Regression"] = comparison_df["Ratio"] > 1 + threshold
+
+    print(comparison_df.round(4).to_string())
+    regressions = comparison_df[comparison_df["Regression"]]
+    if len(regressions):
+        print(f"{len(regressions)} stages are more than {threshold:.0%} slower than the baseline")
+    else:
+        print(f"No stage is more than {threshold:.0%} slower than the baseline")
+    return comparison_df
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages on synthetic survey exports."
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+        help="Rows per synthetic export, e.g. 10000 10000000 (default: %(default)s)",
+    )
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=GROUPS)
+    parser.add_argument("--period", default="seasonal")
+    parser.add_argument("--include-invert-biomass", action="store_true")
+    parser.add_argument("--repeats", type=int, default=1, help="Keep the fastest of this many runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Path of the JSON results file")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+        help="Compare two saved benchmark JSON files instead of running the benchmarks",
+    )
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_benchmarks(*args.compare, threshold=args.threshold)
+    else:
+        run_benchmarks(
+            args.sizes, args.groups, args.period, args.include_invert_biomass,
+            args.repeats, args.seed, args.output,
+        )
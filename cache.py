@@ -0,0 +1,218 @@
+import contextlib
+import glob
+import hashlib
+import os
+import threading
+
+import pandas as pd
+from constants import CONSTANTS_DIR
+from dive_effort import build_dive_index
+from ingestion import read_survey_export
+from pre_processing import PRE_PROCESSING_VERSION, pre_process_data
+from utils import create_daily_df
+
+CACHE_DIR = "data/cache"
+
+# Total size of the cache before the least recently used entries are evicted
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024**3
+
+
+def file_hash(file_url: str) -> str:
+    """
+    Hash the content of a file, reading it in blocks so large exports aren't loaded
+    into memory.
+
+    Parameters:
+    file_url (str): Path to the file.
+
+    Returns:
+    str: The SHA-256 hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_url, "rb") as hashed_file:
+        for block in iter(lambda: hashed_file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def survey_digest(survey_data_file_url: str, group: str) -> str:
+    """
+    Hash everything a survey export's cached stages depend on: the content of the
+    export, the content of the constants and the pre-processing version.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+    group (str): Either fish, inverts or subs.
+
+    Returns:
+    str: The SHA-256 hex digest, which survey_cache_key turns into each stage's key.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{group}:{PRE_PROCESSING_VERSION}".encode())
+    digest.update(file_hash(survey_data_file_url).encode())
+    for constants_file_url in sorted(glob.glob(f"{CONSTANTS_DIR}/*.csv")):
+        digest.update(file_hash(constants_file_url).encode())
+    return digest.hexdigest()
+
+
+def survey_cache_key(export_digest: str, group: str, stage: str) -> str:
+    """
+    Build the cache key of one stage's output for a survey export.
+
+    Parameters:
+    export_digest (str): The export's digest, as returned by survey_digest.
+    group (str): Either fish, inverts or subs.
+    stage (str): The cached stage, e.g. "pre_processed" or "daily".
+
+    Returns:
+    str: The cache key.
+    """
+    stage_digest = hashlib.sha256(f"{stage}:{export_digest}".encode()).hexdigest()
+    return f"{group}-{stage}-{stage_digest[:32]}"
+
+
+def read_cached_frame(key: str) -> pd.DataFrame:
+    """
+    Read a cached DataFrame, marking it as recently used.
+
+    Parameters:
+    key (str): The cache key.
+
+    Returns:
+    pd.DataFrame: The cached DataFrame, or None if it isn't cached.
+    """
+    cache_file_url = f"{CACHE_DIR}/{key}.parquet"
+    if not os.path.exists(cache_file_url):
+        return None
+    os.utime(cache_file_url)
+    return pd.read_parquet(cache_file_url)
+
+
+def write_cached_frame(
+    key: str, survey_data_df: pd.DataFrame, max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES
+) -> None:
+    """
+    Write a DataFrame to the cache as Parquet, then evict the least recently used
+    entries if the cache is over its size cap.
+
+    Parameters:
+    key (str): The cache key.
+    survey_data_df (pd.DataFrame): The DataFrame to cache.
+    max_cache_bytes (int): The maximum total size of the cache.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_file_url = f"{CACHE_DIR}/{key}.parquet"
+    # Write to a temporary file first so a failed write never leaves a partial entry,
+    # unique per process and thread so pipelines sharing the cache never share one
+    temporary_file_url = f"{cache_file_url}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        survey_data_df.to_parquet(temporary_file_url)
+        os.replace(temporary_file_url, cache_file_url)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_file_url)
+        raise
+    evict_least_recently_used(max_cache_bytes)
+
+
+def evict_least_recently_used(max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES) -> None:
+    """
+    Delete the least recently used cache entries until the cache fits its size cap.
+
+    Parameters:
+    max_cache_bytes (int): The maximum total size of the cache.
+    """
+    cache_files = sorted(
+        glob.glob(f"{CACHE_DIR}/*.parquet"), key=os.path.getmtime, reverse=True
+    )
+    total_bytes = 0
+    for cache_file_url in cache_files:
+        total_bytes += os.path.getsize(cache_file_url)
+        if total_bytes > max_cache_bytes:
+            try:
+                os.remove(cache_file_url)
+                print(f"Evicted {cache_file_url} from the cache")
+            except FileNotFoundError:
+                # Already evicted by another pipeline sharing the cache
+                pass
+
+
+def cached_frame(
+    stage: str,
+    export_digest: str,
+    group: str,
+    compute,
+    max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+) -> pd.DataFrame:
+    """
+    Return one stage's output for a survey export from the cache, computing and
+    caching it if the export, the constants or the pre-processing have changed.
+
+    Parameters:
+    stage (str): The cached stage, e.g. "pre_processed" or "daily".
+    export_digest (str): The export's digest, as returned by survey_digest.
+    group (str): Either fish, inverts or subs.
+    compute (callable): Function with no arguments that computes the stage's output.
+    max_cache_bytes (int): The maximum total size of the cache.
+
+    Returns:
+    pd.DataFrame: The stage's output.
+    """
+    key = survey_cache_key(export_digest, group, stage)
+    survey_data_df = read_cached_frame(key)
+    if survey_data_df is None:
+        survey_data_df = compute()
+        write_cached_frame(key, survey_data_df, max_cache_bytes)
+    else:
+        print(f"Loaded {stage} {group} data from the cache")
+    return survey_data_df
+
+
+def cached_survey_data(
+    survey_data_file_url: str, group: str, max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES
+) -> tuple:
+    """
+    Read and pre-process a survey export through the cache. The pre-processed data,
+    its daily aggregates and its dive effort index are cached separately, and the export
+    is only parsed if one of them is missing.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+    group (str): Either fish, inverts or subs.
+    max_cache_bytes (int): The maximum total size of the cache.
+
+    Returns:
+    tuple: The daily DataFrame (as from create_daily_df), which can be passed to the
+    calculate_*_metrics functions, and the dive effort index (see build_dive_index),
+    which can be passed to determine_number_of_dives_per_period.
+    """
+    # Hash the export and the constants once for all the stages' keys
+    digest = survey_digest(survey_data_file_url, group)
+    pre_processed = {}
+
+    def get_pre_processed_df() -> pd.DataFrame:
+        if "df" not in pre_processed:
+            pre_processed["df"] = cached_frame(
+                "pre_processed",
+                digest,
+                group,
+                lambda: pre_process_data(read_survey_export(survey_data_file_url), group),
+                max_cache_bytes,
+            )
+        return pre_processed["df"]
+
+    daily_df = cached_frame(
+        "daily",
+        digest,
+        group,
+        lambda: create_daily_df(get_pre_processed_df(), group),
+        max_cache_bytes,
+    )
+    dives_df = cached_frame(
+        "dive_index",
+        digest,
+        group,
+        lambda: build_dive_index(get_pre_processed_df()),
+        max_cache_bytes,
+    )
+    return daily_df, dives_df
@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from species_resolver import SpeciesResolver
+
+CONSTANTS_DIR = "data/constants"
+
+# Consumer classes with a species list per group in data/constants/<class>_<group>.csv
+CONSUMER_CLASSES = ["corallivore", "detritivore", "omnivore", "carnivore", "herbivore"]
+
+# Parsed constants keyed by file path, each entry holding the file's mtime, content
+# hash and parsed value so a file is only parsed again when it actually changes
+_registry = {}
+
+
+class BiomassCoeffs(NamedTuple):
+    """
+    Biomass coefficients with one read-only array entry per species.
+    """
+    species: pd.Index
+    coeff_a: np.ndarray
+    coeff_b: np.ndarray
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {"Coeff_a": self.coeff_a, "Coeff_b": self.coeff_b}, index=self.species
+        )
+
+
+def _parse_species_list(content: bytes) -> frozenset:
+    return frozenset(pd.read_csv(io.BytesIO(content), header=None).iloc[:, 0])
+
+
+def _parse_biomass_coeffs(content: bytes) -> BiomassCoeffs:
+    biomass_coeffs = pd.read_csv(io.BytesIO(content), index_col="Species")
+    coeff_a = biomass_coeffs["Coeff_a"].to_numpy(dtype=float)
+    coeff_b = biomass_coeffs["Coeff_b"].to_numpy(dtype=float)
+    coeff_a.flags.writeable = False
+    coeff_b.flags.writeable = False
+    return BiomassCoeffs(biomass_coeffs.index, coeff_a, coeff_b)
+
+
+def _parse_biomass_resolver(content: bytes) -> SpeciesResolver:
+    return SpeciesResolver(_parse_biomass_coeffs(content).species)
+
+
+def _load(file_url: str, parser, key: str = None):
+    """
+    Return the parsed contents of a constants file, parsing it only if it is new or
+    its modification time and content hash have changed since it was last parsed.
+
+    Parameters:
+    file_url (str): Path to the constants file.
+    parser (callable): Function turning the raw file bytes into the parsed value.
+    key (str, optional): Registry key, for parsing the same file in more than one way.
+    Defaults to the file path.
+
+    Returns:
+    The parsed value.
+    """
+    key = file_url if key is None else key
+    mtime = os.stat(file_url).st_mtime_ns
+    entry = _registry.get(key)
+    if entry is not None and entry["mtime"] == mtime:
+        return entry["value"]
+
+    with open(file_url, "rb") as constants_file:
+        content = constants_file.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    # Touched but not edited, so the parsed value is still valid
+    if entry is not None and entry["digest"] == digest:
+        entry["mtime"] = mtime
+        return entry["value"]
+
+    value = parser(content)
+    _registry[key] = {"mtime": mtime, "digest": digest, "value": value}
+    return value
+
+
+def load_species_list(file_url: str) -> frozenset:
+    """
+    Load a single column list of species names, e.g. a consumer list.
+
+    Parameters:
+    file_url (str): Path to the species list CSV file (no header).
+
+    Returns:
+    frozenset: The species names in the file.
+    """
+    return _load(file_url, _parse_species_list)
+
+
+def load_consumer_species(consumer: str, group: str) -> frozenset:
+    """
+    Load the species of one consumer class, e.g. herbivore fish.
+
+    Parameters:
+    consumer (str): The consumer class, e.g. herbivore, carnivore, omnivore, detritivore or corallivore.
+    group (str): Either fish or inverts.
+
+    Returns:
+    frozenset: The species names in the consumer class.
+    """
+    return load_species_list(f"{CONSTANTS_DIR}/{consumer}_{group}.csv")
+
+
+def load_commercial_species() -> frozenset:
+    """
+    Load the species considered commercial fish.
+
+    Returns:
+    frozenset: The commercial fish species names.
+    """
+    return load_species_list(f"{CONSTANTS_DIR}/commercial_fish.csv")
+
+
+def load_biomass_coeffs(file_url: str) -> BiomassCoeffs:
+    """
+    Load biomass coefficients as NumPy arrays aligned with a species index.
+
+    Parameters:
+    file_url (str): Path to the biomass coefficients CSV file.
+
+    Returns:
+    BiomassCoeffs: The species index and the Coeff_a and Coeff_b arrays.
+    """
+    return _load(file_url, _parse_biomass_coeffs)
+
+
+def load_biomass_resolver(file_url: str) -> SpeciesResolver:
+    """
+    Load the species resolver of a biomass coefficients file, so survey spellings of
+    its species (and their parents) can be matched to its entries.
+
+    Parameters:
+    file_url (str): Path to the biomass coefficients CSV file.
+
+    Returns:
+    SpeciesResolver: The resolver over the species with coefficients.
+    """
+    return _load(file_url, _parse_biomass_resolver, key=f"{file_url}:resolver")
+
+
+def clear_constants_cache() -> None:
+    """
+    Forget all parsed constants so the next access reads the files again.
+    """
+    _registry.clear()
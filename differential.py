@@ -0,0 +1,365 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from pre_processing import pre_process_data
+from pipeline import GROUPS, check_all_constants_exist, create_group_daily_df
+from benchmark import metric_functions
+from fish_and_inverts_shared_metrics import calculate_biomass
+from ingestion import read_survey_export
+from rollup import build_daily_cube, rollup_cube
+from dive_effort import build_dive_index
+from arrow_backend import (
+    build_daily_cube_table,
+    build_dives_table,
+    create_group_daily_table,
+    rollup_cube_table,
+)
+from utils import (
+    OUTPUT_DIR,
+    determine_number_of_dives_per_period,
+    load_site_results,
+    period_ordinals,
+    prepare_results_df,
+)
+
+# Values are only written to the results files to 2 decimal places
+STORED_RESULTS_ATOL = 0.005 + 1e-9
+
+VALIDATION_FILE = "data/validation/last_season_fish_daily_site_data.csv"
+
+
+def run_legacy_engine(
+    pre_processed_df: pd.DataFrame, period: str, group: str, include_biomass: bool = False
+) -> pd.DataFrame:
+    """
+    Calculate metrics one at a time with the individual calculate_* metric functions,
+    which share none of the aggregation code of the other engines.
+    """
+    daily_dive_numbers_df = determine_number_of_dives_per_period(
+        pre_processed_df[["Date", "Site", "Survey_ID"]], period
+    )
+    daily_df = create_group_daily_df(pre_processed_df, group, include_biomass)
+    daily_with_period_df = daily_df.assign(Period=period_ordinals(daily_df["Date"], period))
+    results_df = prepare_results_df(daily_with_period_df)
+    for function in metric_functions(group, include_biomass).values():
+        results_df = function(daily_with_period_df, results_df, daily_dive_numbers_df)
+    return results_df
+
+
+def run_rollup_engine(
+    pre_processed_df: pd.DataFrame, period: str, group: str, include_biomass: bool = False
+) -> pd.DataFrame:
+    """
+    Calculate metrics by rolling up the daily cube (see rollup.py).
+    """
+    daily_df = create_group_daily_df(pre_processed_df, group, include_biomass)
+    daily_cube = build_daily_cube(daily_df, group, include_biomass)
+    return rollup_cube(daily_cube, build_dive_index(pre_processed_df), period)
+
+
+def run_arrow_engine(
+    pre_processed_df: pd.DataFrame, period: str, group: str, include_biomass: bool = False
+) -> pd.DataFrame:
+    """
+    Calculate metrics with the Arrow compute backend (see arrow_backend.py).
+    """
+    daily_table = create_group_daily_table(pre_processed_df, group, include_biomass)
+    daily_cube = build_daily_cube_table(daily_table, group, include_biomass)
+    return rollup_cube_table(daily_cube, build_dives_table(pre_processed_df), period).to_pandas()
+
+
+# Metric engines that can be compared, each taking the pre-processed survey data,
+# period, group and include_biomass and returning the metrics per Period and Site
+ENGINES = {
+    "legacy": run_legacy_engine,
+    "rollup": run_rollup_engine,
+    "arrow": run_arrow_engine,
+}
+
+
+def compare_frames(
+    expected_df: pd.DataFrame,
+    actual_df: pd.DataFrame,
+    keys: tuple = ("Period", "Site"),
+    rtol: float = 1e-9,
+    atol: float = 1e-9,
+) -> pd.DataFrame:
+    """
+    Compare two tables cell by cell, matching rows on the keys and columns on name.
+    All cells are compared at once with np.isclose, NaNs match NaNs, and rows or
+    metrics missing from either side are reported as differences.
+
+    Parameters:
+    expected_df (pd.DataFrame): The reference table.
+    actual_df (pd.DataFrame): The table to check.
+    keys (tuple): The columns identifying a row.
+    rtol (float): Relative tolerance.
+    atol (float): Absolute tolerance.
+
+    Returns:
+    pd.DataFrame: One row per differing cell with the keys, Metric, Expected, Actual,
+    Abs Diff, Rel Diff and Status ("mismatch", "missing_actual" or "missing_expected").
+    Empty if the tables match.
+    """
+    expected = expected_df.set_index(list(keys))
+    actual = actual_df.set_index(list(keys))
+    metrics = list(dict.fromkeys([*expected.columns, *actual.columns]))
+
+    # Line both tables up on the union of rows and metrics, then compare every cell
+    # at once, row by row
+    index = expected.index.union(actual.index)
+    expected_array = expected.reindex(index=index, columns=metrics).to_numpy(dtype=float).ravel()
+    actual_array = actual.reindex(index=index, columns=metrics).to_numpy(dtype=float).ravel()
+    expected_present = np.outer(index.isin(expected.index), np.isin(metrics, expected.columns)).ravel()
+    actual_present = np.outer(index.isin(actual.index), np.isin(metrics, actual.columns)).ravel()
+    matches = np.isclose(actual_array, expected_array, rtol=rtol, atol=atol, equal_nan=True)
+
+    status = np.select(
+        [
+            expected_present & ~actual_present,
+            actual_present & ~expected_present,
+            expected_present & actual_present & ~matches,
+        ],
+        ["missing_actual", "missing_expected", "mismatch"],
+        default="",
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        abs_diff = np.abs(actual_array - expected_array)
+        rel_diff = abs_diff / np.abs(expected_array)
+    differences_df = pd.DataFrame({
+        "Expected": expected_array,
+        "Actual": actual_array,
+        "Abs Diff": abs_diff,
+        "Rel Diff": rel_diff,
+        "Status": status,
+    })
+    differences_df.insert(0, "Metric", np.tile(metrics, len(index)))
+    key_values = index.to_frame(index=False).loc[np.repeat(np.arange(len(index)), len(metrics))]
+    differences_df = pd.concat([key_values.reset_index(drop=True), differences_df], axis=1)
+    return differences_df[status != ""].reset_index(drop=True)
+
+
+def run_differential_test(
+    pre_processed_df: pd.DataFrame,
+    period: str,
+    group: str,
+    include_biomass: bool = False,
+    baseline: str = "legacy",
+    candidate: str = "rollup",
+    rtol: float = 1e-9,
+    atol: float = 1e-9,
+    repeats: int = 1,
+) -> dict:
+    """
+    Run two metric engines on the same pre-processed data, time them and compare
+    every (Period, Site, metric) cell of their results.
+
+    Parameters:
+    pre_processed_df (pd.DataFrame): The pre-processed survey data.
+    period (str): One of utils.PERIODS.
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to calculate invert biomass metrics.
+    baseline (str): The reference engine, one of ENGINES.
+    candidate (str): The engine to check, one of ENGINES.
+    rtol (float): Relative tolerance.
+    atol (float): Absolute tolerance.
+    repeats (int): Number of timed runs of each engine, the fastest is kept.
+
+    Returns:
+    dict: The seconds each engine took, the speedup of the candidate, the number of
+    cells compared and a DataFrame of every difference (see compare_frames).
+    """
+    for engine in (baseline, candidate):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {list(ENGINES)}.")
+
+    results = {}
+    seconds = {}
+    for engine in (baseline, candidate):
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            results[engine] = ENGINES[engine](pre_processed_df, period, group, include_biomass)
+            elapsed = time.perf_counter() - start_time
+            seconds[engine] = min(elapsed, seconds.get(engine, elapsed))
+
+    # The engines may return rows in different orders, which isn't a difference
+    differences_df = compare_frames(results[baseline], results[candidate], rtol=rtol, atol=atol)
+    return {
+        "group": group,
+        "period": period,
+        "baseline": baseline,
+        "candidate": candidate,
+        "seconds": seconds,
+        "speedup": seconds[baseline] / seconds[candidate],
+        "cells": int(results[baseline].shape[0] * (results[baseline].shape[1] - 2)),
+        "differences": differences_df,
+        "results": results,
+    }
+
+
+def load_stored_results(period: str, group: str) -> pd.DataFrame:
+    """
+    Load every stored site results file of a group and period, with Period ordinals.
+
+    Parameters:
+    period (str): One of utils.PERIODS.
+    group (str): Either fish, inverts or subs.
+
+    Returns:
+    pd.DataFrame: The stored results of all sites.
+    """
+    results_dir = f"{OUTPUT_DIR}/{group}/{period}"
+    sites = sorted(
+        file_name[: -len(".csv")] for file_name in os.listdir(results_dir) if file_name.endswith(".csv")
+    )
+    return load_site_results(sites, period, group)
+
+
+def compare_with_stored_results(
+    results_df: pd.DataFrame,
+    period: str,
+    group: str,
+    rtol: float = 0,
+    atol: float = STORED_RESULTS_ATOL,
+) -> pd.DataFrame:
+    """
+    Compare an engine's results against the results files in data/output. Only the
+    (Period, Site) rows in both are compared, as the stored files may cover a
+    different date range than the input.
+
+    Parameters:
+    results_df (pd.DataFrame): The engine's results, with Period ordinals.
+    period (str): One of utils.PERIODS.
+    group (str): Either fish, inverts or subs.
+    rtol (float): Relative tolerance.
+    atol (float): Absolute tolerance, by default the rounding of the stored files.
+
+    Returns:
+    pd.DataFrame: The differences, as from compare_frames.
+    """
+    stored_results_df = load_stored_results(period, group)
+    stored_keys = pd.MultiIndex.from_frame(stored_results_df[["Period", "Site"]])
+    result_keys = pd.MultiIndex.from_frame(results_df[["Period", "Site"]])
+    return compare_frames(
+        stored_results_df[stored_keys.isin(result_keys)],
+        results_df[result_keys.isin(stored_keys)],
+        rtol=rtol,
+        atol=atol,
+    )
+
+
+def compare_with_fish_reference(
+    reference_file_url: str = VALIDATION_FILE,
+    rtol: float = 1e-6,
+    atol: float = 1e-9,
+) -> pd.DataFrame:
+    """
+    Recalculate the biomass of the reference daily fish data with the current
+    coefficients and compare it to the reference's Total Biomass column.
+
+    Parameters:
+    reference_file_url (str): Path to the reference daily fish data.
+    rtol (float): Relative tolerance.
+    atol (float): Absolute tolerance.
+
+    Returns:
+    pd.DataFrame: The differences per (Date, Site, Species, Size), as from compare_frames.
+    """
+    reference_df = pd.read_csv(reference_file_url)
+    keys = ["Date", "Site", "Species", "Size"]
+    recalculated_df = calculate_biomass(
+        reference_df.drop(columns="Total Biomass"), "data/constants/biomass_coeffs_fish.csv"
+    )
+    return compare_frames(
+        reference_df[keys + ["Total Biomass"]],
+        recalculated_df[keys + ["Total Biomass"]],
+        keys=keys, rtol=rtol, atol=atol,
+    )
+
+
+def print_differential_report(report: dict, max_rows: int = None) -> None:
+    """
+    Print the timings, speedup and every difference of a differential test.
+
+    Parameters:
+    report (dict): A report as returned by run_differential_test.
+    max_rows (int, optional): Only print this many differences.
+    """
+    differences_df = report["differences"]
+    print(
+        f"{report['group']} {report['period']}: {report['baseline']} "
+        f"{report['seconds'][report['baseline']]:.3f}s, {report['candidate']} "
+        f"{report['seconds'][report['candidate']]:.3f}s, speedup {report['speedup']:.2f}x"
+    )
+    if differences_df.empty:
+        print(f"All {report['cells']} cells match")
+        return
+    print(f"{len(differences_df)} of {report['cells']} cells differ:")
+    print(differences_df.head(max_rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run two metric engines on the same survey export and compare every cell."
+    )
+    parser.add_argument("survey_data_file", help="Path to the survey export CSV file")
+    parser.add_argument("group", choices=GROUPS)
+    parser.add_argument("--period", default="seasonal")
+    parser.add_argument("--include-biomass", action="store_true", help="Calculate invert biomass metrics")
+    parser.add_argument("--baseline", choices=list(ENGINES), default="legacy")
+    parser.add_argument("--candidate", choices=list(ENGINES), default="rollup")
+    parser.add_argument("--rtol", type=float, default=1e-9)
+    parser.add_argument("--atol", type=float, default=1e-9)
+    parser.add_argument("--repeats", type=int, default=3, help="Keep the fastest of this many runs")
+    parser.add_argument(
+        "--stored", action="store_true",
+        help="Also compare the candidate with the stored results in data/output",
+    )
+    parser.add_argument(
+        "--fish-reference", action="store_true",
+        help=f"Also check the biomass in {VALIDATION_FILE} against the current coefficients",
+    )
+    parser.add_argument("--report", default=None, help="Save every difference to this JSON file")
+    args = parser.parse_args()
+
+    pre_processed_df = pre_process_data(read_survey_export(args.survey_data_file), args.group)
+    check_all_constants_exist(pre_processed_df, args.group, args.include_biomass)
+    report = run_differential_test(
+        pre_processed_df, args.period, args.group, args.include_biomass,
+        args.baseline, args.candidate, args.rtol, args.atol, args.repeats,
+    )
+    print_differential_report(report)
+    differences = {"engines": report["differences"]}
+
+    if args.stored:
+        differences["stored"] = compare_with_stored_results(
+            report["results"][args.candidate], args.period, args.group
+        )
+        print(f"\n{len(differences['stored'])} cells differ from the stored {args.group} {args.period} results")
+        if len(differences["stored"]):
+            print(differences["stored"].to_string(index=False))
+
+    if args.fish_reference:
+        differences["fish_reference"] = compare_with_fish_reference()
+        print(f"\n{len(differences['fish_reference'])} biomass values differ from {VALIDATION_FILE}")
+        if len(differences["fish_reference"]):
+            print(differences["fish_reference"].to_string(index=False))
+
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump({
+                "group": report["group"],
+                "period": report["period"],
+                "seconds": report["seconds"],
+                "speedup": report["speedup"],
+                "cells": report["cells"],
+                "differences": {
+                    name: json.loads(differences_df.to_json(orient="records"))
+                    for name, differences_df in differences.items()
+                },
+            }, report_file, indent=2)
+        print(f"Saved {args.report}")
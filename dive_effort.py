@@ -0,0 +1,60 @@
+import pandas as pd
+from profiling import profile_stage
+from utils import period_ordinals
+
+# One row of the dive effort index per distinct combination of these columns. Zone and
+# Depth are kept when the source has them, for normalising per zone or depth later
+DIVE_INDEX_COLUMNS = ["Survey_ID", "Date", "Site", "Zone", "Depth"]
+
+
+@profile_stage
+def build_dive_index(survey_data_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Build a group's dive effort index: the distinct dives (Survey_ID, Date, Site and,
+    when present, Zone and Depth) of its survey data. It is built once per group and
+    is orders of magnitude smaller than the observations, so dive counts for any
+    period or date window are a cheap grouping over it.
+
+    Parameters:
+    survey_data_df (pd.DataFrame): Pre-processed survey data, or the dives from
+    stream_survey_data or cached_survey_data (or an existing dive index).
+
+    Returns:
+    pd.DataFrame: One row per dive.
+    """
+    columns = [column for column in DIVE_INDEX_COLUMNS if column in survey_data_df.columns]
+    return survey_data_df[columns].drop_duplicates().reset_index(drop=True)
+
+
+def count_dives(dive_index: pd.DataFrame, period: str, keys: tuple = ("Site",)) -> pd.Series:
+    """
+    Count the distinct dives per period and the keys. With the default keys this is
+    the same as determine_number_of_dives_per_period.
+
+    Parameters:
+    dive_index (pd.DataFrame): The dives from build_dive_index.
+    period (str): One of utils.PERIODS.
+    keys (tuple): The columns to count dives per besides Period, e.g. ("Site", "Depth").
+
+    Returns:
+    pd.Series: The number of dives indexed by (Period, *keys).
+    """
+    periods = period_ordinals(dive_index["Date"], period).rename("Period")
+    return dive_index.groupby([periods, *keys], observed=True)["Survey_ID"].nunique()
+
+
+def count_window_dives(dive_index: pd.DataFrame, start_date, end_date, keys: tuple = ("Site",)) -> pd.Series:
+    """
+    Count the distinct dives per the keys within a custom date window.
+
+    Parameters:
+    dive_index (pd.DataFrame): The dives from build_dive_index.
+    start_date: First date of the window (inclusive), e.g. "2024-12-01".
+    end_date: Last date of the window (inclusive), e.g. "2025-02-28".
+    keys (tuple): The columns to count dives per.
+
+    Returns:
+    pd.Series: The number of dives indexed by the keys.
+    """
+    in_window = dive_index["Date"].between(pd.Timestamp(start_date), pd.Timestamp(end_date))
+    return dive_index[in_window].groupby(list(keys), observed=True)["Survey_ID"].nunique()
@@ -1,163 +1,328 @@
+import numpy as np
 import pandas as pd
+from utils import normalise_by_dives, add_metric_to_results
+from profiling import profile_stage
+from constants import (
+    CONSUMER_CLASSES,
+    load_biomass_coeffs,
+    load_biomass_resolver,
+    load_commercial_species,
+    load_consumer_species,
+)
+from species_resolver import match_species_positions
+
+def lookup_biomass_coeff_positions(species, biomass_coeffs_file_url: str) -> np.ndarray:
+    """
+    Find the biomass coefficients of every species, resolving spellings that differ
+    from the coefficients file (e.g. "Snapper - One-spot") and falling back to the
+    parent's coefficients (e.g. "Grouper" for "Grouper - Other").
+
+    Parameters:
+    species (array-like): The species names, e.g. a Species column.
+    biomass_coeffs_file_url (str): Path to the biomass coefficients CSV file.
+
+    Returns:
+    np.ndarray: The position of each species in the coefficient arrays.
+    """
+    biomass_coeffs = load_biomass_coeffs(biomass_coeffs_file_url)
+    resolver = load_biomass_resolver(biomass_coeffs_file_url)
+    coeff_positions = match_species_positions(
+        biomass_coeffs.species, species, resolver, parent_fallback=True
+    )
+    if (coeff_positions < 0).any():
+        missing_species = set(np.asarray(species, dtype=object)[coeff_positions < 0])
+        raise ValueError(
+            "The following species are missing biomass coefficients:\n"
+            + resolver.describe_missing(missing_species)
+        )
+    return coeff_positions
 
+
+@profile_stage
 def calculate_biomass(daily_data_df: pd.DataFrame, biomass_coeffs_file_url: str) -> pd.DataFrame:
     """
     Calculate the biomass per creature in the dataset.
 
     Parameters:
-    df (pd.DataFrame): The DataFrame containing creature categry and size data per site per day
+    daily_data_df (pd.DataFrame): The DataFrame containing creature category and size data per site per day
+    biomass_coeffs_file_url (str): Path to the biomass coefficients CSV file.
 
     Returns:
     pd.DataFrame: Input dataframe appended with the biomass that each creature row contributes
     """
-    # Read in biomass coefficients
-    biomass_coeffs = pd.read_csv(
-        biomass_coeffs_file_url, index_col="Species"
+    # Join the biomass coefficients against every row in one go
+    biomass_coeffs = load_biomass_coeffs(biomass_coeffs_file_url)
+    coeff_positions = lookup_biomass_coeff_positions(daily_data_df["Species"], biomass_coeffs_file_url)
+    unit_biomass = biomass_coeffs.coeff_a[coeff_positions] * np.power(
+        daily_data_df["Size"].to_numpy(dtype=float), biomass_coeffs.coeff_b[coeff_positions]
     )
 
-    # Replace the lambda function with a nested for loop to calculate biomass
-    biomass_values = []
-    for _, row in daily_data_df.iterrows():
-        coeff_a = biomass_coeffs.loc[row["Species"]]["Coeff_a"]
-        coeff_b = biomass_coeffs.loc[row["Species"]]["Coeff_b"]
-        biomass = row["Total"] * coeff_a * (row["Size"] ** coeff_b)
-        biomass_values.append(biomass)
-
-    daily_data_df["Total Biomass"] = biomass_values
+    daily_data_df["Total Biomass"] = daily_data_df["Total"].to_numpy() * unit_biomass
 
     return daily_data_df
 
-def calculate_total_count_and_density(daily_survey_data_df: pd.DataFrame, results_df: pd.DataFrame, dives_df: pd.DataFrame
+@profile_stage
+def build_species_class_table(group: str, classes: list = CONSUMER_CLASSES) -> pd.DataFrame:
+    """
+    Map every species to the classes it belongs to, reading each constants file once.
+
+    Parameters:
+    group (str): Either fish or inverts, used to determine the file paths for the species names.
+    classes (list): The classes to include. Each class needs a species list in
+    data/constants/<class>_<group>.csv, except "commercial" which reads commercial_fish.csv.
+
+    Returns:
+    pd.DataFrame: A 0/1 membership table indexed by Species with one column per class,
+    e.g. "Herbivore" or "Commercial".
+    """
+    memberships = {}
+    for class_name in classes:
+        if class_name == "commercial":
+            species = load_commercial_species()
+        else:
+            species = load_consumer_species(class_name, group)
+        memberships[class_name.capitalize()] = pd.Series(1.0, index=sorted(species))
+
+    return pd.DataFrame(memberships).fillna(0).rename_axis("Species")
+
+
+def align_species_class_table(species_class_table: pd.DataFrame, species) -> pd.DataFrame:
+    """
+    Look up the class memberships of species, resolving spellings that differ from
+    the consumer lists (e.g. "Snapper - One-spot" for "Snapper - One-Spot").
+
+    Parameters:
+    species_class_table (pd.DataFrame): Membership table as returned by build_species_class_table.
+    species (array-like): The species names, e.g. a Species column.
+
+    Returns:
+    pd.DataFrame: The memberships of each species in order, all 0 for species outside
+    every class.
+    """
+    positions = match_species_positions(species_class_table.index, species)
+    # Unresolved species get position -1, which picks the all 0 row appended last
+    memberships = np.vstack([species_class_table.to_numpy(), np.zeros(species_class_table.shape[1])])
+    return pd.DataFrame(memberships[positions], columns=species_class_table.columns)
+
+
+def is_in_species_list(species, species_list) -> np.ndarray:
+    """
+    Check which species are in a species list (e.g. a consumer list), resolving
+    spellings that differ from the list like align_species_class_table does.
+
+    Parameters:
+    species (array-like): The species names, e.g. a Species column.
+    species_list (iterable): The species names of the list.
+
+    Returns:
+    np.ndarray: Whether each species is in the list.
+    """
+    return match_species_positions(pd.Index(sorted(species_list)), species) >= 0
+
+
+@profile_stage
+def calculate_class_totals(
+    daily_survey_data_df: pd.DataFrame,
+    species_class_table: pd.DataFrame,
+    value_column: str = "Total",
+    suffix: str = "Density",
+    keys: tuple = ("Period", "Site"),
 ) -> pd.DataFrame:
     """
-    Calculate the total creature count and total density for each unique combination of Period and Site.
+    Sum the total and per class values for each unique combination of the keys in a
+    single grouped pass, however many classes there are.
 
     Parameters:
     daily_survey_data_df (pd.DataFrame): The DataFrame containing creature data.
-    results_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
+    species_class_table (pd.DataFrame): Membership table as returned by build_species_class_table.
+    value_column (str): The column to sum, e.g. "Total" or "Total Biomass".
+    suffix (str): Suffix for the output column names, e.g. "Density" gives "Herbivore Density".
+    keys (tuple): The columns to group by.
 
     Returns:
-    pd.DataFrame: A DataFrame with Period, Site, Total Creature]sh Count, and Total Density.
+    pd.DataFrame: Sums indexed by the keys with a "Total <suffix>" column followed by
+    one column per class.
     """
-    # Calculate total creature count per site per day
-    total_count = (
-        daily_survey_data_df.groupby(["Period", "Site"])["Total"]
+    values = daily_survey_data_df[value_column].to_numpy(dtype=float)
+
+    # Weight each row by its class memberships, species outside every class count as 0
+    memberships = align_species_class_table(species_class_table, daily_survey_data_df["Species"]).to_numpy()
+    weighted_values = np.column_stack([values, memberships * values[:, np.newaxis]])
+    columns = [f"Total {suffix}"] + [f"{name} {suffix}" for name in species_class_table.columns]
+
+    return (
+        pd.DataFrame(weighted_values, columns=columns, index=daily_survey_data_df.index)
+        .groupby([daily_survey_data_df[key] for key in keys], observed=True)
         .sum()
-        .reset_index()
-        .rename(columns={"Total": "Total Count"})
     )
 
-    # Calculate total density by dividing total creature count by the number of dives
-    total_count["Total Density"] = total_count.apply(
-        lambda row: row["Total Count"] / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
+
+@profile_stage
+def calculate_class_densities(
+    daily_survey_data_df: pd.DataFrame,
+    dives_df: pd.DataFrame,
+    species_class_table: pd.DataFrame,
+    value_column: str = "Total",
+    suffix: str = "Density",
+) -> pd.DataFrame:
+    """
+    Calculate the total and per class densities for each unique combination of Period
+    and Site in a single grouped pass, however many classes there are.
+
+    Parameters:
+    daily_survey_data_df (pd.DataFrame): The DataFrame containing creature data with Period.
+    dives_df (pd.DataFrame): The number of dives per Period and Site.
+    species_class_table (pd.DataFrame): Membership table as returned by build_species_class_table.
+    value_column (str): The column to sum, e.g. "Total" or "Total Biomass".
+    suffix (str): Suffix for the output column names, e.g. "Density" gives "Herbivore Density".
+
+    Returns:
+    pd.DataFrame: Densities indexed by (Period, Site) with a "Total <suffix>" column
+    followed by one column per class.
+    """
+    class_totals = calculate_class_totals(
+        daily_survey_data_df, species_class_table, value_column, suffix
     )
-    results_df["Total Density"] = total_count["Total Density"]
-    return results_df
+    return normalise_by_dives(class_totals, dives_df)
+
+
+@profile_stage
+def calculate_total_count_and_density(daily_survey_data_df: pd.DataFrame, results_df: pd.DataFrame, dives_df: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Calculate the total creature count and total density for each unique combination of Period and Site.
+
+    Parameters:
+    daily_survey_data_df (pd.DataFrame): The DataFrame containing creature data.
+    results_df (pd.DataFrame): The DataFrame with one row per Period and Site.
+    dives_df (pd.DataFrame): The number of dives per Period and Site.
+
+    Returns:
+    pd.DataFrame: The results DataFrame with Total Density added.
+    """
+    # Calculate total creature count per site per period
+    total_count = daily_survey_data_df.groupby(["Period", "Site"], observed=True)["Total"].sum()
+
+    # Calculate total density by dividing total creature count by the number of dives
+    total_density = normalise_by_dives(total_count, dives_df)
+    return add_metric_to_results(results_df, total_density, "Total Density")
 
+@profile_stage
 def calculate_commercial_count_and_density(daily_fish_data_df: pd.DataFrame, results_df: pd.DataFrame, dives_df: pd.DataFrame
 ) -> pd.DataFrame:
     """
-    Calculate the total fish count and total density for each unique combination of Period and Site.
+    Calculate the commercial fish density for each unique combination of Period and Site.
 
     Parameters:
     daily_fish_data_df (pd.DataFrame): The DataFrame containing fish data.
-    results_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
+    results_df (pd.DataFrame): The DataFrame with one row per Period and Site.
+    dives_df (pd.DataFrame): The number of dives per Period and Site.
 
     Returns:
-    pd.DataFrame: A DataFrame with Period, Site, Total Fish Count, and Total Density.
+    pd.DataFrame: The results DataFrame with Commercial Density added.
     """
-    # Read in commercial fish names
-    commercial_fish_names = (
-        pd.read_csv("data/constants/commercial_fish.csv", header=None)
-        .squeeze()
-        .tolist()
-    )
-    # Count total fish per site per day that are commercial
+    is_commercial = is_in_species_list(daily_fish_data_df["Species"], load_commercial_species())
+    # Count total fish per site per period that are commercial
     commercial_count = (
-        daily_fish_data_df[daily_fish_data_df["Species"].isin(commercial_fish_names)]
-        .groupby(["Period", "Site"])["Total"]
+        daily_fish_data_df[is_commercial]
+        .groupby(["Period", "Site"], observed=True)["Total"]
         .sum()
-        .reset_index()
-        .rename(columns={"Total": "Commercial Count"})
     )
 
     # Calculate commercial density by dividing total fish count by the number of dives
-    commercial_count["Commercial Density"] = commercial_count.apply(
-        lambda row: row["Commercial Count"] / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    results_df["Commercial Density"] = commercial_count["Commercial Density"]
-    return results_df
+    commercial_density = normalise_by_dives(commercial_count, dives_df)
+    return add_metric_to_results(results_df, commercial_density, "Commercial Density")
 
+@profile_stage
 def calculate_total_biomass_and_density(daily_survey_data_df: pd.DataFrame, results_df: pd.DataFrame, dives_df: pd.DataFrame
 ) -> pd.DataFrame:
     """
-    Calculate the total and normalised biomass and commercial biomass for each unique 
-    combination of Period and Site. Divide by 1000
+    Calculate the normalised total biomass for each unique combination of Period and Site.
+    Divide by 1000
 
     Parameters:
     daily_survey_data_df (pd.DataFrame): The DataFrame containing creature data.
-    results_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
+    results_df (pd.DataFrame): The DataFrame with one row per Period and Site.
+    dives_df (pd.DataFrame): The number of dives per Period and Site.
 
     Returns:
-    pd.DataFrame: A DataFrame with Period, Site, Total Biomass, and Total Density.
+    pd.DataFrame: The results DataFrame with Total Biomass Density added.
     """
-    # Calculate total biomass per site per day
-    total_biomass = (
-        daily_survey_data_df.groupby(["Period", "Site"])["Total Biomass"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Total Biomass": "Total Biomass"})
-    )
-    total_biomass["Total Biomass"] = total_biomass["Total Biomass"] / 1000  # Convert from g/ha^2 to g/m^2 
+    # Calculate total biomass per site per period
+    total_biomass = daily_survey_data_df.groupby(["Period", "Site"], observed=True)["Total Biomass"].sum()
+    total_biomass = total_biomass / 1000  # Convert from g/ha^2 to g/m^2
 
     # Calculate total biomass density by dividing total biomass by the number of dives
-    total_biomass["Total Biomass Density"] = total_biomass.apply(
-        lambda row: row["Total Biomass"] / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    results_df["Total Biomass Density"] = total_biomass["Total Biomass Density"]
-    return results_df
+    total_biomass_density = normalise_by_dives(total_biomass, dives_df)
+    return add_metric_to_results(results_df, total_biomass_density, "Total Biomass Density")
 
 
+@profile_stage
 def calculate_commercial_biomass(
     daily_fish_data_df: pd.DataFrame, results_df: pd.DataFrame, dives_df: pd.DataFrame
 ) -> pd.DataFrame:
     """
-    Calculate the total commercial biomass for each unique combination of Period and Site.
+    Calculate the normalised commercial biomass for each unique combination of Period and Site.
 
     Parameters:
     daily_fish_data_df (pd.DataFrame): The DataFrame containing fish data.
-    commercial_fish_names (list): A list of species names considered commercial.
+    results_df (pd.DataFrame): The DataFrame with one row per Period and Site.
+    dives_df (pd.DataFrame): The number of dives per Period and Site.
 
     Returns:
-    pd.DataFrame: A DataFrame with Period, Site, and the summed commercial biomass.
+    pd.DataFrame: The results DataFrame with Commercial Biomass Density added.
     """
-    commercial_fish_names = (
-        pd.read_csv("data/constants/commercial_fish.csv", header=None)
-        .squeeze()
-        .tolist()
-    )
-    # Calculate commercial biomass per site per day
+    is_commercial = is_in_species_list(daily_fish_data_df["Species"], load_commercial_species())
+    # Calculate commercial biomass per site per period
     commercial_biomass = (
-        daily_fish_data_df[daily_fish_data_df["Species"].isin(commercial_fish_names)]
-        .groupby(["Period", "Site"])["Total Biomass"]
+        daily_fish_data_df[is_commercial]
+        .groupby(["Period", "Site"], observed=True)["Total Biomass"]
         .sum()
-        .reset_index()
-        .rename(columns={"Total Biomass": "Commercial Biomass"})
     )
+    commercial_biomass = commercial_biomass / 1000  # Convert to kg
 
-    commercial_biomass["Commercial Biomass"] = commercial_biomass["Commercial Biomass"] / 1000  # Convert to kg
+    # Calculate commercial biomass density by dividing by the number of dives
+    commercial_biomass_density = normalise_by_dives(commercial_biomass, dives_df)
+    return add_metric_to_results(
+        results_df, commercial_biomass_density, "Commercial Biomass Density"
+    )
 
-    # Calculate commercial density by dividing total fish count by the number of dives
-    commercial_biomass["Commercial Biomass Density"] = commercial_biomass.apply(
-        lambda row: row["Commercial Biomass"] / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
+
+@profile_stage
+def calculate_consumer_density(
+    daily_survey_data_df: pd.DataFrame,
+    results_df: pd.DataFrame,
+    dives_df: pd.DataFrame,
+    group: str,
+    consumer: str
+) -> pd.DataFrame:
+    """
+    Calculate the density of one consumer class (e.g. herbivore) for each unique
+    combination of Period and Site.
+
+    Parameters:
+    daily_survey_data_df (pd.DataFrame): The DataFrame containing creature data.
+    results_df (pd.DataFrame): The DataFrame with one row per Period and Site.
+    dives_df (pd.DataFrame): The number of dives per Period and Site.
+    group (str): Either fish or inverts, used to determine the file path for the species names.
+    consumer (str): The consumer class, e.g. herbivore, carnivore, omnivore, detritivore or corallivore.
+
+    Returns:
+    pd.DataFrame: The results DataFrame with the consumer density added after Period and Site.
+    """
+    is_consumer = is_in_species_list(daily_survey_data_df["Species"], load_consumer_species(consumer, group))
+    # Calculate consumer total counts per site per period
+    consumer_count = (
+        daily_survey_data_df[is_consumer]
+        .groupby(["Period", "Site"], observed=True)["Total"]
+        .sum()
+    )
+
+    # Divide consumer total counts by the number of dives to get consumer density
+    consumer_density = normalise_by_dives(consumer_count, dives_df)
+    return add_metric_to_results(
+        results_df, consumer_density, f"{consumer.capitalize()} Density", loc=2
     )
-    
-    results_df["Commercial Biomass Density"] = commercial_biomass["Commercial Biomass Density"]
-    return results_df
 
 
 def calculate_herbivore_density(
@@ -171,33 +336,14 @@ def calculate_herbivore_density(
 
     Parameters:
     daily_survey_data_df (pd.DataFrame): The DataFrame containing fish data.
-    herbivores (list): A list of species names considered herbivores.
+    results_df (pd.DataFrame): The DataFrame with one row per Period and Site.
     dives_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
     group (str): Either fish or inverts, used to determine the file path for herbivore fish names.
 
     Returns:
-    pd.DataFrame: A DataFrame with Period, Site, and the summed herbivore density.
+    pd.DataFrame: The results DataFrame with Herbivore Density added.
     """
-    herbivores = (
-        pd.read_csv(f"data/constants/herbivore_{group}.csv", header=None).loc[:,0].tolist()
-    )
-    # Calculate herbivore total counts per site per day
-    herbivore_density = (
-        daily_survey_data_df[daily_survey_data_df["Species"].isin(herbivores)]
-        .groupby(["Period", "Site"])["Total"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Total": "Herbivore Density"})
-    )
-
-    # Divide Herbivore total counts by the number of dives to get Herbivore Density
-    herbivore_density["Herbivore Density"] = herbivore_density.apply(
-        lambda row: row["Herbivore Density"]
-        / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-
-    return pd.merge(herbivore_density, results_df, "right").fillna(0)
+    return calculate_consumer_density(daily_survey_data_df, results_df, dives_df, group, "herbivore")
 
 
 def calculate_carnivore_density(
@@ -206,22 +352,7 @@ def calculate_carnivore_density(
     dives_df: pd.DataFrame,
     group: str
 ) -> pd.DataFrame:
-    carnivores = (
-        pd.read_csv(f"data/constants/carnivore_{group}.csv", header=None).loc[:,0].tolist()
-    )
-    carnivore_density = (
-        daily_survey_data_df[daily_survey_data_df["Species"].isin(carnivores)]
-        .groupby(["Period", "Site"])["Total"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Total": "Carnivore Density"})
-    )
-    carnivore_density["Carnivore Density"] = carnivore_density.apply(
-        lambda row: row["Carnivore Density"]
-        / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    return pd.merge(carnivore_density, results_df, "right").fillna(0)
+    return calculate_consumer_density(daily_survey_data_df, results_df, dives_df, group, "carnivore")
 
 
 def calculate_omnivore_density(
@@ -230,22 +361,7 @@ def calculate_omnivore_density(
     dives_df: pd.DataFrame,
     group: str
 ) -> pd.DataFrame:
-    omnivores = (
-        pd.read_csv(f"data/constants/omnivore_{group}.csv", header=None).loc[:,0].tolist()
-    )
-    omnivore_density = (
-        daily_survey_data_df[daily_survey_data_df["Species"].isin(omnivores)]
-        .groupby(["Period", "Site"])["Total"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Total": "Omnivore Density"})
-    )
-    omnivore_density["Omnivore Density"] = omnivore_density.apply(
-        lambda row: row["Omnivore Density"]
-        / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    return pd.merge(omnivore_density, results_df, "right").fillna(0)
+    return calculate_consumer_density(daily_survey_data_df, results_df, dives_df, group, "omnivore")
 
 
 def calculate_detritivore_density(
@@ -254,23 +370,7 @@ def calculate_detritivore_density(
     dives_df: pd.DataFrame,
     group: str
 ) -> pd.DataFrame:
-    detritivores = (
-        pd.read_csv(f"data/constants/detritivore_{group}.csv", header=None)
-        .loc[:,0].tolist()
-    )
-    detritivore_density = (
-        daily_survey_data_df[daily_survey_data_df["Species"].isin(detritivores)]
-        .groupby(["Period", "Site"])["Total"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Total": "Detritivore Density"})
-    )
-    detritivore_density["Detritivore Density"] = detritivore_density.apply(
-        lambda row: row["Detritivore Density"]
-        / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    return pd.merge(detritivore_density, results_df, "right").fillna(0)
+    return calculate_consumer_density(daily_survey_data_df, results_df, dives_df, group, "detritivore")
 
 
 def calculate_corallivore_density(
@@ -279,17 +379,4 @@ def calculate_corallivore_density(
     dives_df: pd.DataFrame,
     group: str
 ) -> pd.DataFrame:
-    corallivores = pd.read_csv(f"data/constants/corallivore_{group}.csv", header=None).loc[:,0].tolist()
-    corallivore_density = (
-        daily_survey_data_df[daily_survey_data_df["Species"].isin(corallivores)]
-        .groupby(["Period", "Site"])["Total"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Total": "Corallivore Density"})
-    )
-    corallivore_density["Corallivore Density"] = corallivore_density.apply(
-        lambda row: row["Corallivore Density"]
-        / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    return pd.merge(corallivore_density, results_df, "right").fillna(0)
+    return calculate_consumer_density(daily_survey_data_df, results_df, dives_df, group, "corallivore")
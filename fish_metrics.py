@@ -1,137 +1,87 @@
 import pandas as pd
-from utils import prepare_results_df, add_periods, create_daily_df
+from utils import prepare_results_df, period_ordinals, create_daily_df
+from profiling import profile_stage
 from fish_and_inverts_shared_metrics import (
-    calculate_total_count_and_density,
-    calculate_biomass,  
-    calculate_total_biomass_and_density,
-    calculate_herbivore_density,
-    calculate_carnivore_density,
-    calculate_omnivore_density,
-    calculate_detritivore_density,
-    calculate_corallivore_density,
-    calculate_biomass
+    CONSUMER_CLASSES,
+    calculate_biomass,
+    build_species_class_table,
+    calculate_class_densities,
 )
 
-
-def calculate_fish_metrics(
-    pre_processed_fish_data_df: pd.DataFrame,
-    daily_dive_numbers_df: pd.DataFrame,
-    period: str,
-) -> pd.DataFrame:
+# Output columns, in the order they are written to the results files
+FISH_METRIC_COLUMNS = [
+    "Corallivore Density",
+    "Detritivore Density",
+    "Omnivore Density",
+    "Carnivore Density",
+    "Herbivore Density",
+    "Total Density",
+    "Commercial Density",
+    "Total Biomass Density",
+    "Commercial Biomass Density",
+]
+
+
+@profile_stage
+def create_daily_fish_df(pre_processed_fish_data_df: pd.DataFrame) -> pd.DataFrame:
     """
-    Calculate various fish metrics for each unique combination of Period and Site, or aggregated by month or season.
+    Aggregate the fish data per day, site, species and size and add the biomass of each
+    row. This doesn't depend on the period, so it can be shared across periods.
 
     Parameters:
-    daily_fish_data_df (pd.DataFrame): The DataFrame containing fish data.
-    daily_dive_numbers_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
-    period (str): The period for aggregation. Options are "daily", "monthly", or "seasonal".
+    pre_processed_fish_data_df (pd.DataFrame): The pre-processed (or daily) fish data.
 
     Returns:
-    pd.DataFrame: A DataFrame with aggregated metrics based on the specified period.
+    pd.DataFrame: The daily fish data with a Total Biomass column.
     """
     daily_fish_data_df = create_daily_df(pre_processed_fish_data_df, "fish")
-    daily_fish_data_df = calculate_biomass(daily_fish_data_df, "data/constants/biomass_coeffs_fish.csv")
-    daily_fish_data_df = add_periods(daily_fish_data_df, period)
-
-    results_df = prepare_results_df(daily_fish_data_df)
-    results_df = calculate_total_count_and_density(
-        daily_fish_data_df, results_df, daily_dive_numbers_df
-    )
-    results_df = calculate_commercial_count_and_density(
-        daily_fish_data_df, results_df, daily_dive_numbers_df
-    )
-    results_df = calculate_total_biomass_and_density(daily_fish_data_df, results_df, daily_dive_numbers_df)
-    results_df = calculate_commercial_biomass(daily_fish_data_df, results_df, daily_dive_numbers_df)
-    results_df = calculate_herbivore_density(
-        daily_fish_data_df, results_df, daily_dive_numbers_df, "fish"
-    )
-    results_df = calculate_carnivore_density(
-        daily_fish_data_df, results_df, daily_dive_numbers_df, "fish"
-    )
-    results_df = calculate_omnivore_density(
-        daily_fish_data_df, results_df, daily_dive_numbers_df, "fish"
-    )
-    results_df = calculate_detritivore_density(
-        daily_fish_data_df, results_df, daily_dive_numbers_df, "fish"
-    )
-    results_df = calculate_corallivore_density(
-        daily_fish_data_df, results_df, daily_dive_numbers_df, "fish"
-    )
+    return calculate_biomass(daily_fish_data_df, "data/constants/biomass_coeffs_fish.csv")
 
-    return results_df.groupby(["Period", "Site"]).sum().reset_index()
 
-
-def calculate_commercial_count_and_density(daily_fish_data_df: pd.DataFrame, results_df: pd.DataFrame, dives_df: pd.DataFrame
+@profile_stage
+def calculate_fish_metrics(
+    pre_processed_fish_data_df: pd.DataFrame,
+    daily_dive_numbers_df: pd.DataFrame,
+    period: str,
+    daily_fish_data_df: pd.DataFrame = None,
 ) -> pd.DataFrame:
     """
-    Calculate the total fish count and total density for each unique combination of Period and Site.
+    Calculate various fish metrics for each unique combination of Period and Site, or aggregated by month or season.
 
     Parameters:
-    daily_fish_data_df (pd.DataFrame): The DataFrame containing fish data.
-    results_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
+    pre_processed_fish_data_df (pd.DataFrame): The DataFrame containing fish data.
+    daily_dive_numbers_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
+    period (str): The period for aggregation. Options are "monthly" or "seasonal".
+    daily_fish_data_df (pd.DataFrame, optional): The output of create_daily_fish_df, to
+    reuse it across periods. Calculated from pre_processed_fish_data_df if None.
 
     Returns:
-    pd.DataFrame: A DataFrame with Period, Site, Total Fish Count, and Total Density.
+    pd.DataFrame: A DataFrame with aggregated metrics based on the specified period.
     """
-    # Read in commercial fish names
-    commercial_fish_names = (
-        pd.read_csv("data/constants/commercial_fish.csv", header=None)
-        .squeeze()
-        .tolist()
-    )
-    # Count total fish per site per day that are commercial
-    commercial_count = (
-        daily_fish_data_df[daily_fish_data_df["Species"].isin(commercial_fish_names)]
-        .groupby(["Period", "Site"])["Total"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Total": "Commercial Count"})
+    if daily_fish_data_df is None:
+        daily_fish_data_df = create_daily_fish_df(pre_processed_fish_data_df)
+    daily_fish_data_df = daily_fish_data_df.assign(
+        Period=period_ordinals(daily_fish_data_df["Date"], period)
     )
 
-    # Calculate commercial density by dividing total fish count by the number of dives
-    commercial_count["Commercial Density"] = commercial_count.apply(
-        lambda row: row["Commercial Count"] / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    results_df["Commercial Density"] = commercial_count["Commercial Density"]
-    return results_df
+    # Map each species to its consumer classes and commercial flag once
+    species_class_table = build_species_class_table("fish", CONSUMER_CLASSES + ["commercial"])
 
-def calculate_commercial_biomass(
-    daily_fish_data_df: pd.DataFrame, results_df: pd.DataFrame, dives_df: pd.DataFrame
-) -> pd.DataFrame:
-    """
-    Calculate the total commercial biomass for each unique combination of Period and Site.
-
-    Parameters:
-    daily_fish_data_df (pd.DataFrame): The DataFrame containing fish data.
-    commercial_fish_names (list): A list of species names considered commercial.
-
-    Returns:
-    pd.DataFrame: A DataFrame with Period, Site, and the summed commercial biomass.
-    """
-    commercial_fish_names = (
-        pd.read_csv("data/constants/commercial_fish.csv", header=None)
-        .squeeze()
-        .tolist()
+    # Count densities for every class in one pass, then commercial biomass in another
+    count_densities = calculate_class_densities(
+        daily_fish_data_df, daily_dive_numbers_df, species_class_table
     )
-    # Calculate commercial biomass per site per day
-    commercial_biomass = (
-        daily_fish_data_df[daily_fish_data_df["Species"].isin(commercial_fish_names)]
-        .groupby(["Period", "Site"])["Total Biomass"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Total Biomass": "Commercial Biomass"})
-    )
-
-    commercial_biomass["Commercial Biomass"] = commercial_biomass["Commercial Biomass"] / 1000  # Convert to kg
+    biomass_densities = calculate_class_densities(
+        daily_fish_data_df,
+        daily_dive_numbers_df,
+        species_class_table[["Commercial"]],
+        value_column="Total Biomass",
+        suffix="Biomass Density",
+    ) / 1000  # Convert from g/ha^2 to g/m^2
 
-    # Calculate commercial density by dividing total fish count by the number of dives
-    commercial_biomass["Commercial Biomass Density"] = commercial_biomass.apply(
-        lambda row: row["Commercial Biomass"] / dives_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    
-    results_df["Commercial Biomass Density"] = commercial_biomass["Commercial Biomass Density"]
-    return results_df
+    results_df = prepare_results_df(daily_fish_data_df)
+    results_df = results_df.join(
+        count_densities.join(biomass_densities)[FISH_METRIC_COLUMNS], on=["Period", "Site"]
+    ).fillna(0)
 
-    
+    return results_df.groupby(["Period", "Site"], observed=True).sum().reset_index()
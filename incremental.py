@@ -0,0 +1,120 @@
+import argparse
+
+import pandas as pd
+from pre_processing import pre_process_data
+from pipeline import calculate_group_metrics, check_all_constants_exist
+from results_store import list_stored_sites, read_results_store, write_results_store
+from dive_effort import build_dive_index
+from utils import (
+    GROUPS,
+    PERIODS,
+    add_periods,
+    determine_number_of_dives_per_period,
+    load_site_results,
+    parse_period_label,
+    save_site_dataframes,
+)
+
+
+def load_store_results(sites, period: str, group: str) -> pd.DataFrame:
+    """
+    Load the results of the given sites from the Parquet results store, which unlike
+    the CSV files holds unrounded values, with Period as ordinals.
+
+    Parameters:
+    sites (iterable): The sites to load. Sites without results in the store are skipped.
+    period (str): One of utils.PERIODS.
+    group (str): Either fish, inverts or subs.
+
+    Returns:
+    pd.DataFrame: The stored results of the sites, or an empty DataFrame if there are none.
+    """
+    stored_sites = set(list_stored_sites(group, period))
+    sites = [site for site in sites if site in stored_sites]
+    if not sites:
+        return pd.DataFrame(columns=["Period", "Site"])
+
+    store_results_df = read_results_store(group, period, sites)
+    store_results_df["Period"] = store_results_df["Period"].astype(str).map(
+        lambda label: parse_period_label(label, period)
+    )
+    return store_results_df
+
+
+def update_results_incrementally(
+    delta_survey_data_df: pd.DataFrame,
+    period: str,
+    group: str,
+    include_biomass: bool = False,
+) -> pd.DataFrame:
+    """
+    Update the stored per site results with a delta export (e.g. one new season),
+    recomputing only the (Period, Site) combinations the delta touches.
+
+    Rows for those combinations are replaced in the stored results, so a delta must
+    contain every survey of the periods it covers. Periods and sites it doesn't
+    touch are kept as they are, and only the touched sites' files are rewritten.
+
+    Parameters:
+    delta_survey_data_df (pd.DataFrame): The raw survey data of the delta export.
+    period (str): One of utils.PERIODS.
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to calculate invert biomass metrics.
+
+    Returns:
+    pd.DataFrame: The recomputed results for the touched (Period, Site) combinations.
+    """
+    pre_processed_df = pre_process_data(delta_survey_data_df, group)
+    check_all_constants_exist(pre_processed_df, group, include_biomass)
+
+    dive_index = build_dive_index(pre_processed_df)
+    daily_dive_numbers_df = determine_number_of_dives_per_period(dive_index, period)
+    delta_results_df = calculate_group_metrics(
+        pre_processed_df, daily_dive_numbers_df, period, group, include_biomass
+    )
+
+    # Replace the stored rows of every (Period, Site) the delta was exported for
+    touched_sites = delta_results_df["Site"].unique()
+    stored_results_df = load_site_results(touched_sites, period, group)
+    touched_keys = pd.MultiIndex.from_frame(add_periods(dive_index, period)[["Period", "Site"]])
+    stored_keys = pd.MultiIndex.from_frame(stored_results_df[["Period", "Site"]])
+    kept_results_df = stored_results_df[~stored_keys.isin(touched_keys)]
+
+    merged_results_df = pd.concat([kept_results_df, delta_results_df], ignore_index=True)
+    save_site_dataframes(merged_results_df, period, group)
+
+    # The touched sites' store partitions are rewritten from the store's own unrounded
+    # rows, and only sites missing from the store fall back to the rounded CSV rows
+    store_results_df = load_store_results(touched_sites, period, group)
+    store_results_df = pd.concat([
+        store_results_df,
+        stored_results_df[~stored_results_df["Site"].isin(store_results_df["Site"].unique())],
+    ], ignore_index=True)
+    store_keys = pd.MultiIndex.from_frame(store_results_df[["Period", "Site"]])
+    write_results_store(
+        pd.concat([store_results_df[~store_keys.isin(touched_keys)], delta_results_df], ignore_index=True),
+        period,
+        group,
+        remove_stale_sites=False,
+    )
+    print(
+        f"Replaced {len(stored_results_df) - len(kept_results_df)} and added "
+        f"{len(delta_results_df) - (len(stored_results_df) - len(kept_results_df))} "
+        f"{group} {period} rows across {len(touched_sites)} sites"
+    )
+    return delta_results_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Update the stored results with a delta survey export."
+    )
+    parser.add_argument("delta_file", help="Path to the delta survey export CSV file")
+    parser.add_argument("group", choices=GROUPS)
+    parser.add_argument("--period", choices=PERIODS, default="seasonal")
+    parser.add_argument("--include-biomass", action="store_true", help="Calculate invert biomass metrics")
+    args = parser.parse_args()
+
+    update_results_incrementally(
+        pd.read_csv(args.delta_file), args.period, args.group, args.include_biomass
+    )
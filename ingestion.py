@@ -0,0 +1,133 @@
+from typing import Iterator
+
+import pandas as pd
+from pre_processing import pre_process_data
+from profiling import profile_stage
+from utils import create_daily_df
+from dive_effort import build_dive_index
+
+# Number of raw survey rows read at a time when streaming an export
+DEFAULT_CHUNKSIZE = 200_000
+
+# Explicit dtypes for the columns each group's metrics and dive effort index need.
+# Observer names, diver counts and the other dive conditions are never read. Date
+# is parsed separately.
+SURVEY_SCHEMAS = {
+    "fish": {
+        "Site": "category",
+        "Zone": "Int8",
+        "Depth": "category",
+        "Species": "category",
+        "Size": "category",
+        "Total": "Int32",
+        "Survey_Status": "Int8",
+        "Survey_ID": "category",
+    },
+    "inverts": {
+        "Site": "category",
+        "Zone": "Int8",
+        "Depth": "category",
+        "Species": "category",
+        "Size": "category",
+        "Total": "Int32",
+        "Survey_Status": "Int8",
+        "Survey_ID": "category",
+    },
+    "subs": {
+        "Site": "category",
+        "Zone": "Int8",
+        "Depth": "category",
+        "Group": "category",
+        "Status": "category",
+        "Total": "Int32",
+        "Survey_Status": "Int8",
+        "Survey_ID": "category",
+    },
+}
+
+
+@profile_stage
+def read_survey_export(survey_data_file_url: str) -> pd.DataFrame:
+    """
+    Read a whole survey export into memory.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+
+    Returns:
+    pd.DataFrame: The raw survey data.
+    """
+    return pd.read_csv(survey_data_file_url)
+
+
+def read_survey_chunks(
+    survey_data_file_url: str, group: str, chunksize: int = DEFAULT_CHUNKSIZE
+) -> Iterator[pd.DataFrame]:
+    """
+    Read a survey export in bounded chunks with an explicit schema, skipping every
+    column the metrics don't use.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+    group (str): Either fish, inverts or subs.
+    chunksize (int): Maximum number of rows per chunk.
+
+    Returns:
+    Iterator[pd.DataFrame]: The typed chunks of raw survey data.
+    """
+    schema = SURVEY_SCHEMAS[group]
+    return pd.read_csv(
+        survey_data_file_url,
+        usecols=lambda column: column == "Date" or column in schema,
+        dtype=schema,
+        parse_dates=["Date"],
+        chunksize=chunksize,
+    )
+
+
+@profile_stage
+def stream_survey_data(
+    survey_data_file_url: str, group: str, chunksize: int = DEFAULT_CHUNKSIZE
+) -> tuple:
+    """
+    Stream a survey export chunk by chunk, pre-processing each chunk and folding it
+    into running daily aggregates, so memory depends on the number of distinct
+    (Date, Site, Species, Size) keys rather than the number of raw rows.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+    group (str): Either fish, inverts or subs.
+    chunksize (int): Maximum number of raw rows held in memory at a time.
+
+    Returns:
+    tuple: The daily DataFrame (as from create_daily_df), which can be passed to the
+    calculate_*_metrics functions in place of the pre-processed data, and the dive
+    effort index (see build_dive_index), which can be passed to
+    determine_number_of_dives_per_period.
+    """
+    daily_df = None
+    dives_df = None
+    for chunk in read_survey_chunks(survey_data_file_url, group, chunksize):
+        # Survey_ID codes would clash between chunks, and the schema already reads
+        # the string columns as categoricals
+        pre_processed_chunk = pre_process_data(chunk, group, verbose=False, compact=False)
+
+        # Partial aggregates for this chunk, with plain string keys so they can be
+        # combined with the aggregates of chunks that saw different categories
+        chunk_daily_df = _decategorise(create_daily_df(pre_processed_chunk, group))
+        chunk_dives_df = _decategorise(build_dive_index(pre_processed_chunk))
+
+        if daily_df is None:
+            daily_df, dives_df = chunk_daily_df, chunk_dives_df
+        else:
+            daily_df = create_daily_df(pd.concat([daily_df, chunk_daily_df]), group)
+            dives_df = pd.concat([dives_df, chunk_dives_df]).drop_duplicates()
+
+    if daily_df is None:
+        raise ValueError(f"No survey data found in {survey_data_file_url}")
+    return daily_df, dives_df.reset_index(drop=True)
+
+
+def _decategorise(survey_data_df: pd.DataFrame) -> pd.DataFrame:
+    categorical_columns = survey_data_df.select_dtypes("category").columns
+    return survey_data_df.astype({column: object for column in categorical_columns})
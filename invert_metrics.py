@@ -1,66 +1,96 @@
 import pandas as pd
-from utils import prepare_results_df, add_periods, create_daily_df
+from utils import prepare_results_df, period_ordinals, create_daily_df
+from profiling import profile_stage
 from fish_and_inverts_shared_metrics import (
+    CONSUMER_CLASSES,
     calculate_biomass,
-    calculate_total_biomass_and_density,
-    calculate_total_count_and_density, 
-    calculate_herbivore_density,
-    calculate_carnivore_density,
-    calculate_omnivore_density,
-    calculate_detritivore_density,
-    calculate_corallivore_density
+    build_species_class_table,
+    calculate_class_densities,
 )
 
+# Output columns, in the order they are written to the results files
+INVERTS_METRIC_COLUMNS = [
+    "Corallivore Density",
+    "Detritivore Density",
+    "Omnivore Density",
+    "Carnivore Density",
+    "Herbivore Density",
+    "Total Density",
+]
+
+
+@profile_stage
+def create_daily_inverts_df(
+    pre_processed_inverts_data_df: pd.DataFrame, include_biomass: bool
+) -> pd.DataFrame:
+    """
+    Aggregate the inverts data per day, site, species and size, adding the biomass of
+    each row if include_biomass is True. This doesn't depend on the period, so it can
+    be shared across periods.
+
+    Parameters:
+    pre_processed_inverts_data_df (pd.DataFrame): The pre-processed (or daily) inverts data.
+    include_biomass (bool): True/False indicating whether or not to calculate biomass
+
+    Returns:
+    pd.DataFrame: The daily inverts data.
+    """
+    daily_inverts_data_df = create_daily_df(pre_processed_inverts_data_df, "inverts")
+    # TODO: Remove this boolean when biomass coeficients for inverts become available
+    if include_biomass:
+        daily_inverts_data_df = calculate_biomass(daily_inverts_data_df, "data/constants/biomass_coeffs_inverts.csv")
+    return daily_inverts_data_df
+
+
+@profile_stage
 def calculate_inverts_metrics(
     pre_processed_inverts_data_df: pd.DataFrame,
     daily_dive_numbers_df: pd.DataFrame,
     period: str,
-    include_biomass: bool
+    include_biomass: bool,
+    daily_inverts_data_df: pd.DataFrame = None,
 ) -> pd.DataFrame:
     """
     Calculate various inverts metrics for each unique combination of Period and Site, or aggregated by month or season.
 
     Parameters:
-    daily_inverts_data_df (pd.DataFrame): The DataFrame containing inverts data.
+    pre_processed_inverts_data_df (pd.DataFrame): The DataFrame containing inverts data.
     daily_dive_numbers_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
-    period (str): The period for aggregation. Options are "daily", "monthly", or "seasonal".
+    period (str): The period for aggregation. Options are "monthly" or "seasonal".
     include_biomass (bool): True/False indicating whether or not to calculate biomass metrics
     NOTE: When implemented biomass coefficients for inverts were not yet available.
+    daily_inverts_data_df (pd.DataFrame, optional): The output of create_daily_inverts_df,
+    to reuse it across periods. Calculated from pre_processed_inverts_data_df if None.
 
     Returns:
     pd.DataFrame: A DataFrame with aggregated metrics based on the specified period.
     """
-    daily_inverts_data_df = create_daily_df(pre_processed_inverts_data_df, "inverts")
-    # TODO: Remove this boolean when biomass coeficients for inverts become available
-    if include_biomass:
-        daily_inverts_data_df = calculate_biomass(daily_inverts_data_df, "data/constants/biomass_coeffs_inverts.csv")
-    daily_inverts_data_df = add_periods(daily_inverts_data_df, period)
+    if daily_inverts_data_df is None:
+        daily_inverts_data_df = create_daily_inverts_df(pre_processed_inverts_data_df, include_biomass)
+    daily_inverts_data_df = daily_inverts_data_df.assign(
+        Period=period_ordinals(daily_inverts_data_df["Date"], period)
+    )
 
-    results_df = prepare_results_df(daily_inverts_data_df)
-    results_df = calculate_total_count_and_density(
-        daily_inverts_data_df, results_df, daily_dive_numbers_df
+    # Map each species to its consumer classes once and get all densities in one pass
+    species_class_table = build_species_class_table("inverts", CONSUMER_CLASSES)
+    densities = calculate_class_densities(
+        daily_inverts_data_df, daily_dive_numbers_df, species_class_table
     )
-    # results_df = calculate_commercial_count_and_density(
-    #     daily_inverts_data_df, results_df, daily_dive_numbers_df
-    # )
+    metric_columns = list(INVERTS_METRIC_COLUMNS)
+
     # TODO: Remove this boolean when biomass coeficients for inverts become available
     if include_biomass:
-        results_df = calculate_total_biomass_and_density(daily_inverts_data_df, results_df, daily_dive_numbers_df)
+        biomass_densities = calculate_class_densities(
+            daily_inverts_data_df,
+            daily_dive_numbers_df,
+            species_class_table[[]],
+            value_column="Total Biomass",
+            suffix="Biomass Density",
+        ) / 1000  # Convert from g/ha^2 to g/m^2
+        densities = densities.join(biomass_densities)
+        metric_columns.append("Total Biomass Density")
 
-    results_df = calculate_herbivore_density(
-        daily_inverts_data_df, results_df, daily_dive_numbers_df, "inverts"
-    )
-    results_df = calculate_carnivore_density(
-        daily_inverts_data_df, results_df, daily_dive_numbers_df, "inverts"
-    )
-    results_df = calculate_omnivore_density(
-        daily_inverts_data_df, results_df, daily_dive_numbers_df, "inverts"
-    )
-    results_df = calculate_detritivore_density(
-        daily_inverts_data_df, results_df, daily_dive_numbers_df, "inverts"
-    )
-    results_df = calculate_corallivore_density(
-        daily_inverts_data_df, results_df, daily_dive_numbers_df, "inverts"
-    )
+    results_df = prepare_results_df(daily_inverts_data_df)
+    results_df = results_df.join(densities[metric_columns], on=["Period", "Site"]).fillna(0)
 
-    return results_df.groupby(["Period", "Site"]).sum().reset_index()
+    return results_df.groupby(["Period", "Site"], observed=True).sum().reset_index()
@@ -1,77 +1,111 @@
-import pandas as pd
-from pre_processing import pre_process_data, check_all_constants_exist_for_fish, check_all_constants_exist_for_inverts
-from subs_metrics import calculate_subs_metrics
-from utils import (
-    determine_number_of_dives_per_period,
-    save_site_dataframes,
-)
-from fish_metrics import (
-    calculate_fish_metrics,
-)
-from invert_metrics import (
-    calculate_inverts_metrics,
+import argparse
+import sys
+
+from pipeline import COMPUTE_BACKENDS, GROUPS, run_pipelines
+from profiling import (
+    DEFAULT_TRACE_FILE,
+    PROFILE_ENV_VAR,
+    enable_profiling,
+    print_profile_summary,
+    profiling_enabled,
+    write_profile_trace,
 )
+from utils import PERIODS
 
-period = "seasonal" # seasonal or monthly
+DEFAULT_SURVEY_DATA_FILE_URLS = {
+    "fish": "data/input/DBMCP_Fish_2017-08-01_2025-05-31.csv",
+    "inverts": "data/input/DBMCP_Inverts_2017-08-01_2025-05-31.csv",
+    "subs": "data/input/DBMCP_Subs_2017-08-01_2025-05-31.csv",
+}
 
-### FISH
 
-## Read in survey data 
-all_fish_survey_data_df = pd.read_csv(
-    "data/input/DBMCP_Fish_2017-08-01_2025-05-31.csv"
-)
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Calculate survey metrics per site and period and save them to data/output."
+    )
+    for group in GROUPS:
+        parser.add_argument(
+            f"--{group}-input",
+            default=DEFAULT_SURVEY_DATA_FILE_URLS[group],
+            help=f"Path to the {group} survey export CSV file (default: %(default)s)",
+        )
+    parser.add_argument(
+        "--groups", nargs="+", choices=GROUPS, default=GROUPS,
+        help="Groups to calculate metrics for (default: all)",
+    )
+    parser.add_argument(
+        "--periods", nargs="+", choices=PERIODS, default=["seasonal"],
+        help="Periods to produce results for. Pre-processing, daily data and biomass are "
+        "computed once and rolled up to every period (default: seasonal)",
+    )
+    # WHEN BIOMASS COEFFICIENTS BECOME AVAILABLE FOR INVERTS, PASS THIS FLAG
+    parser.add_argument(
+        "--include-invert-biomass", action="store_true",
+        help="Calculate invert biomass metrics (needs biomass_coeffs_inverts.csv to be filled in)",
+    )
+    parser.add_argument(
+        "--streaming", action="store_true",
+        help="Read the exports in bounded chunks (for exports too big for memory)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Don't reuse pre-processed data from data/cache",
+    )
+    parser.add_argument(
+        "--backend", choices=COMPUTE_BACKENDS, default="pandas",
+        help="Compute the daily data, cube and rollups with pandas or with Arrow compute "
+        "kernels on pyarrow Tables (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of groups to run at once (default: all of them, 1 runs them one after another)",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help=f"Record the time, memory and rows in/out of every stage, print a summary and "
+        f"save a JSON trace (also enabled by setting {PROFILE_ENV_VAR}=1)",
+    )
+    parser.add_argument(
+        "--profile-time-only", action="store_true",
+        help="Don't trace memory allocations when profiling, which makes profiling cheaper",
+    )
+    parser.add_argument(
+        "--profile-trace", default=DEFAULT_TRACE_FILE,
+        help="Path of the JSON trace saved when profiling (default: %(default)s)",
+    )
+    return parser.parse_args(argv)
 
-## Pre-process survey data
-pre_processed_fish_df = pre_process_data(all_fish_survey_data_df, group="fish")
-# Check that all constants used in the fish metrics calculations exist
-check_all_constants_exist_for_fish(pre_processed_fish_df)
 
-## Calculate metrics
-# First, calculate the number of dives per day for each site
-fish_daily_dive_numbers_df = determine_number_of_dives_per_period(pre_processed_fish_df, period)
-# Calculate metrics
-fish_results_df = calculate_fish_metrics(
-    pre_processed_fish_df, fish_daily_dive_numbers_df, period
-)
-## Save results to CSV
-save_site_dataframes(fish_results_df, period, group="fish")
+def main(argv: list = None) -> dict:
+    args = parse_args(argv)
+    survey_data_file_urls = {
+        group: getattr(args, f"{group}_input") for group in args.groups
+    }
+    if args.profile:
+        enable_profiling(trace_memory=not args.profile_time_only)
 
-#-------------------------------------------------------------------------------------------
-### INVERTS
-## WHEN BIOMASS COEFFICIENTS BECOME AVAILABLE FOR INVERTS, YOU NEED TO CHANGE TWO THINGS BELOW
-## Read in survey data 
-all_invert_survey_data_df = pd.read_csv(
-    "data/input/DBMCP_Inverts_2017-08-01_2025-05-31.csv"
-)
-## Pre-process survey data
-pre_processed_inverts_df = pre_process_data(all_invert_survey_data_df, group="inverts")
-# Check that all constants used in the fish metrics calculations exist
-check_all_constants_exist_for_inverts(pre_processed_inverts_df, include_biomass=False) # <- CHANGE THIS TO TRUE
-## Calculate metrics
-# First, calculate the number of dives per day for each site
-inverts_daily_dive_numbers_df = determine_number_of_dives_per_period(pre_processed_inverts_df, period)
-# Calculate metrics
-inverts_results_df = calculate_inverts_metrics(
-    pre_processed_inverts_df, inverts_daily_dive_numbers_df, period, include_biomass=False
-) # <- CHANGE THIS TO TRUE
-## Save results to CSV
-save_site_dataframes(inverts_results_df, period, group="inverts")
+    # Each group is read and pre-processed, checked against the constants and turned
+    # into a daily cube once, then rolled up and saved to one CSV per site for every
+    # period. The groups share no state so they run in parallel.
+    run_summaries = run_pipelines(
+        survey_data_file_urls,
+        list(dict.fromkeys(args.periods)),
+        include_biomass=args.include_invert_biomass,
+        streaming=args.streaming,
+        use_cache=not args.no_cache,
+        max_workers=args.workers,
+        backend=args.backend,
+    )
 
-#-------------------------------------------------------------------------------------------
-### SUBS
-## Read in survey data 
-all_subs_survey_data_df = pd.read_csv(
-    "data/input/DBMCP_Subs_2017-08-01_2025-05-31.csv"
-)
-## Pre-process survey data
-pre_processed_subs_df = pre_process_data(all_subs_survey_data_df, group="subs")
+    # Profiling can also be switched on with the SURVEY_PROFILE environment variable
+    if profiling_enabled():
+        print_profile_summary()
+        write_profile_trace(args.profile_trace)
+    return run_summaries
 
-## Calculate metrics
-# First, calculate the number of dives per day for each site
-subs_daily_dive_numbers_df = determine_number_of_dives_per_period(pre_processed_subs_df, period)
-# Calculate metrics
-subs_results_df = calculate_subs_metrics(
-    pre_processed_subs_df, subs_daily_dive_numbers_df, period
-)
-## Save results to CSV
-save_site_dataframes(subs_results_df, period, group="subs")
+
+if __name__ == "__main__":
+    run_summaries = main()
+    # Exit non-zero when any group failed, so cron or CI can tell the run broke
+    if any(run_summary["status"] == "failed" for run_summary in run_summaries.values()):
+        sys.exit(1)
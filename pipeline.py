@@ -0,0 +1,293 @@
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from pre_processing import (
+    pre_process_data,
+    check_all_constants_exist_for_fish,
+    check_all_constants_exist_for_inverts,
+)
+from ingestion import read_survey_export, stream_survey_data
+from cache import cached_survey_data
+from profiling import (
+    add_profile_records,
+    drain_profile_records,
+    profile_stage,
+    profiling_enabled,
+)
+from utils import GROUPS, create_daily_df, save_site_dataframes
+from rollup import build_daily_cube, rollup_cube
+from dive_effort import build_dive_index
+from arrow_backend import (
+    build_daily_cube_table,
+    build_dives_table,
+    create_group_daily_table,
+    rollup_cube_table,
+)
+from results_store import write_results_store
+from fish_metrics import calculate_fish_metrics, create_daily_fish_df
+from invert_metrics import calculate_inverts_metrics, create_daily_inverts_df
+from subs_metrics import calculate_subs_metrics
+
+# Compute backends for the daily data, cube and rollups. "arrow" keeps the data in
+# pyarrow Tables (see arrow_backend.py) until the results are saved
+COMPUTE_BACKENDS = ["pandas", "arrow"]
+
+
+def check_all_constants_exist(
+    survey_data_df: pd.DataFrame, group: str, include_biomass: bool = False
+) -> None:
+    """
+    Check that all constants used in the group's metrics calculations exist.
+    Subs metrics don't use any constants.
+
+    Parameters:
+    survey_data_df (pd.DataFrame): The pre-processed (or daily) survey data.
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether invert biomass coefficients are needed.
+    """
+    if group == "fish":
+        check_all_constants_exist_for_fish(survey_data_df)
+    elif group == "inverts":
+        check_all_constants_exist_for_inverts(survey_data_df, include_biomass=include_biomass)
+
+
+def create_group_daily_df(
+    pre_processed_df: pd.DataFrame, group: str, include_biomass: bool = False
+) -> pd.DataFrame:
+    """
+    Create the daily data of any group, including biomass where it is calculated. This
+    doesn't depend on the period, so it can be shared across periods.
+
+    Parameters:
+    pre_processed_df (pd.DataFrame): The pre-processed (or daily) survey data.
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to calculate invert biomass.
+
+    Returns:
+    pd.DataFrame: The group's daily data.
+    """
+    if group == "fish":
+        return create_daily_fish_df(pre_processed_df)
+    elif group == "inverts":
+        return create_daily_inverts_df(pre_processed_df, include_biomass)
+    elif group == "subs":
+        return create_daily_df(pre_processed_df, "subs")
+    raise ValueError(f"Unknown group '{group}', expected one of {GROUPS}.")
+
+
+def calculate_group_metrics(
+    pre_processed_df: pd.DataFrame,
+    daily_dive_numbers_df: pd.DataFrame,
+    period: str,
+    group: str,
+    include_biomass: bool = False,
+    daily_df: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """
+    Calculate the metrics of any group for each unique combination of Period and Site.
+
+    Parameters:
+    pre_processed_df (pd.DataFrame): The pre-processed (or daily) survey data.
+    daily_dive_numbers_df (pd.DataFrame): The number of dives per Period and Site.
+    period (str): Either "monthly" or "seasonal".
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to calculate invert biomass metrics.
+    daily_df (pd.DataFrame, optional): The output of create_group_daily_df, to reuse it
+    across periods.
+
+    Returns:
+    pd.DataFrame: A DataFrame with the group's metrics per Period and Site.
+    """
+    if group == "fish":
+        return calculate_fish_metrics(pre_processed_df, daily_dive_numbers_df, period, daily_df)
+    elif group == "inverts":
+        return calculate_inverts_metrics(
+            pre_processed_df, daily_dive_numbers_df, period, include_biomass, daily_df
+        )
+    elif group == "subs":
+        return calculate_subs_metrics(pre_processed_df, daily_dive_numbers_df, period, daily_df)
+    raise ValueError(f"Unknown group '{group}', expected one of {GROUPS}.")
+
+
+def read_and_pre_process(
+    survey_data_file_url: str, group: str, streaming: bool = False, use_cache: bool = False
+) -> tuple:
+    """
+    Read and pre-process a survey export.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+    group (str): Either fish, inverts or subs.
+    streaming (bool): Read the export in bounded chunks (for exports too big for memory).
+    use_cache (bool): Reuse pre-processed data from the cache when the export and
+    constants are unchanged.
+
+    Returns:
+    tuple: The data to calculate metrics from, and the data to count dives from. When
+    streaming or using the cache these are the daily aggregates and the distinct dives,
+    otherwise both are the full pre-processed survey data.
+    """
+    if streaming:
+        return stream_survey_data(survey_data_file_url, group)
+    if use_cache:
+        return cached_survey_data(survey_data_file_url, group)
+    pre_processed_df = pre_process_data(read_survey_export(survey_data_file_url), group=group)
+    return pre_processed_df, pre_processed_df
+
+
+@profile_stage
+def run_group_pipeline(
+    survey_data_file_url: str,
+    group: str,
+    periods: list,
+    include_biomass: bool = False,
+    streaming: bool = False,
+    use_cache: bool = False,
+    backend: str = "pandas",
+) -> dict:
+    """
+    Run one group's pipeline end to end: read and pre-process the export, check the
+    constants, create the daily data and roll it into the daily cube (see rollup.py),
+    then for each period roll the cube up to the period's metrics and save the per
+    site results, as CSV files and in the Parquet results store. Everything before
+    the period loop is only computed once however many periods are requested.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+    group (str): Either fish, inverts or subs.
+    periods (list): The periods to produce results for, any of utils.PERIODS.
+    include_biomass (bool): Whether to calculate invert biomass metrics.
+    streaming (bool): Read the export in bounded chunks.
+    use_cache (bool): Reuse pre-processed data from the cache.
+    backend (str): One of COMPUTE_BACKENDS.
+
+    Returns:
+    dict: The seconds taken by each stage.
+    """
+    if backend not in COMPUTE_BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {COMPUTE_BACKENDS}.")
+    stage_seconds = {}
+    start_time = time.perf_counter()
+
+    def finish_stage(stage: str) -> None:
+        nonlocal start_time
+        stage_seconds[stage] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+
+    survey_data_df, dives_source_df = read_and_pre_process(
+        survey_data_file_url, group, streaming, use_cache
+    )
+    finish_stage("read_and_pre_process")
+    check_all_constants_exist(survey_data_df, group, include_biomass)
+    finish_stage("check_constants")
+    # The dive effort index is built once and every period's dive counts come from it
+    dive_index = build_dive_index(dives_source_df)
+    finish_stage("build_dive_index")
+    if backend == "arrow":
+        daily_table = create_group_daily_table(survey_data_df, group, include_biomass)
+        finish_stage("create_daily")
+        daily_cube = build_daily_cube_table(daily_table, group, include_biomass)
+        dives = build_dives_table(dive_index)
+    else:
+        daily_df = create_group_daily_df(survey_data_df, group, include_biomass)
+        finish_stage("create_daily")
+        daily_cube = build_daily_cube(daily_df, group, include_biomass)
+        dives = dive_index
+    finish_stage("build_cube")
+
+    for period in periods:
+        if backend == "arrow":
+            results_df = rollup_cube_table(daily_cube, dives, period).to_pandas()
+        else:
+            results_df = rollup_cube(daily_cube, dives, period)
+        finish_stage(f"rollup[{period}]")
+        save_site_dataframes(results_df, period, group)
+        finish_stage(f"save[{period}]")
+        write_results_store(results_df, period, group)
+        finish_stage(f"store[{period}]")
+    return stage_seconds
+
+
+def _run_group_pipeline_safely(survey_data_file_url: str, group: str, *args) -> dict:
+    """
+    Run a group's pipeline, returning its status, timings and any error instead of
+    raising, so one failing group doesn't stop the others. When profiling, the stage
+    records of the run are returned too, so they get back from worker processes.
+    """
+    start_time = time.perf_counter()
+    try:
+        stage_seconds = run_group_pipeline(survey_data_file_url, group, *args)
+        run_summary = {"group": group, "status": "ok", "seconds": time.perf_counter() - start_time,
+                       "stages": stage_seconds, "error": None}
+    except Exception:
+        run_summary = {"group": group, "status": "failed", "seconds": time.perf_counter() - start_time,
+                       "stages": {}, "error": traceback.format_exc()}
+    run_summary["profile_records"] = drain_profile_records() if profiling_enabled() else []
+    return run_summary
+
+
+def run_pipelines(
+    survey_data_file_urls: dict,
+    periods: list,
+    include_biomass: bool = False,
+    streaming: bool = False,
+    use_cache: bool = False,
+    max_workers: int = None,
+    backend: str = "pandas",
+) -> dict:
+    """
+    Run the pipelines of several groups concurrently in a process pool, then print
+    each group's errors and a timing summary.
+
+    Parameters:
+    survey_data_file_urls (dict): Path to the survey export CSV file of each group,
+    e.g. {"fish": "data/input/fish.csv"}.
+    periods (list): The periods to produce results for, any of utils.PERIODS.
+    include_biomass (bool): Whether to calculate invert biomass metrics.
+    streaming (bool): Read the exports in bounded chunks.
+    use_cache (bool): Reuse pre-processed data from the cache.
+    max_workers (int): Number of worker processes. Defaults to one per group, up to the
+    number of CPUs. With 1 the groups run one after another in this process.
+    backend (str): One of COMPUTE_BACKENDS.
+
+    Returns:
+    dict: The status, total seconds, seconds per stage and error (if any) of each group.
+    """
+    if max_workers is None:
+        max_workers = min(len(survey_data_file_urls), os.cpu_count() or 1)
+    start_time = time.perf_counter()
+
+    job_args = [
+        (survey_data_file_url, group, periods, include_biomass, streaming, use_cache, backend)
+        for group, survey_data_file_url in survey_data_file_urls.items()
+    ]
+    if max_workers == 1:
+        run_summaries = [_run_group_pipeline_safely(*args) for args in job_args]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_run_group_pipeline_safely, *args) for args in job_args]
+            run_summaries = [future.result() for future in futures]
+    for run_summary in run_summaries:
+        add_profile_records(run_summary.pop("profile_records"))
+
+    print_run_summary(run_summaries, time.perf_counter() - start_time)
+    return {run_summary["group"]: run_summary for run_summary in run_summaries}
+
+
+def print_run_summary(run_summaries: list, wall_seconds: float) -> None:
+    """
+    Print the errors of failed groups and a table of the seconds each group and stage took.
+    """
+    for run_summary in run_summaries:
+        if run_summary["error"]:
+            print(f"\n{run_summary['group']} pipeline failed:\n{run_summary['error']}")
+
+    print(f"\n{'Group':<10}{'Status':<8}{'Total (s)':>10}  Stages (s)")
+    for run_summary in run_summaries:
+        stages = ", ".join(f"{stage} {seconds:.2f}" for stage, seconds in run_summary["stages"].items())
+        print(f"{run_summary['group']:<10}{run_summary['status']:<8}{run_summary['seconds']:>10.2f}  {stages}")
+    print(f"Wall clock: {wall_seconds:.2f}s, sum of groups: "
+          f"{sum(run_summary['seconds'] for run_summary in run_summaries):.2f}s")
@@ -1,25 +1,230 @@
-import pandas as pd
+import argparse
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+# Render to files only, so charts can be drawn in worker processes without a display
+matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
+from matplotlib.ticker import MaxNLocator
+import pandas as pd
+from results_query import ResultsIndex
+from utils import GROUPS, OUTPUT_DIR, PERIODS, write_file_if_changed
+
+CHARTS_DIR = "data/charts"
+
+# Bump this when the look of the charts changes, so every chart is drawn again
+CHART_STYLE_VERSION = 1
+
+
+def chart_path(group: str, period: str, site: str, metric: str) -> str:
+    """
+    Parameters:
+    group (str): Either fish, inverts or subs.
+    period (str): One of utils.PERIODS.
+    site (str): The site.
+    metric (str): The metric.
+
+    Returns:
+    str: The path of the site's chart of the metric.
+    """
+    return f"{CHARTS_DIR}/{group}/{period}/{site}/{metric}.png"
+
+
+def chart_data_hash(site: str, metric: str, site_results_df: pd.DataFrame) -> str:
+    """
+    Hash everything a chart is drawn from, so unchanged charts can be skipped.
+
+    Parameters:
+    site (str): The site.
+    metric (str): The metric.
+    site_results_df (pd.DataFrame): The site's results file.
+
+    Returns:
+    str: The SHA-256 hex digest of the chart's data.
+    """
+    digest = hashlib.sha256(f"{CHART_STYLE_VERSION}:{site}:{metric}".encode())
+    digest.update(site_results_df["Period"].astype(str).str.cat(sep="\n").encode())
+    digest.update(site_results_df[metric].to_numpy(dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def _manifest_path(group: str, period: str) -> str:
+    return f"{CHARTS_DIR}/{group}/{period}/manifest.json"
+
+
+def read_chart_manifest(group: str, period: str) -> dict:
+    """
+    Read the data hash each chart of a group and period was last drawn from.
+
+    Parameters:
+    group (str): Either fish, inverts or subs.
+    period (str): One of utils.PERIODS.
+
+    Returns:
+    dict: The data hash of each chart, keyed by chart path. Empty if no charts were drawn.
+    """
+    manifest_path = _manifest_path(group, period)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def find_chart_jobs(group: str, period: str, force: bool = False) -> tuple:
+    """
+    Find the charts of a group and period whose data changed since they were drawn.
+
+    Parameters:
+    group (str): Either fish, inverts or subs.
+    period (str): One of utils.PERIODS.
+    force (bool): Draw every chart, even if its data hasn't changed.
+
+    Returns:
+    tuple: A list of jobs (one per site, with the site's results and the metrics to
+    draw), the data hash of every chart and the number of charts skipped.
+    """
+    if not os.path.isdir(f"{OUTPUT_DIR}/{group}/{period}"):
+        return [], {}, 0
+    previous_hashes = {} if force else read_chart_manifest(group, period)
+    # Every site's results come from one index instead of parsing each file here
+    results_index = ResultsIndex.from_output(group, period, cache_size=0)
+
+    jobs, chart_hashes, skipped = [], {}, 0
+    for site in sorted(results_index.sites):
+        site_results_df = results_index.query(sites=[site]).astype({"Period": str})
+        metrics = []
+        for metric in results_index.metrics:
+            file_url = chart_path(group, period, site, metric)
+            chart_hashes[file_url] = chart_data_hash(site, metric, site_results_df)
+            if previous_hashes.get(file_url) == chart_hashes[file_url] and os.path.exists(file_url):
+                skipped += 1
+            else:
+                metrics.append(metric)
+        if metrics:
+            jobs.append((group, period, site, site_results_df, metrics))
+    return jobs, chart_hashes, skipped
+
+
+def render_site_charts(job: tuple) -> list:
+    """
+    Draw the charts of one site, reusing one figure for all of its metrics.
+
+    Parameters:
+    job (tuple): The group, period, site, site results and metrics to draw, as from
+    find_chart_jobs.
+
+    Returns:
+    list: The paths of the charts that were written.
+    """
+    group, period, site, site_results_df, metrics = job
+    os.makedirs(f"{CHARTS_DIR}/{group}/{period}/{site}", exist_ok=True)
+
+    written = []
+    # The periods are the same for every metric, so the figure is built once and only
+    # the line, title and y axis change between metrics. Fixed margins avoid a layout
+    # pass per chart.
+    figure, axes = plt.subplots(figsize=(10, 6))
+    figure.subplots_adjust(left=0.1, right=0.97, top=0.93, bottom=0.2)
+    (line,) = axes.plot(site_results_df["Period"], site_results_df[metrics[0]], marker="o")
+    axes.set_xlabel("Period")
+    axes.tick_params(axis="x", labelrotation=45)
+    # Label at most a dozen periods, so daily and monthly charts stay readable and
+    # drawing the tick labels doesn't dominate the render time
+    axes.xaxis.set_major_locator(MaxNLocator(nbins=12))
+    axes.grid(True)
+    try:
+        for metric in metrics:
+            line.set_ydata(site_results_df[metric])
+            line.set_label(metric)
+            axes.relim()
+            axes.autoscale_view()
+            axes.set_title(f"{site} - {metric} ({period})")
+            axes.set_ylabel(metric)
+            axes.legend()
+
+            buffer = io.BytesIO()
+            figure.savefig(buffer, format="png")
+            file_url = chart_path(group, period, site, metric)
+            if write_file_if_changed(file_url, buffer.getvalue())["status"] == "written":
+                written.append(file_url)
+    finally:
+        plt.close(figure)
+    return written
+
+
+def render_all_charts(
+    groups: list = GROUPS,
+    periods: list = PERIODS,
+    max_workers: int = None,
+    force: bool = False,
+) -> dict:
+    """
+    Draw a trend chart of every metric for every site from the results in data/output,
+    in parallel worker processes. Charts whose data hasn't changed since they were
+    last drawn are skipped.
+
+    Parameters:
+    groups (list): The groups to draw charts for.
+    periods (list): The periods to draw charts for. Periods without results are skipped.
+    max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+    force (bool): Draw every chart, even if its data hasn't changed.
+
+    Returns:
+    dict: The number of charts drawn, written (changed on disk) and skipped.
+    """
+    all_jobs, all_chart_hashes, skipped = [], {}, 0
+    for group in groups:
+        for period in periods:
+            jobs, chart_hashes, period_skipped = find_chart_jobs(group, period, force)
+            all_jobs += jobs
+            all_chart_hashes[(group, period)] = chart_hashes
+            skipped += period_skipped
+
+    drawn = sum(len(job[-1]) for job in all_jobs)
+    written = []
+    if all_jobs:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for site_written in executor.map(render_site_charts, all_jobs):
+                written += site_written
 
+    # Only record the hashes once every chart is drawn, so a failed run draws them again
+    for (group, period), chart_hashes in all_chart_hashes.items():
+        if chart_hashes:
+            write_file_if_changed(_manifest_path(group, period), json.dumps(chart_hashes, indent=1, sort_keys=True))
 
-df = pd.read_csv("data/output/daily_fish_results_Andulay MPA.csv")
+    print(f"Drew {drawn} charts ({len(written)} changed) and skipped {skipped} unchanged charts in {CHARTS_DIR}")
+    return {"drawn": drawn, "written": len(written), "skipped": skipped}
 
-# Ensure the necessary columns exist
-if "Date" not in df.columns or "Total Biomass" not in df.columns:
-    raise ValueError("The file must contain 'Date' and 'Total Biomass' columns.")
 
-# Convert Date column to datetime
-df["Date"] = pd.to_datetime(df["Date"])
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=f"Draw a trend chart of every metric for every site in {OUTPUT_DIR}."
+    )
+    parser.add_argument(
+        "--groups", nargs="+", choices=GROUPS, default=GROUPS,
+        help="Groups to draw charts for (default: all)",
+    )
+    parser.add_argument(
+        "--periods", nargs="+", choices=PERIODS, default=PERIODS,
+        help="Periods to draw charts for, periods without results are skipped (default: all)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of worker processes (default: the number of CPUs)",
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Draw every chart, even if its data hasn't changed",
+    )
+    return parser.parse_args(argv)
 
-# Plot the data
-plt.figure(figsize=(10, 6))
-plt.plot(df["Date"], df["Total Biomass"], marker="o", label="Total Biomass")
-plt.title("Daily Fish Results")
-plt.xlabel("Date")
-plt.ylabel("Total Biomass")
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
 
-# Show the plot
-plt.show()
+if __name__ == "__main__":
+    args = parse_args()
+    render_all_charts(args.groups, args.periods, args.workers, args.force)
@@ -1,7 +1,29 @@
+import time
+
+import numpy as np
 import pandas as pd
+from constants import CONSUMER_CLASSES, load_consumer_species, load_biomass_resolver
+from profiling import profile_stage
+from species_resolver import SpeciesResolver
+
+# Bump whenever pre-processing changes its output, so cached pre-processed data is rebuilt
+PRE_PROCESSING_VERSION = 3
+
+# Columns that are not needed for any metric: diver/observer names, the per diver
+# counts (Total includes the total for both) and the survey status once filtered on
+DROPPED_COLUMNS = [
+    "Observer_name_1",
+    "Observer_name_2",
+    "Diver_1_count",
+    "Diver_2_count",
+    "Survey_Status",
+]
 
 
-def pre_process_data(survey_data_df: pd.DataFrame, group: str) -> pd.DataFrame:
+@profile_stage
+def pre_process_data(
+    survey_data_df: pd.DataFrame, group: str, verbose: bool = True, compact: bool = True
+) -> pd.DataFrame:
     """
     Process survey data to:
     - remove diver/observer names
@@ -10,131 +32,231 @@ def pre_process_data(survey_data_df: pd.DataFrame, group: str) -> pd.DataFrame:
     - remove fish of size >120 (turtles, whom aren't accounted for in metrics)
     - average the size range
     - ensure Date column is in datetime format
+    - compact the remaining columns (see compact_survey_data)
+
+    Rows are filtered with one combined mask and projected onto the needed columns in
+    a single copy, so the input DataFrame is left unchanged. Dates and size ranges are
+    parsed once per distinct value rather than once per row.
 
     Parameters:
-    all_fish_survey_data_df (pd.DataFrame): The DataFrame containing all fish data.
+    survey_data_df (pd.DataFrame): The DataFrame containing all survey data.
+    group (str): Either fish, inverts or subs.
+    verbose (bool): Print the rows in/out and time taken by each step, and the memory
+    saved by compacting.
+    compact (bool): Compact the processed data. Survey_ID codes are only meaningful
+    within one call, so pass False when the output is combined with other calls' output.
 
     Returns:
-    pd.DataFrame: The processed DataFrame of all fish data ready for metrics
+    pd.DataFrame: The processed DataFrame of all survey data ready for metrics
     to be calculated.
     """
-    # Remove diver/observer names
-    if {"Observer_name_1", "Observer_name_2"}.issubset(survey_data_df.columns):
-        survey_data_df.drop(
-            ["Observer_name_1", "Observer_name_2"], axis=1, inplace=True
-        )
-    
-    # Remove redundant Diver count columns (Total includes the total for both)
-    survey_data_df.drop(["Diver_1_count", "Diver_2_count"], axis=1, inplace=True)
-
-    # Remove time survey was recorded from date column
-    survey_data_df["Date"] = pd.to_datetime(
-        survey_data_df["Date"]
-    ).dt.floor("D")
+    def report(step: str, rows_in: int, rows_out: int, start_time: float) -> None:
+        if verbose:
+            print(
+                f"pre_process_data [{group}] {step}: {rows_in} -> {rows_out} rows "
+                f"({time.perf_counter() - start_time:.3f}s)"
+            )
 
-    # Remove invalid surveys then drop column as it's no longer needed
+    # Remove invalid surveys, and fish of size >120, with one combined mask, then
+    # keep only the columns we need in a single copy
+    start_time = time.perf_counter()
+    keep_rows = pd.Series(True, index=survey_data_df.index)
     if "Survey_Status" in survey_data_df.columns:
-        survey_data_df = survey_data_df[
-            survey_data_df["Survey_Status"] == 1
-        ]
-        survey_data_df.drop(["Survey_Status"], axis=1, inplace=True)
-
+        # A missing status (nullable when streamed) isn't a valid survey either
+        keep_rows &= survey_data_df["Survey_Status"].eq(1).fillna(False).astype(bool)
     if group != "subs":
-        # Remove surveys of fish size >120
-        survey_data_df = survey_data_df[
-            survey_data_df["Size"] != ">120"
-        ]
+        keep_rows &= survey_data_df["Size"] != ">120"
+    keep_columns = [
+        column for column in survey_data_df.columns if column not in DROPPED_COLUMNS
+    ]
+    processed_df = survey_data_df.loc[keep_rows.to_numpy(), keep_columns].copy()
+    report("filter", len(survey_data_df), len(processed_df), start_time)
+
+    # Remove time survey was recorded from date column
+    start_time = time.perf_counter()
+    processed_df["Date"] = _parse_dates(processed_df["Date"])
+    report("dates", len(processed_df), len(processed_df), start_time)
 
+    if group != "subs":
         # Average the size range
-        size_list = [survey_data_df["Size"].str.split("-")]
-        average_size_list = []
-        for row in size_list:
-            for sizes in row:
-                float_sizes = [float(i) for i in sizes]
-                average_size_list.append(sum(float_sizes) / 2)
-        survey_data_df["Size"] = average_size_list
+        start_time = time.perf_counter()
+        processed_df["Size"] = _average_size_ranges(processed_df["Size"])
+        report("sizes", len(processed_df), len(processed_df), start_time)
+
+    if compact:
+        start_time = time.perf_counter()
+        bytes_before = processed_df.memory_usage(deep=True).sum() if verbose else None
+        processed_df = compact_survey_data(processed_df)
+        if verbose:
+            bytes_after = processed_df.memory_usage(deep=True).sum()
+            print(
+                f"pre_process_data [{group}] compact: {bytes_before / 1024**2:.1f} MB -> "
+                f"{bytes_after / 1024**2:.1f} MB ({bytes_before / bytes_after:.1f}x smaller, "
+                f"{time.perf_counter() - start_time:.3f}s)"
+            )
 
-    return survey_data_df
+    return processed_df
+
+
+def compact_survey_data(survey_data_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrink processed survey data without changing any metric:
+    - Survey_ID becomes an integer code per distinct survey (only the number of
+      distinct surveys is ever used, not the IDs themselves)
+    - the other string columns (Site, Species, Group, Status, Depth) become categoricals,
+      whose categories sort like the strings so grouped output keeps its order
+    - integer columns use the narrowest integer dtype that holds their values, and
+      float columns float32 when every value survives the round trip (e.g. Size, which
+      only holds averages of whole centimetre bounds)
+
+    Parameters:
+    survey_data_df (pd.DataFrame): Processed survey data.
+
+    Returns:
+    pd.DataFrame: The compacted survey data, with the same index and columns.
+    """
+    compact_columns = {}
+    for column in survey_data_df.columns:
+        values = survey_data_df[column]
+        if column == "Date" or isinstance(values.dtype, pd.CategoricalDtype):
+            continue
+        if column == "Survey_ID":
+            codes, _ = pd.factorize(values)
+            survey_codes = pd.Series(codes, index=values.index, name=column)
+            if (codes < 0).any():
+                # Keep missing IDs missing, so they still don't count as a survey
+                survey_codes = survey_codes.astype("Int32").mask(codes < 0)
+            compact_columns[column] = pd.to_numeric(survey_codes, downcast="integer")
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            compact_columns[column] = pd.to_numeric(values, downcast="integer")
+        elif pd.api.types.is_float_dtype(values.dtype):
+            narrow_values = values.astype("float32")
+            if np.array_equal(narrow_values.to_numpy(dtype=float), values.to_numpy(dtype=float), equal_nan=True):
+                compact_columns[column] = narrow_values
+        elif pd.api.types.is_string_dtype(values.dtype):
+            compact_columns[column] = values.astype("category")
+    return survey_data_df.assign(**compact_columns)
 
 
+def _parse_dates(dates: pd.Series) -> pd.Series:
+    """
+    Parse dates to datetimes at day resolution, parsing each distinct value only once.
+    """
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.dt.normalize()
+    codes, unique_dates = pd.factorize(dates)
+    parsed_dates = pd.DatetimeIndex(pd.to_datetime(unique_dates)).normalize()
+    return pd.Series(
+        parsed_dates.take(codes, allow_fill=True), index=dates.index, name=dates.name
+    )
+
+
+def _average_size_ranges(sizes: pd.Series) -> pd.Series:
+    """
+    Convert size range labels such as "5-10" into the average of the range, parsing
+    each distinct label only once.
+    """
+    codes, unique_sizes = pd.factorize(sizes)
+    bounds = pd.Series(unique_sizes).astype(str).str.split("-", expand=True).astype(float)
+    average_sizes = (bounds.sum(axis=1) / 2).to_numpy()
+    return pd.Series(average_sizes[codes], index=sizes.index, name=sizes.name)
+
+
+def find_unresolved_species(unique_species, resolver: SpeciesResolver, parent_fallback: bool = False) -> list:
+    """
+    Find the species that a resolver can't match, printing the species only matched
+    through an alias or their parent so the constants can be fixed at leisure.
+
+    Parameters:
+    unique_species (iterable): The distinct species in the survey data.
+    resolver (SpeciesResolver): The resolver over the constants' species.
+    parent_fallback (bool): Whether a species may use its parent's entry.
+
+    Returns:
+    list: The species that can't be resolved, sorted.
+    """
+    unresolved_species = []
+    for species in unique_species:
+        resolved_species = resolver.resolve(species, parent_fallback)
+        if resolved_species is None:
+            unresolved_species.append(species)
+        elif resolved_species != species:
+            print(f"  Using '{resolved_species}' for '{species}'")
+    return sorted(unresolved_species, key=str)
+
+
+@profile_stage
 def check_all_constants_exist_for_fish(survey_data_df: pd.DataFrame) -> None:
     """
-    Check that all constants used in the fish metrics calculations exist.
-    If any are missing, raise an error.
+    Check that all constants used in the fish metrics calculations exist, allowing
+    for spellings that only differ in case, punctuation or hyphen spacing.
+    If any are missing, raise an error with the closest names in the constants.
     """
     # Get all unique species in the survey data
     unique_species = survey_data_df["Species"].unique()
 
     # Read in constants
-    consumer_constants = [
-        "corallivore_fish.csv",
-        "detritivore_fish.csv",
-        "herbivore_fish.csv",
-        "omnivore_fish.csv",
-        "carnivore_fish.csv"
-    ]
-    all_constants = []
-    for constant in consumer_constants:
-        constant_list = pd.read_csv(f"data/constants/{constant}",header=None).iloc[:,0].to_list()
-        all_constants.extend(constant_list)
-    
+    all_constants = set()
+    for consumer in CONSUMER_CLASSES:
+        all_constants |= load_consumer_species(consumer, "fish")
+    consumer_resolver = SpeciesResolver(sorted(all_constants))
+
     # Check all species in the survey data appear in the consumer constant CSV files
-    missing_species = list(set(unique_species) - set(all_constants))
+    missing_species = find_unresolved_species(unique_species, consumer_resolver)
     if missing_species:
         raise ValueError(
-            f"The following fish species in the survey data are not any of the consumer lists: {missing_species}"
+            "The following fish species in the survey data are not any of the consumer lists:\n"
+            + consumer_resolver.describe_missing(missing_species)
         )
     else:
         print("All consumer constants exist for fish in the survey data.")
-        
-    # Check we have biomass coefficients for all species
-    biomass_coeffs = pd.read_csv("data/constants/biomass_coeffs_fish.csv", index_col="Species")
-    missing_biomass_coeffs = list(set(unique_species) - set(biomass_coeffs.index))
+
+    # Check we have biomass coefficients for all species, or for their parent
+    biomass_resolver = load_biomass_resolver("data/constants/biomass_coeffs_fish.csv")
+    missing_biomass_coeffs = find_unresolved_species(unique_species, biomass_resolver, parent_fallback=True)
     if missing_biomass_coeffs:
         raise ValueError(
-            f"The following fish species in the survey data are missing biomass coefficients: {missing_biomass_coeffs}"
+            "The following fish species in the survey data are missing biomass coefficients:\n"
+            + biomass_resolver.describe_missing(missing_biomass_coeffs)
         )
     else:
         print("All fish species in the survey data have biomass coefficients.")
 
 
+@profile_stage
 def check_all_constants_exist_for_inverts(survey_data_df: pd.DataFrame, include_biomass: bool) -> None:
     """
-    Check that all constants used in the inverts metrics calculations exist.
-    If any are missing, raise an error.
+    Check that all constants used in the inverts metrics calculations exist, allowing
+    for spellings that only differ in case, punctuation or hyphen spacing.
+    If any are missing, raise an error with the closest names in the constants.
     """
     # Get all unique species in the survey data
     unique_species = survey_data_df["Species"].unique()
 
     # Read in constants
-    consumer_constants = [
-        "corallivore_inverts.csv",
-        "detritivore_inverts.csv",
-        "herbivore_inverts.csv",
-        "omnivore_inverts.csv",
-        "carnivore_inverts.csv",
-    ]
-    all_constants = []
-    for constant in consumer_constants:
-        constant_list = pd.read_csv(f"data/constants/{constant}",header=None).iloc[:,0].to_list()
-        all_constants.extend(constant_list)
-    
+    all_constants = set()
+    for consumer in CONSUMER_CLASSES:
+        all_constants |= load_consumer_species(consumer, "inverts")
+    consumer_resolver = SpeciesResolver(sorted(all_constants))
+
     # Check all species in the survey data appear in the consumer constant CSV files
-    missing_species = list(set(unique_species) - set(all_constants))
+    missing_species = find_unresolved_species(unique_species, consumer_resolver)
     if missing_species:
         raise ValueError(
-            f"The following invertebrate species in the survey data are not any of the consumer lists: {missing_species}"
+            "The following invertebrate species in the survey data are not any of the consumer lists:\n"
+            + consumer_resolver.describe_missing(missing_species)
         )
     else:
         print("All consumer constants exists for invertebrates in the survey data.")
-        
-    # Check we have biomass coefficients for all species IF include_biomass is True
+
+    # Check we have biomass coefficients for all species (or their parent) IF include_biomass is True
     if include_biomass:
-        biomass_coeffs = pd.read_csv("data/constants/biomass_coeffs_inverts.csv", index_col="Species")
-        missing_biomass_coeffs = list(set(unique_species) - set(biomass_coeffs.index))
+        biomass_resolver = load_biomass_resolver("data/constants/biomass_coeffs_inverts.csv")
+        missing_biomass_coeffs = find_unresolved_species(unique_species, biomass_resolver, parent_fallback=True)
         if missing_biomass_coeffs:
             raise ValueError(
-                f"The following invertebrate species in the survey data are missing biomass coefficients: {missing_biomass_coeffs}"
+                "The following invertebrate species in the survey data are missing biomass coefficients:\n"
+                + biomass_resolver.describe_missing(missing_biomass_coeffs)
             )
         else:
             print("All invertebrate species in the survey data have biomass coefficients.")
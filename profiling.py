@@ -0,0 +1,254 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Set to 1 to profile every run, or to "time" to profile without tracing memory
+PROFILE_ENV_VAR = "SURVEY_PROFILE"
+
+DEFAULT_TRACE_FILE = "data/profiles/trace.json"
+
+# Stage records of this process, each a dict as built by profile_stage
+_records = []
+_records_lock = threading.Lock()
+
+# The stages currently running in each thread, innermost last
+_stack = threading.local()
+
+
+def profiling_enabled() -> bool:
+    """
+    Whether stages are being profiled, i.e. the environment variable is set (by the
+    user, or by enable_profiling, so worker processes profile too).
+    """
+    return os.environ.get(PROFILE_ENV_VAR, "0") not in ("", "0")
+
+
+def _memory_tracing_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV_VAR) != "time"
+
+
+def enable_profiling(trace_memory: bool = True) -> None:
+    """
+    Start profiling every stage in this process and in worker processes started after
+    this call.
+
+    Parameters:
+    trace_memory (bool): Also record the peak memory allocated in each stage with
+    tracemalloc, which slows down allocation heavy stages.
+    """
+    os.environ[PROFILE_ENV_VAR] = "1" if trace_memory else "time"
+
+
+def disable_profiling() -> None:
+    """
+    Stop profiling stages. Records collected so far are kept.
+    """
+    os.environ.pop(PROFILE_ENV_VAR, None)
+
+
+def _count_rows(value) -> int:
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series, list)):
+        return len(value)
+    # pyarrow Tables, from the Arrow compute backend
+    return getattr(value, "num_rows", None)
+
+
+def _max_rss_bytes() -> int:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def profile_stage(function):
+    """
+    Decorator recording the wall time, CPU time, peak traced memory, peak RSS and rows
+    in and out of every call to a pipeline function while profiling is enabled. Rows
+    in are the length of the first DataFrame or Series argument, rows out the length
+    of the result. When profiling is disabled the function is called directly.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not profiling_enabled():
+            return function(*args, **kwargs)
+
+        trace_memory = _memory_tracing_enabled()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        stack = getattr(_stack, "frames", None)
+        if stack is None:
+            stack = _stack.frames = []
+
+        # The traced peak is process wide, so fold it into the enclosing stage before
+        # resetting it for this one
+        start_traced = 0
+        if trace_memory:
+            start_traced, peak_traced = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak_traced)
+            tracemalloc.reset_peak()
+        frame = {"stage": function.__name__, "peak": start_traced}
+        stack.append(frame)
+
+        rows_in = next(
+            (
+                _count_rows(arg) for arg in args
+                if isinstance(arg, (pd.DataFrame, pd.Series)) or hasattr(arg, "num_rows")
+            ),
+            None,
+        )
+        start_time = time.time()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            wall_seconds = time.perf_counter() - start_wall
+            cpu_seconds = time.process_time() - start_cpu
+            stack.pop()
+            peak_traced_bytes = None
+            if trace_memory:
+                frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                peak_traced_bytes = frame["peak"] - start_traced
+                if stack:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], frame["peak"])
+
+        record = {
+            "stage": function.__name__,
+            "module": function.__module__,
+            "parent": stack[-1]["stage"] if stack else None,
+            "depth": len(stack),
+            "start": start_time,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": cpu_seconds,
+            "peak_traced_bytes": peak_traced_bytes,
+            "max_rss_bytes": _max_rss_bytes(),
+            "rows_in": rows_in,
+            "rows_out": _count_rows(result),
+            "pid": os.getpid(),
+            "thread": threading.get_ident(),
+        }
+        with _records_lock:
+            _records.append(record)
+        return result
+
+    return wrapper
+
+
+def profile_records() -> list:
+    """
+    Return a copy of the stage records collected in this process.
+    """
+    with _records_lock:
+        return list(_records)
+
+
+def drain_profile_records() -> list:
+    """
+    Return and forget the stage records collected in this process, e.g. to send them
+    from a worker process back to the parent.
+    """
+    with _records_lock:
+        records = list(_records)
+        _records.clear()
+    return records
+
+
+def add_profile_records(records: list) -> None:
+    """
+    Add stage records collected elsewhere (e.g. in a worker process) to this process.
+    """
+    with _records_lock:
+        _records.extend(records)
+
+
+def profile_summary(records: list = None) -> pd.DataFrame:
+    """
+    Summarise stage records per stage, slowest first.
+
+    Parameters:
+    records (list, optional): The stage records. Defaults to those of this process.
+
+    Returns:
+    pd.DataFrame: Calls, total wall and CPU seconds, the largest peak traced memory and
+    peak RSS (in MB), and total rows in and out of each stage.
+    """
+    records_df = pd.DataFrame(records if records is not None else profile_records())
+    if records_df.empty:
+        return pd.DataFrame()
+    summary_df = records_df.groupby("stage").agg(
+        calls=("stage", "size"),
+        wall_seconds=("wall_seconds", "sum"),
+        cpu_seconds=("cpu_seconds", "sum"),
+        peak_traced_mb=("peak_traced_bytes", "max"),
+        max_rss_mb=("max_rss_bytes", "max"),
+        rows_in=("rows_in", "sum"),
+        rows_out=("rows_out", "sum"),
+    )
+    summary_df[["peak_traced_mb", "max_rss_mb"]] /= 1024 ** 2
+    return summary_df.sort_values("wall_seconds", ascending=False)
+
+
+def print_profile_summary(records: list = None) -> None:
+    """
+    Print the per stage summary of the stage records as a table.
+
+    Parameters:
+    records (list, optional): The stage records. Defaults to those of this process.
+    """
+    summary_df = profile_summary(records)
+    if summary_df.empty:
+        print("No stages were profiled")
+        return
+    print(summary_df.round(3).to_string(na_rep="-"))
+
+
+def write_profile_trace(file_url: str = DEFAULT_TRACE_FILE, records: list = None) -> str:
+    """
+    Save the stage records as a JSON trace in the Trace Event format, which can be
+    opened in chrome://tracing or Perfetto, with every measurement in each event's args.
+
+    Parameters:
+    file_url (str): Path of the JSON file to write.
+    records (list, optional): The stage records. Defaults to those of this process.
+
+    Returns:
+    str: The path of the written file.
+    """
+    records = records if records is not None else profile_records()
+    start = min((record["start"] for record in records), default=0)
+    trace_events = [
+        {
+            "name": record["stage"],
+            "cat": record["module"],
+            "ph": "X",
+            "ts": (record["start"] - start) * 1e6,
+            "dur": record["wall_seconds"] * 1e6,
+            "pid": record["pid"],
+            "tid": record["thread"],
+            "args": {
+                key: record[key]
+                for key in ("cpu_seconds", "peak_traced_bytes", "max_rss_bytes", "rows_in", "rows_out")
+            },
+        }
+        for record in records
+    ]
+    os.makedirs(os.path.dirname(file_url) or ".", exist_ok=True)
+    with open(file_url, "w") as trace_file:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, trace_file)
+    print(f"Saved {file_url}")
+    return file_url
@@ -0,0 +1,229 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from utils import OUTPUT_DIR, as_period_ordinal, label_periods, load_site_results, period_label
+
+# Number of slices kept by the LRU cache of a ResultsIndex
+DEFAULT_QUERY_CACHE_SIZE = 256
+
+
+class ResultsIndex:
+    """
+    A group's results for one period held as one dense array per metric, indexed by
+    site and period ordinal, so lookups are array indexing instead of DataFrame
+    filtering. Combinations without results are NaN.
+
+    Slices returned by the query methods are cached in a least recently used cache,
+    so repeated requests (e.g. serving the same chart) skip the array work too.
+    """
+
+    def __init__(self, results_df: pd.DataFrame, period: str, cache_size: int = DEFAULT_QUERY_CACHE_SIZE):
+        """
+        Parameters:
+        results_df (pd.DataFrame): Results with Period ordinals, Site and one column
+        per metric, as from calculate_*_metrics or rollup_cube.
+        period (str): One of utils.PERIODS.
+        cache_size (int): Number of slices to cache, 0 to disable the cache.
+        """
+        self.period = period
+        self.metrics = [column for column in results_df.columns if column not in ("Period", "Site")]
+        site_codes, sites = pd.factorize(results_df["Site"], sort=True)
+        period_codes, ordinals = pd.factorize(results_df["Period"].astype("int64"), sort=True)
+        self.sites = pd.Index(np.asarray(sites, dtype=object), name="Site")
+        self.ordinals = np.asarray(ordinals, dtype="int64")
+        self.labels = pd.Index(
+            [period_label(ordinal, period) for ordinal in self.ordinals], name="Period"
+        )
+
+        # One (site x period) array per metric
+        self.values = np.full((len(self.metrics), len(self.sites), len(self.ordinals)), np.nan)
+        self.values[:, site_codes, period_codes] = results_df[self.metrics].to_numpy(dtype=float).T
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_output(cls, group: str, period: str, cache_size: int = DEFAULT_QUERY_CACHE_SIZE) -> "ResultsIndex":
+        """
+        Load the site files saved by save_site_dataframes once.
+
+        Parameters:
+        group (str): Either fish, inverts or subs.
+        period (str): One of utils.PERIODS.
+        cache_size (int): Number of slices to cache, 0 to disable the cache.
+
+        Returns:
+        ResultsIndex: The index of the stored results.
+        """
+        results_dir = f"{OUTPUT_DIR}/{group}/{period}"
+        sites = [
+            file_name[: -len(".csv")] for file_name in os.listdir(results_dir) if file_name.endswith(".csv")
+        ]
+        return cls(load_site_results(sites, period, group), period, cache_size)
+
+    def _site_code(self, site: str) -> int:
+        site_code = self.sites.get_indexer([site])[0]
+        if site_code < 0:
+            raise ValueError(f"Unknown site '{site}'.")
+        return site_code
+
+    def _metric_code(self, metric: str) -> int:
+        if metric not in self.metrics:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {self.metrics}.")
+        return self.metrics.index(metric)
+
+    def _period_bounds(self, start, end) -> tuple:
+        # Positions of the first and one past the last period in the range
+        first = 0 if start is None else np.searchsorted(self.ordinals, as_period_ordinal(start, self.period), "left")
+        last = len(self.ordinals) if end is None else np.searchsorted(
+            self.ordinals, as_period_ordinal(end, self.period), "right"
+        )
+        return first, last
+
+    def _cached(self, key: tuple, compute):
+        if self.cache_size <= 0:
+            return compute()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._cache[key] = compute()
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return self._cache[key].copy()
+
+    def lookup(self, site: str, period_value, metric: str) -> float:
+        """
+        Look up one value.
+
+        Parameters:
+        site (str): The site.
+        period_value (str or int): The period label, e.g. 'Spring 2024', or ordinal.
+        metric (str): The metric, e.g. 'Hard Coral Cover'.
+
+        Returns:
+        float: The value, or NaN if the site has no results for the period.
+        """
+        ordinal = as_period_ordinal(period_value, self.period)
+        position = np.searchsorted(self.ordinals, ordinal)
+        if position == len(self.ordinals) or self.ordinals[position] != ordinal:
+            return np.nan
+        return float(self.values[self._metric_code(metric), self._site_code(site), position])
+
+    def period_range(self, site: str, metric: str, start=None, end=None) -> pd.Series:
+        """
+        Get a metric over a range of periods for one site, e.g. for a time series chart.
+        Periods without results are left out.
+
+        Parameters:
+        site (str): The site.
+        metric (str): The metric.
+        start (str or int, optional): The first period, as a label or ordinal.
+        end (str or int, optional): The last period, as a label or ordinal.
+
+        Returns:
+        pd.Series: The metric indexed by period label, in chronological order.
+        """
+        def compute() -> pd.Series:
+            first, last = self._period_bounds(start, end)
+            series = pd.Series(
+                self.values[self._metric_code(metric), self._site_code(site), first:last],
+                index=self.labels[first:last],
+                name=metric,
+            )
+            return series.dropna()
+
+        return self._cached(("period_range", site, metric, start, end), compute)
+
+    def cross_site(self, period_value, metric: str, sites: list = None) -> pd.Series:
+        """
+        Get a metric for every site (or the given sites) in one period, e.g. for a bar
+        chart comparing sites. Sites without results for the period are left out.
+
+        Parameters:
+        period_value (str or int): The period label or ordinal.
+        metric (str): The metric.
+        sites (list, optional): The sites to include. All sites if None.
+
+        Returns:
+        pd.Series: The metric indexed by site.
+        """
+        def compute() -> pd.Series:
+            ordinal = as_period_ordinal(period_value, self.period)
+            position = np.searchsorted(self.ordinals, ordinal)
+            if position == len(self.ordinals) or self.ordinals[position] != ordinal:
+                return pd.Series(dtype=float, name=metric, index=pd.Index([], name="Site"))
+            site_codes = (
+                np.arange(len(self.sites)) if sites is None
+                else np.array([self._site_code(site) for site in sites], dtype=int)
+            )
+            series = pd.Series(
+                self.values[self._metric_code(metric), site_codes, position],
+                index=self.sites[site_codes],
+                name=metric,
+            )
+            return series.dropna()
+
+        key_sites = None if sites is None else tuple(sites)
+        return self._cached(("cross_site", period_value, metric, key_sites), compute)
+
+    def query(self, sites: list = None, start=None, end=None, metrics: list = None) -> pd.DataFrame:
+        """
+        Get any slice of the results as a DataFrame in the layout of the results files.
+
+        Parameters:
+        sites (list, optional): The sites to include. All sites if None.
+        start (str or int, optional): The first period, as a label or ordinal.
+        end (str or int, optional): The last period, as a label or ordinal.
+        metrics (list, optional): The metrics to include. All metrics if None.
+
+        Returns:
+        pd.DataFrame: Period (as ordered labels), Site and the metrics, one row per site
+        and period with results, ordered by Period and Site.
+        """
+        def compute() -> pd.DataFrame:
+            first, last = self._period_bounds(start, end)
+            site_codes = (
+                np.arange(len(self.sites)) if sites is None
+                else np.array([self._site_code(site) for site in sites], dtype=int)
+            )
+            metric_codes = (
+                np.arange(len(self.metrics)) if metrics is None
+                else np.array([self._metric_code(metric) for metric in metrics], dtype=int)
+            )
+            # (metric x site x period) -> one row per (period, site)
+            block = self.values[np.ix_(metric_codes, site_codes, np.arange(first, last))]
+            rows = block.transpose(2, 1, 0).reshape(-1, len(metric_codes))
+            present = ~np.isnan(self.values[:, site_codes][:, :, first:last]).all(axis=0).T.ravel()
+            sliced_df = pd.DataFrame(rows[present], columns=[self.metrics[code] for code in metric_codes])
+            sliced_df.insert(0, "Period", label_periods(
+                pd.Series(np.repeat(self.ordinals[first:last], len(site_codes))[present]), self.period
+            ))
+            sliced_df.insert(1, "Site", np.tile(self.sites[site_codes], last - first)[present])
+            return sliced_df
+
+        key = (
+            "query",
+            None if sites is None else tuple(sites),
+            start,
+            end,
+            None if metrics is None else tuple(metrics),
+        )
+        return self._cached(key, compute)
+
+    def cache_info(self) -> dict:
+        """
+        Return the hits, misses and current size of the slice cache.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "max_size": self.cache_size}
+
+    def clear_cache(self) -> None:
+        """
+        Forget all cached slices.
+        """
+        self._cache.clear()
@@ -0,0 +1,165 @@
+import io
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from profiling import profile_stage
+from utils import (
+    DEFAULT_WRITE_WORKERS,
+    as_period_ordinal,
+    label_periods,
+    write_file_if_changed,
+)
+
+RESULTS_STORE_DIR = "data/results"
+
+
+def _partition_dir(group: str, period: str, site: str = None) -> str:
+    # Hive style partition directories, with site names URI encoded as pyarrow expects
+    partition_dir = f"{RESULTS_STORE_DIR}/group={group}/period={period}"
+    if site is not None:
+        partition_dir += f"/site={quote(site, safe='')}"
+    return partition_dir
+
+
+@profile_stage
+def write_results_store(
+    results_df: pd.DataFrame,
+    period: str,
+    group: str,
+    max_workers: int = DEFAULT_WRITE_WORKERS,
+    remove_stale_sites: bool = True,
+) -> list:
+    """
+    Write a group's results for one period to the Parquet results store, one file per
+    site partitioned by group/period/site. Period is stored as the integer ordinal
+    (so period ranges can be pushed down to the files) with its label alongside. Like
+    save_site_dataframes, files are written atomically and only when they change, so
+    this can run next to the CSV export. Each site's file is replaced whole, so periods
+    missing from the results don't linger in the store.
+
+    Parameters:
+    results_df (pd.DataFrame): The results with Period ordinals, as from rollup_cube
+    or calculate_group_metrics.
+    period (str): One of utils.PERIODS.
+    group (str): Either fish, inverts or subs.
+    max_workers (int): Number of files to write at once.
+    remove_stale_sites (bool): Remove the partitions of sites missing from the results,
+    so the store holds exactly these results. Pass False when the results only cover
+    some of the sites, e.g. an incremental update.
+
+    Returns:
+    list: A manifest with the site, file path, content hash and whether the file was
+    "written", "unchanged" or "removed", for each site.
+    """
+    results_df = results_df.sort_values("Period", kind="stable")
+    results_df.insert(1, "Period Label", label_periods(results_df["Period"], period).astype(str))
+    results_df["Period"] = results_df["Period"].astype("int64")
+
+    def write_site_results(site_and_df: tuple) -> dict:
+        site, site_df = site_and_df
+        site_dir = _partition_dir(group, period, site)
+        os.makedirs(site_dir, exist_ok=True)
+        buffer = io.BytesIO()
+        pq.write_table(
+            pa.Table.from_pandas(site_df.drop(columns="Site"), preserve_index=False), buffer
+        )
+        return {"site": site, **write_file_if_changed(f"{site_dir}/part-0.parquet", buffer.getvalue())}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        manifest = list(executor.map(write_site_results, results_df.groupby("Site", observed=True)))
+
+    if remove_stale_sites:
+        written_sites = {str(site_manifest["site"]) for site_manifest in manifest}
+        for site in list_stored_sites(group, period):
+            if site not in written_sites:
+                site_dir = _partition_dir(group, period, site)
+                shutil.rmtree(site_dir)
+                manifest.append({"site": site, "path": site_dir, "sha256": None, "status": "removed"})
+                print(f"Removed stale {group} {period} results of {site} from {RESULTS_STORE_DIR}")
+
+    written = sum(site_manifest["status"] == "written" for site_manifest in manifest)
+    print(f"Stored {written} changed {group} {period} site results in {RESULTS_STORE_DIR}")
+    return manifest
+
+
+def list_stored_sites(group: str, period: str) -> list:
+    """
+    List the sites with results in the store for a group and period.
+
+    Parameters:
+    group (str): Either fish, inverts or subs.
+    period (str): One of utils.PERIODS.
+
+    Returns:
+    list: The site names, sorted.
+    """
+    partition_dir = _partition_dir(group, period)
+    if not os.path.isdir(partition_dir):
+        return []
+    return sorted(
+        unquote(entry.removeprefix("site=")) for entry in os.listdir(partition_dir)
+        if entry.startswith("site=")
+    )
+
+
+@profile_stage
+def read_results_store(
+    group: str,
+    period: str,
+    sites: list = None,
+    start=None,
+    end=None,
+    metrics: list = None,
+) -> pd.DataFrame:
+    """
+    Read results from the store, pushing every filter down to Parquet: sites prune
+    whole partitions, the period range is checked against each file's Period
+    statistics before rows are read, and only the requested metric columns are read.
+
+    Parameters:
+    group (str): Either fish, inverts or subs.
+    period (str): One of utils.PERIODS.
+    sites (list, optional): Only read these sites. All sites if None.
+    start (str or int, optional): First period to read, as a label (e.g. 'Spring 2020')
+    or ordinal.
+    end (str or int, optional): Last period to read, as a label or ordinal.
+    metrics (list, optional): Only read these metrics. All metrics if None.
+
+    Returns:
+    pd.DataFrame: Period (as ordered labels), Site and the metrics, ordered by Period
+    and Site.
+    """
+    partition_dir = _partition_dir(group, period)
+    if not os.path.isdir(partition_dir):
+        raise ValueError(f"No {group} {period} results in {RESULTS_STORE_DIR}.")
+    dataset = ds.dataset(partition_dir, format="parquet", partitioning="hive")
+
+    filters = []
+    if sites is not None:
+        filters.append(ds.field("site").isin(list(sites)))
+    if start is not None:
+        filters.append(ds.field("Period") >= as_period_ordinal(start, period))
+    if end is not None:
+        filters.append(ds.field("Period") <= as_period_ordinal(end, period))
+    row_filter = None
+    for row_filter_part in filters:
+        row_filter = row_filter_part if row_filter is None else row_filter & row_filter_part
+
+    columns = ["Period", "site"] + (list(metrics) if metrics is not None else [
+        name for name in dataset.schema.names if name not in ("Period", "Period Label", "site")
+    ])
+    stored_results_df = (
+        dataset.to_table(columns=columns, filter=row_filter)
+        .to_pandas()
+        .rename(columns={"site": "Site"})
+    )
+    stored_results_df["Site"] = stored_results_df["Site"].astype(str)
+    stored_results_df = stored_results_df.sort_values(["Period", "Site"], kind="stable")
+    stored_results_df["Period"] = label_periods(stored_results_df["Period"], period)
+    return stored_results_df.reset_index(drop=True)
@@ -0,0 +1,105 @@
+import pandas as pd
+from constants import CONSUMER_CLASSES
+from profiling import profile_stage
+from fish_and_inverts_shared_metrics import build_species_class_table, calculate_class_totals
+from fish_metrics import FISH_METRIC_COLUMNS
+from invert_metrics import INVERTS_METRIC_COLUMNS
+from subs_metrics import SUBS_METRIC_COLUMNS, calculate_subs_totals
+from dive_effort import count_dives, count_window_dives
+from utils import normalise_by_dives, period_ordinals
+
+
+@profile_stage
+def build_daily_cube(
+    daily_df: pd.DataFrame, group: str, include_biomass: bool = False, keys: tuple = ("Date", "Site")
+) -> pd.DataFrame:
+    """
+    Build the additive daily cube of a group: the numerator of every metric (the
+    counts, biomass or cover before dividing by the number of dives) summed per Date
+    and Site. Any period's metrics are sums over the cube divided by that period's
+    number of dives, so the raw data only has to be scanned once.
+
+    Parameters:
+    daily_df (pd.DataFrame): The group's daily data, from create_group_daily_df.
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to include invert biomass.
+    keys (tuple): The columns to sum per, e.g. ("Survey_ID", "Date", "Site") for a cube
+    per dive from data aggregated with the same keys.
+
+    Returns:
+    pd.DataFrame: One row per Date and Site (or the keys) with one column per metric,
+    named after the metric it is the numerator of.
+    """
+    if group == "subs":
+        return calculate_subs_totals(daily_df, keys)[SUBS_METRIC_COLUMNS].reset_index()
+
+    if group == "fish":
+        species_class_table = build_species_class_table("fish", CONSUMER_CLASSES + ["commercial"])
+        biomass_classes = species_class_table[["Commercial"]]
+        metric_columns = FISH_METRIC_COLUMNS
+    else:
+        species_class_table = build_species_class_table("inverts", CONSUMER_CLASSES)
+        biomass_classes = species_class_table[[]]
+        metric_columns = INVERTS_METRIC_COLUMNS + (["Total Biomass Density"] if include_biomass else [])
+
+    daily_cube = calculate_class_totals(daily_df, species_class_table, keys=keys)
+    if "Total Biomass Density" in metric_columns:
+        biomass_totals = calculate_class_totals(
+            daily_df, biomass_classes, "Total Biomass", "Biomass Density", keys
+        ) / 1000  # Convert from g/ha^2 to g/m^2
+        daily_cube = daily_cube.join(biomass_totals)
+    return daily_cube[metric_columns].reset_index()
+
+
+def _divide_by_dives(period_totals: pd.DataFrame, dives: pd.Series) -> pd.DataFrame:
+    # Name the dives' levels like the totals' on a copy, the caller's Series is left as is
+    dives = dives.rename_axis(period_totals.index.names)
+    return normalise_by_dives(period_totals, dives).reset_index()
+
+
+@profile_stage
+def rollup_cube(daily_cube: pd.DataFrame, dive_index: pd.DataFrame, period: str) -> pd.DataFrame:
+    """
+    Roll the daily cube up to any period, giving the same results as the
+    calculate_*_metrics functions without another scan of the survey data.
+
+    Parameters:
+    daily_cube (pd.DataFrame): The cube from build_daily_cube.
+    dive_index (pd.DataFrame): The dives from dive_effort.build_dive_index.
+    period (str): One of utils.PERIODS (daily, monthly, seasonal or annual).
+
+    Returns:
+    pd.DataFrame: The metrics for each unique combination of Period (as ordinals) and Site.
+    """
+    period_totals = daily_cube.drop(columns="Date").groupby(
+        [period_ordinals(daily_cube["Date"], period).rename("Period"), "Site"], observed=True
+    ).sum()
+    return _divide_by_dives(period_totals, count_dives(dive_index, period))
+
+
+@profile_stage
+def rollup_window(
+    daily_cube: pd.DataFrame, dive_index: pd.DataFrame, start_date, end_date
+) -> pd.DataFrame:
+    """
+    Roll the daily cube up over a custom date window, giving one row per site.
+
+    Parameters:
+    daily_cube (pd.DataFrame): The cube from build_daily_cube.
+    dive_index (pd.DataFrame): The dives from dive_effort.build_dive_index.
+    start_date: First date of the window (inclusive), e.g. "2024-12-01".
+    end_date: Last date of the window (inclusive), e.g. "2025-02-28".
+
+    Returns:
+    pd.DataFrame: The metrics of each site over the window, with the window as a
+    "<start> to <end>" Period label.
+    """
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    window_cube = daily_cube[daily_cube["Date"].between(start_date, end_date)]
+
+    site_totals = window_cube.drop(columns="Date").groupby("Site", observed=True).sum()
+    window_results_df = _divide_by_dives(
+        site_totals, count_window_dives(dive_index, start_date, end_date)
+    )
+    window_results_df.insert(0, "Period", f"{start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}")
+    return window_results_df
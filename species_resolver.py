@@ -0,0 +1,208 @@
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+# Survey names are "<Parent> - <Qualifier>", e.g. "Grouper - Barramundi"
+PARENT_SEPARATOR = " - "
+
+# Length of the character n-grams used to find near matches
+NGRAM_SIZE = 3
+
+# Minimum Dice similarity (on n-grams) for a name to be suggested as a near match
+DEFAULT_MIN_SIMILARITY = 0.5
+
+_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+
+
+def normalise_species_name(name: str) -> str:
+    """
+    Normalise a species name so spellings that only differ in case, punctuation or
+    hyphen spacing get the same key, e.g. "Snapper - One-Spot", "SNAPPER -One spot"
+    and "Snapper - One-spot" all become "snapper - one spot".
+
+    Parameters:
+    name (str): The species name.
+
+    Returns:
+    str: The normalised name, with parent and qualifier joined by " - ".
+    """
+    name = str(name).translate(_QUOTES).casefold().strip(" '\"")
+    # A hyphen with a space on either side separates the parent from the qualifier,
+    # any other hyphen or punctuation is just a word break
+    parts = re.split(r"\s+-\s*|\s*-\s+", name, maxsplit=1)
+    return PARENT_SEPARATOR.join(
+        " ".join(re.sub(r"[^\w]+", " ", part).split()) for part in parts
+    )
+
+
+def parent_species_name(name: str) -> str:
+    """
+    Parameters:
+    name (str): The species name, e.g. "Grouper - Other".
+
+    Returns:
+    str: The parent name, e.g. "Grouper", or None if the name has no qualifier.
+    """
+    parent, separator, _ = normalise_species_name(name).partition(PARENT_SEPARATOR)
+    return parent if separator else None
+
+
+def _ngrams(normalised_name: str) -> Counter:
+    # Pad so short names and word starts get their own n-grams
+    padded = f" {normalised_name} "
+    return Counter(padded[start:start + NGRAM_SIZE] for start in range(len(padded) - NGRAM_SIZE + 1))
+
+
+class SpeciesResolver:
+    """
+    Resolves species names against a vocabulary (e.g. the biomass coefficients or a
+    consumer list) through an alias table of normalised names, and suggests near
+    matches from an n-gram index, so only names sharing n-grams with the query are
+    ever scored instead of every name in the vocabulary.
+    """
+
+    def __init__(self, names):
+        """
+        Parameters:
+        names (iterable): The species names of the vocabulary, as they are spelled in it.
+        """
+        self.names = list(dict.fromkeys(str(name) for name in names))
+        self.aliases = {}
+        for name in self.names:
+            # The first spelling of a normalised name wins, as in a lookup by exact name
+            self.aliases.setdefault(normalise_species_name(name), name)
+
+        # Postings of each n-gram: the positions of the names containing it and how
+        # often they contain it
+        postings = defaultdict(lambda: ([], []))
+        ngram_counts = []
+        for position, normalised_name in enumerate(self.aliases):
+            ngrams = _ngrams(normalised_name)
+            ngram_counts.append(sum(ngrams.values()))
+            for ngram, count in ngrams.items():
+                postings[ngram][0].append(position)
+                postings[ngram][1].append(count)
+        self._ngram_index = {
+            ngram: (np.array(positions, dtype=np.int32), np.array(counts, dtype=np.int32))
+            for ngram, (positions, counts) in postings.items()
+        }
+        self._ngram_counts = np.array(ngram_counts, dtype=float)
+        self._alias_names = list(self.aliases.values())
+
+    def __contains__(self, name: str) -> bool:
+        return self.resolve(name) is not None
+
+    def resolve(self, name: str, parent_fallback: bool = False) -> str:
+        """
+        Find the vocabulary's spelling of a name.
+
+        Parameters:
+        name (str): The species name, e.g. "Snapper - One-spot".
+        parent_fallback (bool): If the name isn't in the vocabulary, use its parent's
+        entry, e.g. "Grouper" for "Grouper - Other".
+
+        Returns:
+        str: The name as spelled in the vocabulary, or None if it can't be resolved.
+        """
+        resolved_name = self.aliases.get(normalise_species_name(name))
+        if resolved_name is None and parent_fallback:
+            parent = parent_species_name(name)
+            if parent is not None:
+                resolved_name = self.aliases.get(parent)
+        return resolved_name
+
+    def resolve_all(self, names, parent_fallback: bool = False) -> dict:
+        """
+        Resolve many names, e.g. the distinct species of a survey export.
+
+        Parameters:
+        names (iterable): The species names.
+        parent_fallback (bool): Fall back to the parent's entry, see resolve.
+
+        Returns:
+        dict: The vocabulary's spelling of every name that could be resolved, keyed by name.
+        """
+        resolved_names = {}
+        for name in dict.fromkeys(names):
+            resolved_name = self.resolve(name, parent_fallback)
+            if resolved_name is not None:
+                resolved_names[name] = resolved_name
+        return resolved_names
+
+    def suggest(self, name: str, limit: int = 3, min_similarity: float = DEFAULT_MIN_SIMILARITY) -> list:
+        """
+        Suggest the vocabulary names closest to a name, by the Dice similarity of their
+        character n-grams. Only names sharing at least one n-gram are scored.
+
+        Parameters:
+        name (str): The species name, e.g. "Grouper - Barramundi Cod".
+        limit (int): The maximum number of suggestions.
+        min_similarity (float): The minimum similarity, between 0 and 1.
+
+        Returns:
+        list: (name, similarity) pairs, most similar first.
+        """
+        ngrams = _ngrams(normalise_species_name(name))
+        matched = [(self._ngram_index[ngram], count) for ngram, count in ngrams.items() if ngram in self._ngram_index]
+        if not matched:
+            return []
+        positions = np.concatenate([postings[0] for postings, _ in matched])
+        shared = np.concatenate([np.minimum(postings[1], count) for postings, count in matched])
+        shared_counts = np.bincount(positions, weights=shared, minlength=len(self._ngram_counts))
+
+        similarities = 2 * shared_counts / (sum(ngrams.values()) + self._ngram_counts)
+        candidates = np.flatnonzero(similarities >= min_similarity)
+        suggestions = [(self._alias_names[position], round(float(similarities[position]), 3)) for position in candidates]
+        suggestions.sort(key=lambda suggestion: (-suggestion[1], suggestion[0]))
+        return suggestions[:limit]
+
+    def describe_missing(self, names) -> str:
+        """
+        List names missing from the vocabulary with their closest suggestions, for
+        error messages.
+
+        Parameters:
+        names (iterable): The missing species names.
+
+        Returns:
+        str: One name per line, with "did you mean" suggestions where there are any.
+        """
+        lines = []
+        for name in sorted(names, key=str):
+            suggestions = self.suggest(name)
+            hint = f" (did you mean {', '.join(repr(match) for match, _ in suggestions)}?)" if suggestions else ""
+            lines.append(f"  {name}{hint}")
+        return "\n".join(lines)
+
+
+def match_species_positions(
+    vocabulary: pd.Index, names, resolver: SpeciesResolver = None, parent_fallback: bool = False
+) -> np.ndarray:
+    """
+    Find the position of every name in a vocabulary, matching exact names first and
+    resolving only the distinct names without an exact match.
+
+    Parameters:
+    vocabulary (pd.Index): The unique species names, e.g. the biomass coefficients' species.
+    names (array-like): The species names to match, e.g. a Species column.
+    resolver (SpeciesResolver, optional): The resolver over the vocabulary. Built when
+    needed if None.
+    parent_fallback (bool): Fall back to the parent's entry, see SpeciesResolver.resolve.
+
+    Returns:
+    np.ndarray: The position of each name in the vocabulary, -1 where it can't be resolved.
+    """
+    positions = vocabulary.get_indexer(names)
+    unmatched = positions < 0
+    if unmatched.any():
+        if resolver is None:
+            resolver = SpeciesResolver(vocabulary)
+        codes, unmatched_names = pd.factorize(np.asarray(names, dtype=object)[unmatched], use_na_sentinel=False)
+        resolved_names = resolver.resolve_all(unmatched_names, parent_fallback)
+        resolved_positions = vocabulary.get_indexer(
+            [resolved_names.get(name) for name in unmatched_names]
+        )
+        positions[unmatched] = resolved_positions[codes]
+    return positions
@@ -1,8 +1,36 @@
 import pandas as pd
-from utils import prepare_results_df, add_periods, create_daily_df
-
+import numpy as np
+from utils import prepare_results_df, period_ordinals, create_daily_df, normalise_by_dives, add_metric_to_results
+from profiling import profile_stage
+
+# Output columns, in the order they are written to the results files
+SUBS_METRIC_COLUMNS = [
+    "Rubble Cover",
+    "Fresh Algae Cover",
+    "Soft Coral Cover",
+    "Hard Coral Cover",
+    "Bleaching",
+]
+
+# Define fresh algae categories - I don't expect this to change hence why I've
+# defined it in code and not as an input file
+FRESH_ALGAE_CATEGORIES = ["Algae Turf", "Algae Macro", "Algae Filamentous", "Algae Seagrass"]
+
+# Which substrate Groups count towards each cover. A new cover only needs a rule here,
+# the rules are evaluated once per distinct Group and the data is still summed in one pass
+SUBS_COVER_RULES = {
+    "Rubble Cover": lambda groups: groups.str.contains("Rubble"),
+    "Fresh Algae Cover": lambda groups: groups.isin(FRESH_ALGAE_CATEGORIES),
+    "Soft Coral Cover": lambda groups: groups.str.contains("Soft Coral"),
+    "Hard Coral Cover": lambda groups: groups.str.contains("Hard Coral"),
+}
+
+# Fully Bleached counts as 1, Partially Bleached counts as 0.5
+BLEACHING_WEIGHTS = {"Fully Bleaching": 1.0, "Partially Bleaching": 0.5}
+
+@profile_stage
 def calculate_subs_metrics(pre_processed_subs_data_df: pd.DataFrame, daily_dive_numbers_df: pd.DataFrame,
-    period: str) -> pd.DataFrame:
+    period: str, daily_subs_data_df: pd.DataFrame = None) -> pd.DataFrame:
     """
     Calculate various subs metrics for each unique combination of Period and Site, or aggregated by month or season.
 
@@ -10,22 +38,27 @@ def calculate_subs_metrics(pre_processed_subs_data_df: pd.DataFrame, daily_dive_
     pre_processed_subs_data_df (pd.DataFrame): The DataFrame containing subs data.
     daily_dive_numbers_df (pd.DataFrame): The DataFrame containing the number of dives per day for each site.
     period (str): The period for aggregation. Options are "monthly", or "seasonal".
+    daily_subs_data_df (pd.DataFrame, optional): The output of create_daily_df for subs,
+    to reuse it across periods. Calculated from pre_processed_subs_data_df if None.
 
     Returns:
     pd.DataFrame: A DataFrame with aggregated metrics based on the specified period.
     """
-    daily_subs_data_df = create_daily_df(pre_processed_subs_data_df, "subs")
-    daily_subs_data_df = add_periods(daily_subs_data_df, period)
+    if daily_subs_data_df is None:
+        daily_subs_data_df = create_daily_df(pre_processed_subs_data_df, "subs")
+    daily_subs_data_df = daily_subs_data_df.assign(
+        Period=period_ordinals(daily_subs_data_df["Date"], period)
+    )
 
-    results_df = prepare_results_df(daily_subs_data_df)
-    results_df = calculate_hard_coral_cover(daily_subs_data_df, results_df, daily_dive_numbers_df)
-    results_df = calculate_soft_coral_cover(daily_subs_data_df, results_df, daily_dive_numbers_df)
-    results_df = calculate_fresh_algae_cover(daily_subs_data_df, results_df, daily_dive_numbers_df) 
-    results_df = calculate_rubber_cover(daily_subs_data_df, results_df, daily_dive_numbers_df)
-    results_df = calculate_bleaching(daily_subs_data_df, results_df, daily_dive_numbers_df)
+    # Classify each distinct Group/Status once, then sum every cover and the weighted
+    # bleaching in one grouped pass
+    subs_totals = calculate_subs_totals(daily_subs_data_df)
+    subs_densities = normalise_by_dives(subs_totals, daily_dive_numbers_df)
 
-    return results_df
+    results_df = prepare_results_df(daily_subs_data_df)
+    return results_df.join(subs_densities[SUBS_METRIC_COLUMNS], on=["Period", "Site"]).fillna(0)
 
+@profile_stage
 def calculate_hard_coral_cover(daily_subs_data_df, results_df, daily_dive_numbers_df):
     """
     Calculate hard coral cover metrics.
@@ -41,20 +74,15 @@ def calculate_hard_coral_cover(daily_subs_data_df, results_df, daily_dive_number
     # Count number of hard coral records
     hard_coral_cover = (
         daily_subs_data_df[daily_subs_data_df["Group"].str.contains("Hard Coral")]
-        .groupby(["Period", "Site"])["Total"]
+        .groupby(["Period", "Site"], observed=True)["Total"]
         .sum()
-        .reset_index()
-        .rename(columns={"Total": "Hard Coral Cover"})
     )
 
     # Normalise by the number of dives
-    hard_coral_cover["Hard Coral Cover"] = hard_coral_cover.apply(
-        lambda row: row["Hard Coral Cover"]
-        / daily_dive_numbers_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    return pd.merge(hard_coral_cover, results_df, "right").fillna(0)
+    hard_coral_cover = normalise_by_dives(hard_coral_cover, daily_dive_numbers_df)
+    return add_metric_to_results(results_df, hard_coral_cover, "Hard Coral Cover", loc=2)
 
+@profile_stage
 def calculate_soft_coral_cover(daily_subs_data_df, results_df, daily_dive_numbers_df):
     """
     Calculate soft coral cover metrics.
@@ -70,20 +98,15 @@ def calculate_soft_coral_cover(daily_subs_data_df, results_df, daily_dive_number
     # Count number of soft coral records
     soft_coral_cover = (
         daily_subs_data_df[daily_subs_data_df["Group"].str.contains("Soft Coral")]
-        .groupby(["Period", "Site"])["Total"]
+        .groupby(["Period", "Site"], observed=True)["Total"]
         .sum()
-        .reset_index()
-        .rename(columns={"Total": "Soft Coral Cover"})
     )
 
     # Normalise by the number of dives
-    soft_coral_cover["Soft Coral Cover"] = soft_coral_cover.apply(
-        lambda row: row["Soft Coral Cover"]
-        / daily_dive_numbers_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    return pd.merge(soft_coral_cover, results_df, "right").fillna(0)
+    soft_coral_cover = normalise_by_dives(soft_coral_cover, daily_dive_numbers_df)
+    return add_metric_to_results(results_df, soft_coral_cover, "Soft Coral Cover", loc=2)
 
+@profile_stage
 def calculate_fresh_algae_cover(daily_subs_data_df, results_df, daily_dive_numbers_df):
     """
     Calculate fresh algae cover metrics.
@@ -97,25 +120,17 @@ def calculate_fresh_algae_cover(daily_subs_data_df, results_df, daily_dive_numbe
     pd.DataFrame: Updated results DataFrame with fresh algae cover metrics.
     """
     ## Count number of fresh algae records
-    # Define fresh algae categories - I don't expect this to change hence why I've
-    # defined it in code and not as an input file
-    fresh_algae_categories = ["Algae Turf", "Algae Macro", "Algae Filamentous", "Algae Seagrass"]
     fresh_algae_cover = (
-        daily_subs_data_df[daily_subs_data_df["Group"].isin(fresh_algae_categories)]
-        .groupby(["Period", "Site"])["Total"]
+        daily_subs_data_df[daily_subs_data_df["Group"].isin(FRESH_ALGAE_CATEGORIES)]
+        .groupby(["Period", "Site"], observed=True)["Total"]
         .sum()
-        .reset_index()
-        .rename(columns={"Total": "Fresh Algae Cover"})
     )
 
     # Normalise by the number of dives
-    fresh_algae_cover["Fresh Algae Cover"] = fresh_algae_cover.apply(
-        lambda row: row["Fresh Algae Cover"]
-        / daily_dive_numbers_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    return pd.merge(fresh_algae_cover, results_df, "right").fillna(0)
+    fresh_algae_cover = normalise_by_dives(fresh_algae_cover, daily_dive_numbers_df)
+    return add_metric_to_results(results_df, fresh_algae_cover, "Fresh Algae Cover", loc=2)
 
+@profile_stage
 def calculate_rubber_cover(daily_subs_data_df, results_df, daily_dive_numbers_df): 
     """
     Calculate rubber cover metrics.
@@ -131,20 +146,15 @@ def calculate_rubber_cover(daily_subs_data_df, results_df, daily_dive_numbers_df
     # Count rubble records
     rubble_cover = (
         daily_subs_data_df[daily_subs_data_df["Group"].str.contains("Rubble")]
-        .groupby(["Period", "Site"])["Total"]
+        .groupby(["Period", "Site"], observed=True)["Total"]
         .sum()
-        .reset_index()
-        .rename(columns={"Total": "Rubble Cover"})
     )
 
     # Normalise by the number of dives
-    rubble_cover["Rubble Cover"] = rubble_cover.apply(
-        lambda row: row["Rubble Cover"]
-        / daily_dive_numbers_df.loc[(row["Period"], row["Site"])],
-        axis=1,
-    )
-    return pd.merge(rubble_cover, results_df, "right").fillna(0)
+    rubble_cover = normalise_by_dives(rubble_cover, daily_dive_numbers_df)
+    return add_metric_to_results(results_df, rubble_cover, "Rubble Cover", loc=2)
 
+@profile_stage
 def calculate_bleaching(daily_subs_data_df, results_df, daily_dive_numbers_df):
     """
     Calculate bleaching metrics - Fully Bleached counts as 1, Partially Bleached counts as 0.5.
@@ -158,28 +168,76 @@ def calculate_bleaching(daily_subs_data_df, results_df, daily_dive_numbers_df):
     pd.DataFrame: Updated results DataFrame with bleaching metrics.
     """
     # Count fully bleached records
-    fully_bleached_cover = (
+    fully_bleached = (
         daily_subs_data_df[daily_subs_data_df["Status"] == "Fully Bleaching"]
-        .groupby(["Period", "Site"])["Total"]
+        .groupby(["Period", "Site"], observed=True)["Total"]
         .sum()
-        .reset_index()
-        .rename(columns={"Total": "Fully Bleached"})
-    )   
-    results_df = pd.merge(results_df, fully_bleached_cover, how="left").fillna(0)
+    )
     # Count partially bleached records and divide by 2
-    partially_bleached_cover = (
+    partially_bleached = (
         daily_subs_data_df[daily_subs_data_df["Status"] == "Partially Bleaching"]
-        .groupby(["Period", "Site"])["Total"]
+        .groupby(["Period", "Site"], observed=True)["Total"]
         .sum()
-        .reset_index()
-        .rename(columns={"Total": "Partially Bleached"})
     )
-    results_df = pd.merge(results_df, partially_bleached_cover, how="left").fillna(0)
+    bleached = fully_bleached.add(partially_bleached / 2, fill_value=0)
+
+    # Normalise by the number of dives
+    bleaching = normalise_by_dives(bleached, daily_dive_numbers_df)
+    return add_metric_to_results(results_df, bleaching, "Bleaching")
+
 
-    results_df["Bleaching"] = results_df.apply(
-        lambda row: (row["Fully Bleached"] + row["Partially Bleached"]/2)
-        / daily_dive_numbers_df.loc[(row["Period"], row["Site"])],
-        axis=1,
+def classify_subs_categories(daily_subs_data_df: pd.DataFrame) -> tuple:
+    """
+    Classify every distinct Group/Status combination into the subs metrics it counts
+    towards, evaluating SUBS_COVER_RULES and BLEACHING_WEIGHTS once per distinct value
+    rather than once per row.
+
+    Parameters:
+    daily_subs_data_df (pd.DataFrame): The DataFrame containing subs data.
+
+    Returns:
+    tuple: The category code of each row, and a (categories x SUBS_METRIC_COLUMNS)
+    array of the weight each category's Total counts with in each metric.
+    """
+    # Covers only depend on the Group and bleaching only on the Status, so each column
+    # is factorised on its own and a category is a (Group, Status) pair of codes
+    group_codes, groups = pd.factorize(daily_subs_data_df["Group"], use_na_sentinel=False)
+    status_codes, statuses = pd.factorize(daily_subs_data_df["Status"], use_na_sentinel=False)
+    # A missing Group or Status gets its own code, as an empty string that no rule or
+    # bleaching weight matches, rather than -1 which would index from the end
+    groups = pd.Series(np.asarray(groups, dtype=object)).fillna("").astype(str)
+    statuses = pd.Series(np.asarray(statuses, dtype=object)).fillna("").astype(str)
+    codes = group_codes * len(statuses) + status_codes
+
+    group_weights = np.column_stack(
+        [SUBS_COVER_RULES[metric](groups).to_numpy(dtype=float) for metric in SUBS_METRIC_COLUMNS[:-1]]
+    )
+    status_weights = statuses.map(BLEACHING_WEIGHTS).fillna(0).to_numpy(dtype=float)
+    category_weights = np.column_stack([
+        np.repeat(group_weights, len(statuses), axis=0),
+        np.tile(status_weights, len(groups)),
+    ])
+    return codes, category_weights
+
+
+@profile_stage
+def calculate_subs_totals(daily_subs_data_df: pd.DataFrame, keys: tuple = ("Period", "Site")) -> pd.DataFrame:
+    """
+    Sum the numerator of every subs metric (before normalising by the number of dives)
+    for each unique combination of the keys, in one grouped pass.
+
+    Parameters:
+    daily_subs_data_df (pd.DataFrame): The DataFrame containing subs data.
+    keys (tuple): The columns to group by.
+
+    Returns:
+    pd.DataFrame: The summed numerators indexed by the keys, one column per metric.
+    """
+    codes, category_weights = classify_subs_categories(daily_subs_data_df)
+    totals = daily_subs_data_df["Total"].to_numpy(dtype=float)
+    numerators = pd.DataFrame(
+        category_weights[codes] * totals[:, np.newaxis],
+        columns=SUBS_METRIC_COLUMNS,
+        index=daily_subs_data_df.index,
     )
-    results_df.drop(["Fully Bleached", "Partially Bleached"], axis=1, inplace=True)
-    return results_df
\ No newline at end of file
+    return numerators.groupby([daily_subs_data_df[key] for key in keys], observed=True).sum()
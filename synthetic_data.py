@@ -0,0 +1,247 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from constants import (
+    CONSTANTS_DIR,
+    CONSUMER_CLASSES,
+    load_biomass_coeffs,
+    load_consumer_species,
+)
+
+# Column order of the survey exports
+SURVEY_COLUMNS = {
+    "fish": [
+        "Observer_name_1", "Observer_name_2", "Date", "Site", "Zone", "Depth",
+        "Water_Temp", "Visibility", "Current", "Species", "Size",
+        "Diver_1_count", "Diver_2_count", "Total", "Survey_Status", "Survey_ID",
+    ],
+    "subs": [
+        "Observer_name_1", "Observer_name_2", "Date", "Site", "Zone", "Depth",
+        "Water_Temp", "Visibility", "Current", "Group", "Status",
+        "Diver_1_count", "Diver_2_count", "Total", "Survey_Status", "Survey_ID",
+    ],
+}
+SURVEY_COLUMNS["inverts"] = SURVEY_COLUMNS["fish"]
+
+SITES = [
+    "Andulay MPA",
+    "Antulang",
+    "Basak Can-Unsang MPA",
+    "Dalakit MPA",
+    "Guinsuan MPA",
+    "Kookoos",
+    "Latason MPA",
+    "Lutoban North MPA",
+    "Lutoban Pier",
+    "Lutoban South MPA",
+    "Maluay Malatapay MPA",
+    "Mojon MPA",
+    "Salag MPA",
+    "Santa Catalina Cawitan",
+    "Santa Catalina Manalongon",
+]
+
+OBSERVERS = ["Andreas Kerger", "Flemming Fogh Larsen", "Tobes", "Jess", "Marco", "Pia"]
+
+DEPTHS = ["Shallow", "Medium", "Deep"]
+
+# Size bins as recorded on the survey slates. >120 is filtered out by pre-processing
+SIZE_BINS = {
+    "fish": [
+        "0-5", "5-10", "10-15", "15-20", "20-25", "25-30", "30-35", "35-40", "40-45",
+        "45-50", "50-60", "60-70", "70-80", "80-90", "90-100", "100-110", "110-120", ">120",
+    ],
+    "inverts": [
+        "0-5", "6-10", "11-15", "16-20", "21-25", "26-30", "31-35", "36-40", "41-45",
+        "46-50", "51-60", "71-80", "81-90", "110-120",
+    ],
+}
+
+# Substrate (Group, Status) combinations with their relative frequency in the exports
+SUBS_CATEGORIES = [
+    ("Algae Coralline", "Healthy", 179),
+    ("Algae Filamentous", "Healthy", 104),
+    ("Algae Halimeda", "Healthy", 86),
+    ("Algae Macro", "Healthy", 182),
+    ("Algae Macro", "Silt", 2),
+    ("Algae Seagrass", "Healthy", 32),
+    ("Algae Turf", "Healthy", 199),
+    ("Hard Coral Branching", "Healthy", 175),
+    ("Hard Coral Branching", "Partially Bleaching", 20),
+    ("Hard Coral Branching", "Fully Bleaching", 5),
+    ("Hard Coral Branching", "Disease", 4),
+    ("Hard Coral Branching", "Recently Killed Coral", 4),
+    ("Hard Coral Encrusting", "Healthy", 193),
+    ("Hard Coral Encrusting", "Partially Bleaching", 22),
+    ("Hard Coral Encrusting", "Silt", 9),
+    ("Hard Coral Massive", "Healthy", 25),
+    ("Hard Coral Plating", "Healthy", 56),
+    ("Hard Coral Solitary", "Healthy", 143),
+    ("Hard Coral Solitary", "Fully Bleaching", 4),
+    ("Hard Coral Submassive", "Healthy", 186),
+    ("Hard Coral Submassive", "Partially Bleaching", 17),
+    ("Hard Coral Tabulate", "Healthy", 49),
+    ("Other Cnidarian Hydroid", "Healthy", 55),
+    ("Other Cnidarian Zoanthid", "Healthy", 47),
+    ("Sessile invertebrates Ascidian", "Healthy", 107),
+    ("Sessile invertebrates Sponge - Encrusting", "Healthy", 146),
+    ("Sessile invertebrates Sponge - Irregular", "Healthy", 170),
+    ("Soft Coral", "Healthy", 163),
+    ("Soft Coral", "Fully Bleaching", 1),
+    ("Soft Coral Gorgonian", "Healthy", 12),
+    ("Substrate Rock", "Healthy", 100),
+    ("Substrate Rubble", "Healthy", 190),
+    ("Substrate Sand", "Healthy", 202),
+]
+
+# Average number of export rows recorded per dive
+ROWS_PER_DIVE = {"fish": 40, "inverts": 10, "subs": 25}
+
+# Share of dives recorded with Survey_Status 0 (invalid)
+INVALID_SURVEY_SHARE = 0.02
+
+
+def survey_species(group: str) -> list:
+    """
+    List the species that can appear in synthetic data of a group: every species in
+    one of the group's consumer lists that also has biomass coefficients, so the
+    synthetic data passes the constants checks with and without biomass.
+
+    Parameters:
+    group (str): Either fish or inverts.
+
+    Returns:
+    list: The species names, sorted.
+    """
+    consumer_species = set()
+    for consumer in CONSUMER_CLASSES:
+        consumer_species |= load_consumer_species(consumer, group)
+    biomass_species = set(load_biomass_coeffs(f"{CONSTANTS_DIR}/biomass_coeffs_{group}.csv").species)
+    return sorted(consumer_species & biomass_species)
+
+
+def generate_survey_data(
+    group: str,
+    n_rows: int,
+    seed: int = 0,
+    start_date: str = "2017-08-01",
+    end_date: str = "2025-05-31",
+) -> pd.DataFrame:
+    """
+    Generate a synthetic survey export that looks like the real thing: real site,
+    species, size bin and substrate names, dives with 24 character hex Survey_IDs
+    spread over the date range, a few invalid surveys and skewed species frequencies.
+    Everything is generated per dive and per row with NumPy, so 10M rows take seconds.
+
+    Parameters:
+    group (str): Either fish, inverts or subs.
+    n_rows (int): Number of rows to generate.
+    seed (int): Seed of the random generator, the same seed gives the same data.
+    start_date (str): First possible survey date.
+    end_date (str): Last possible survey date.
+
+    Returns:
+    pd.DataFrame: The synthetic export, with the columns (and text dates) of a real one.
+    """
+    if group not in SURVEY_COLUMNS:
+        raise ValueError(f"Unknown group '{group}', expected one of {list(SURVEY_COLUMNS)}.")
+    rng = np.random.default_rng(seed)
+
+    # Dives first, in date order like the exports, then each row belongs to one dive
+    n_dives = max(1, n_rows // ROWS_PER_DIVE[group])
+    days = pd.date_range(start_date, end_date, freq="D")
+    day_codes = np.sort(rng.integers(0, len(days), n_dives))
+    dive_of_row = np.arange(n_rows) * n_dives // max(n_rows, 1)
+
+    dives = {
+        "Observer_name_1": rng.integers(0, len(OBSERVERS), n_dives),
+        "Observer_name_2": rng.integers(0, len(OBSERVERS), n_dives),
+        "Site": rng.integers(0, len(SITES), n_dives),
+        "Zone": rng.integers(1, 4, n_dives),
+        "Depth": rng.integers(0, len(DEPTHS), n_dives),
+        "Water_Temp": rng.integers(26, 32, n_dives),
+        "Visibility": rng.integers(5, 26, n_dives),
+        "Current": rng.integers(0, 3, n_dives),
+        "Survey_Status": (rng.random(n_dives) >= INVALID_SURVEY_SHARE).astype(int),
+    }
+    survey_ids = np.array(
+        [f"{high:08x}{low:016x}" for high, low in zip(
+            rng.integers(0, 2**32, n_dives, dtype=np.uint64),
+            rng.integers(0, 2**63, n_dives, dtype=np.uint64),
+        )]
+    )
+
+    # Text columns are built from the distinct values and indexed by code
+    survey_data_df = pd.DataFrame({
+        "Observer_name_1": np.array(OBSERVERS, dtype=object)[dives["Observer_name_1"][dive_of_row]],
+        "Observer_name_2": np.array(OBSERVERS, dtype=object)[dives["Observer_name_2"][dive_of_row]],
+        "Date": days.strftime("%Y-%m-%d 00:00:00").to_numpy(dtype=object)[day_codes[dive_of_row]],
+        "Site": np.array(SITES, dtype=object)[dives["Site"][dive_of_row]],
+        "Zone": dives["Zone"][dive_of_row],
+        "Depth": np.array(DEPTHS, dtype=object)[dives["Depth"][dive_of_row]],
+        "Water_Temp": dives["Water_Temp"][dive_of_row],
+        "Visibility": dives["Visibility"][dive_of_row],
+        "Current": dives["Current"][dive_of_row],
+    })
+
+    if group == "subs":
+        weights = np.array([weight for _, _, weight in SUBS_CATEGORIES], dtype=float)
+        categories = rng.choice(len(SUBS_CATEGORIES), n_rows, p=weights / weights.sum())
+        survey_data_df["Group"] = np.array([g for g, _, _ in SUBS_CATEGORIES], dtype=object)[categories]
+        survey_data_df["Status"] = np.array([s for _, s, _ in SUBS_CATEGORIES], dtype=object)[categories]
+        diver_1_count = rng.integers(1, 6, n_rows)
+        diver_2_count = np.zeros(n_rows, dtype=int)
+    else:
+        # A few common species make up most sightings, as on a real reef
+        species = np.array(survey_species(group), dtype=object)
+        species_weights = 1 / np.arange(1, len(species) + 1)
+        species_weights = rng.permutation(species_weights / species_weights.sum())
+        survey_data_df["Species"] = species[rng.choice(len(species), n_rows, p=species_weights)]
+
+        # Small creatures are seen far more often than big ones
+        size_bins = np.array(SIZE_BINS[group], dtype=object)
+        size_weights = 0.6 ** np.arange(len(size_bins))
+        survey_data_df["Size"] = size_bins[
+            rng.choice(len(size_bins), n_rows, p=size_weights / size_weights.sum())
+        ]
+        diver_1_count = rng.geometric(0.3, n_rows)
+        diver_2_count = rng.geometric(0.3, n_rows) - 1
+
+    survey_data_df["Diver_1_count"] = diver_1_count
+    survey_data_df["Diver_2_count"] = diver_2_count
+    survey_data_df["Total"] = diver_1_count + diver_2_count
+    survey_data_df["Survey_Status"] = dives["Survey_Status"][dive_of_row]
+    survey_data_df["Survey_ID"] = survey_ids[dive_of_row]
+    return survey_data_df[SURVEY_COLUMNS[group]]
+
+
+def write_synthetic_export(
+    file_url: str, group: str, n_rows: int, seed: int = 0
+) -> str:
+    """
+    Generate a synthetic survey export and save it as a CSV file.
+
+    Parameters:
+    file_url (str): Path to the CSV file to write.
+    group (str): Either fish, inverts or subs.
+    n_rows (int): Number of rows to generate.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    str: The path of the written file.
+    """
+    generate_survey_data(group, n_rows, seed).to_csv(file_url, index=False)
+    print(f"Saved {n_rows} synthetic {group} rows to {file_url}")
+    return file_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic survey export.")
+    parser.add_argument("group", choices=list(SURVEY_COLUMNS))
+    parser.add_argument("rows", type=int, help="Number of rows to generate")
+    parser.add_argument("output", help="Path to the CSV file to write")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_synthetic_export(args.output, args.group, args.rows, args.seed)
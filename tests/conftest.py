@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules live at the top of the repository and read data/constants by relative
+# path, so tests import them from there and run from there
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.chdir(REPO_DIR)
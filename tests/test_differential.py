@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import fish_and_inverts_shared_metrics
+from differential import compare_frames, run_differential_test
+from pre_processing import pre_process_data
+from synthetic_data import generate_survey_data
+from utils import PERIODS
+
+# (group, include_biomass) combinations with every metric between them
+GROUP_CASES = [("fish", False), ("inverts", True), ("subs", False)]
+
+SYNTHETIC_ROWS = 20_000
+
+
+@pytest.fixture(scope="module")
+def pre_processed_data():
+    return {
+        group: pre_process_data(generate_survey_data(group, SYNTHETIC_ROWS, seed=1), group, verbose=False)
+        for group, _ in GROUP_CASES
+    }
+
+
+@pytest.mark.parametrize("period", PERIODS)
+@pytest.mark.parametrize("group, include_biomass", GROUP_CASES)
+def test_rollup_engine_matches_legacy(pre_processed_data, group, include_biomass, period):
+    report = run_differential_test(
+        pre_processed_data[group], period, group, include_biomass, baseline="legacy", candidate="rollup"
+    )
+    assert report["cells"] > 0
+    assert report["differences"].empty, report["differences"].head().to_string()
+
+
+@pytest.mark.parametrize("baseline", ["legacy", "rollup"])
+@pytest.mark.parametrize("period", PERIODS)
+@pytest.mark.parametrize("group, include_biomass", GROUP_CASES)
+def test_arrow_engine_matches_pandas_engines(pre_processed_data, group, include_biomass, period, baseline):
+    report = run_differential_test(
+        pre_processed_data[group], period, group, include_biomass, baseline=baseline, candidate="arrow"
+    )
+    assert report["cells"] > 0
+    assert report["differences"].empty, report["differences"].head().to_string()
+
+
+def test_differential_test_catches_an_aggregation_bug(pre_processed_data, monkeypatch):
+    # Drop every species from its classes in the shared aggregation core only, the
+    # per metric functions of the legacy engine look the species up on their own
+    align_species_class_table = fish_and_inverts_shared_metrics.align_species_class_table
+
+    def align_no_species(species_class_table, species):
+        memberships = align_species_class_table(species_class_table, species)
+        return pd.DataFrame(np.zeros(memberships.shape), columns=memberships.columns)
+
+    monkeypatch.setattr(fish_and_inverts_shared_metrics, "align_species_class_table", align_no_species)
+    report = run_differential_test(
+        pre_processed_data["fish"], "seasonal", "fish", baseline="legacy", candidate="rollup"
+    )
+
+    mismatched_metrics = set(report["differences"].loc[lambda df: df["Status"] == "mismatch", "Metric"])
+    assert "Herbivore Density" in mismatched_metrics
+    assert "Total Density" not in mismatched_metrics
+
+
+def test_compare_frames_reports_every_kind_of_difference():
+    expected_df = pd.DataFrame({
+        "Period": [1, 1, 2],
+        "Site": ["a", "b", "a"],
+        "Total Density": [1.0, 2.0, 3.0],
+        "Herbivore Density": [0.5, float("nan"), 1.5],
+    })
+    actual_df = pd.DataFrame({
+        "Period": [2, 1, 3],
+        "Site": ["a", "a", "a"],
+        "Total Density": [3.0, 1.0 + 1e-6, 4.0],
+        "Herbivore Density": [1.5, 0.5, 2.0],
+    })
+
+    differences_df = compare_frames(expected_df, actual_df)
+
+    statuses = differences_df.set_index(["Period", "Site", "Metric"])["Status"].to_dict()
+    assert statuses == {
+        (1, "a", "Total Density"): "mismatch",
+        (1, "b", "Total Density"): "missing_actual",
+        (1, "b", "Herbivore Density"): "missing_actual",
+        (3, "a", "Total Density"): "missing_expected",
+        (3, "a", "Herbivore Density"): "missing_expected",
+    }
+    assert compare_frames(expected_df, expected_df.iloc[::-1]).empty
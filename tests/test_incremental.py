@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+import pytest
+
+from incremental import update_results_incrementally
+from pipeline import calculate_group_metrics
+from pre_processing import pre_process_data
+from results_store import read_results_store, write_results_store
+from synthetic_data import generate_survey_data
+from utils import determine_number_of_dives_per_period, load_site_results, period_ordinals, save_site_dataframes
+
+# The number of seasons at the end of the synthetic export that make up the delta
+DELTA_SEASONS = 2
+
+
+@pytest.fixture(autouse=True)
+def output_in_tmp_path(tmp_path, monkeypatch):
+    # The outputs are written relative to the working directory, next to the constants
+    constants_dir = os.path.abspath("data/constants")
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    os.symlink(constants_dir, "data/constants")
+
+
+def calculate_fish_metrics(raw_df: pd.DataFrame) -> pd.DataFrame:
+    pre_processed_df = pre_process_data(raw_df, "fish", verbose=False)
+    dives = determine_number_of_dives_per_period(pre_processed_df, "seasonal")
+    results_df = calculate_group_metrics(pre_processed_df, dives, "seasonal", "fish")
+    return results_df.astype({"Site": str}).sort_values(["Period", "Site"], ignore_index=True)
+
+
+def test_delta_update_matches_a_full_recompute():
+    raw_df = generate_survey_data("fish", 20_000, seed=3)
+    seasons = period_ordinals(pd.to_datetime(raw_df["Date"]), "seasonal")
+    in_delta = (seasons > seasons.max() - DELTA_SEASONS).to_numpy()
+    # The stored results already have the delta's seasons, from half of their rows
+    in_base = ~in_delta | (raw_df.index % 2 == 0)
+    base_results_df = calculate_fish_metrics(raw_df[in_base])
+    save_site_dataframes(base_results_df, "seasonal", "fish")
+    write_results_store(base_results_df, "seasonal", "fish")
+
+    delta_results_df = update_results_incrementally(raw_df[in_delta], "seasonal", "fish")
+
+    full_results_df = calculate_fish_metrics(raw_df)
+    assert delta_results_df["Period"].nunique() == DELTA_SEASONS
+    # The stored rows of the delta's seasons were out of date
+    delta_seasons = delta_results_df["Period"].unique()
+    base_delta_density = base_results_df.loc[base_results_df["Period"].isin(delta_seasons), "Total Density"]
+    full_delta_density = full_results_df.loc[full_results_df["Period"].isin(delta_seasons), "Total Density"]
+    assert len(base_delta_density) == len(delta_results_df)
+    assert (base_delta_density.to_numpy() != full_delta_density.to_numpy()).any()
+
+    saved_results_df = load_site_results(full_results_df["Site"].unique(), "seasonal", "fish")
+    pd.testing.assert_frame_equal(
+        saved_results_df.sort_values(["Period", "Site"], ignore_index=True),
+        full_results_df.round(2),
+        check_dtype=False,
+    )
+    # The store keeps the unrounded values
+    stored_results_df = read_results_store("fish", "seasonal")
+    pd.testing.assert_frame_equal(
+        stored_results_df.drop(columns="Period"),
+        full_results_df.drop(columns="Period"),
+        check_dtype=False,
+    )
@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+from dive_effort import count_dives
+from ingestion import SURVEY_SCHEMAS, read_survey_chunks, stream_survey_data
+from pre_processing import pre_process_data
+from synthetic_data import write_synthetic_export
+from utils import create_daily_df
+
+DAILY_KEYS = {
+    "fish": ["Date", "Site", "Species", "Size"],
+    "subs": ["Date", "Site", "Group", "Status"],
+}
+
+
+def write_fish_export(file_url, rows: list) -> None:
+    pd.DataFrame(
+        rows, columns=["Date", "Site", "Zone", "Depth", "Species", "Size", "Total", "Survey_Status", "Survey_ID"]
+    ).to_csv(file_url, index=False)
+
+
+def daily_totals(daily_df: pd.DataFrame, group: str = "fish") -> pd.Series:
+    # Compare the keys as plain strings and floats, whatever dtypes each path gives them
+    key_dtypes = {key: float if key == "Size" else str for key in DAILY_KEYS[group] if key != "Date"}
+    return daily_df.astype(key_dtypes).set_index(DAILY_KEYS[group])["Total"].astype(float).sort_index()
+
+
+def test_streamed_export_with_blank_cells_matches_in_memory(tmp_path):
+    export_file_url = tmp_path / "fish.csv"
+    write_fish_export(export_file_url, [
+        ["2024-12-05 00:00:00", "Andulay MPA", 1, "Medium", "Sea Bass", "5-10", 4, 1, "a1"],
+        ["2024-12-05 00:00:00", "Andulay MPA", 1, "Medium", "Sea Bass", "5-10", None, 1, "a1"],
+        ["2024-12-05 00:00:00", "Andulay MPA", None, "Medium", "Grouper - Other", "10-15", 2, 1, "a1"],
+        ["2024-12-06 00:00:00", "Andulay MPA", 1, "Medium", "Grouper - Other", "10-15", 3, None, "a2"],
+        ["2024-12-06 00:00:00", "Andulay MPA", 1, "Medium", "Sea Bass", "0-5", 5, 1, "a3"],
+    ])
+
+    # Small chunks so the blank cells land in different chunks
+    streamed_daily_df, streamed_dives_df = stream_survey_data(export_file_url, "fish", chunksize=2)
+
+    in_memory_df = pre_process_data(pd.read_csv(export_file_url), "fish", verbose=False)
+    pd.testing.assert_series_equal(
+        daily_totals(streamed_daily_df), daily_totals(create_daily_df(in_memory_df, "fish"))
+    )
+    # The blank Total adds nothing and the survey without a status is dropped
+    assert daily_totals(streamed_daily_df).tolist() == [2.0, 4.0, 5.0]
+    assert sorted(streamed_dives_df["Survey_ID"].unique()) == ["a1", "a3"]
+
+
+@pytest.mark.parametrize("group", ["fish", "subs"])
+def test_streamed_export_matches_in_memory(tmp_path, group):
+    export_file_url = write_synthetic_export(str(tmp_path / f"{group}.csv"), group, 5_000, seed=2)
+
+    chunks = list(read_survey_chunks(export_file_url, group, chunksize=700))
+    assert [len(chunk) for chunk in chunks] == [700] * 7 + [100]
+    assert set(chunks[0].columns) == {"Date", *SURVEY_SCHEMAS[group]}
+
+    streamed_daily_df, streamed_dives_df = stream_survey_data(export_file_url, group, chunksize=700)
+
+    in_memory_df = pre_process_data(pd.read_csv(export_file_url), group, verbose=False)
+    pd.testing.assert_series_equal(
+        daily_totals(streamed_daily_df, group), daily_totals(create_daily_df(in_memory_df, group), group)
+    )
+    pd.testing.assert_series_equal(
+        count_dives(streamed_dives_df, "seasonal"),
+        count_dives(in_memory_df.astype({"Site": str}), "seasonal"),
+    )
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from invert_metrics import calculate_inverts_metrics
+from subs_metrics import calculate_subs_totals
+from utils import determine_number_of_dives_per_period
+
+
+def test_inverts_total_density_is_attached_to_its_own_site():
+    # The sites appear in the opposite order to their sorted order, which used to put
+    # each site's Total Density on the other site
+    pre_processed_df = pd.DataFrame({
+        "Date": pd.to_datetime(["2024-12-05", "2024-12-05", "2024-12-06", "2024-12-07", "2024-12-07"]),
+        "Site": ["Zamboanguita", "Zamboanguita", "Zamboanguita", "Andulay MPA", "Andulay MPA"],
+        "Species": ["Sea Stars", "Sea Urchins - Diadema", "Sea Stars", "Mantis Shrimp", "Sea Stars"],
+        "Size": [5.0, 5.0, 5.0, 5.0, 5.0],
+        "Total": [10, 20, 30, 1, 2],
+        "Survey_ID": ["z1", "z1", "z2", "a1", "a1"],
+    })
+    dives = determine_number_of_dives_per_period(pre_processed_df, "seasonal")
+
+    results_df = calculate_inverts_metrics(pre_processed_df, dives, "seasonal", include_biomass=False)
+
+    total_density = results_df.set_index("Site")["Total Density"]
+    assert total_density["Zamboanguita"] == (10 + 20 + 30) / 2
+    assert total_density["Andulay MPA"] == (1 + 2) / 1
+    herbivore_density = results_df.set_index("Site")["Herbivore Density"]
+    assert herbivore_density["Zamboanguita"] == 20 / 2
+    assert herbivore_density["Andulay MPA"] == 0
+
+
+def test_subs_totals_give_missing_group_or_status_no_weight():
+    daily_subs_data_df = pd.DataFrame({
+        "Period": [1, 1, 1, 1],
+        "Site": ["Antulang"] * 4,
+        "Group": ["Hard Coral", np.nan, "Rubble", "Soft Coral"],
+        "Status": [np.nan, "Fully Bleaching", "Normal", "Partially Bleaching"],
+        "Total": [1.0, 2.0, 4.0, 8.0],
+    })
+
+    totals = calculate_subs_totals(daily_subs_data_df).loc[(1, "Antulang")]
+
+    assert totals["Hard Coral Cover"] == 1.0
+    assert totals["Rubble Cover"] == 4.0
+    assert totals["Soft Coral Cover"] == 8.0
+    assert totals["Fresh Algae Cover"] == 0.0
+    assert totals["Bleaching"] == 2.0 + 0.5 * 8.0
@@ -0,0 +1,54 @@
+import os
+
+import pandas as pd
+import pytest
+
+from plot import chart_path, find_chart_jobs, render_all_charts
+from utils import parse_period_label, save_site_dataframes
+
+PERIOD_LABELS = ["Winter 23/24", "Spring 2024", "Summer 2024"]
+
+
+def save_results(total_density: list) -> None:
+    save_site_dataframes(pd.DataFrame({
+        "Period": [parse_period_label(label, "seasonal") for label in PERIOD_LABELS] * 2,
+        "Site": ["Andulay MPA"] * 3 + ["Zamboanguita"] * 3,
+        "Total Density": total_density,
+        "Herbivore Density": [0.5, 1.0, 1.5, 2.0, 2.5, 3.0],
+    }), "seasonal", "fish")
+
+
+@pytest.fixture(autouse=True)
+def output_in_tmp_path(tmp_path, monkeypatch):
+    # The output and chart directories are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def render_fish_seasonal_charts(force: bool = False) -> dict:
+    return render_all_charts(groups=["fish"], periods=["seasonal"], max_workers=1, force=force)
+
+
+def test_charts_are_only_drawn_again_when_their_data_changes():
+    save_results([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    assert render_fish_seasonal_charts() == {"drawn": 4, "written": 4, "skipped": 0}
+    assert os.path.exists(chart_path("fish", "seasonal", "Andulay MPA", "Total Density"))
+
+    assert render_fish_seasonal_charts() == {"drawn": 0, "written": 0, "skipped": 4}
+
+    # Only the changed site's changed metric is drawn again
+    save_results([1.0, 2.0, 3.0, 4.0, 5.0, 7.0])
+    jobs, _, skipped = find_chart_jobs("fish", "seasonal")
+    assert [(site, metrics) for _, _, site, _, metrics in jobs] == [("Zamboanguita", ["Total Density"])]
+    assert skipped == 3
+    assert render_fish_seasonal_charts() == {"drawn": 1, "written": 1, "skipped": 3}
+
+    # A chart missing on disk is drawn again even though its data hasn't changed
+    os.remove(chart_path("fish", "seasonal", "Andulay MPA", "Herbivore Density"))
+    assert render_fish_seasonal_charts() == {"drawn": 1, "written": 1, "skipped": 3}
+
+    # Forced charts are all drawn, but unchanged images aren't written again
+    assert render_fish_seasonal_charts(force=True) == {"drawn": 4, "written": 0, "skipped": 0}
+
+
+def test_periods_without_results_have_no_chart_jobs():
+    assert find_chart_jobs("fish", "monthly") == ([], {}, 0)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline import calculate_group_metrics
+from pre_processing import compact_survey_data, pre_process_data
+from synthetic_data import generate_survey_data
+from utils import determine_number_of_dives_per_period
+
+
+@pytest.fixture(scope="module")
+def uncompacted_fish_df():
+    return pre_process_data(generate_survey_data("fish", 5_000, seed=4), "fish", verbose=False, compact=False)
+
+
+def test_compact_survey_data_round_trips(uncompacted_fish_df, tmp_path):
+    survey_data_df = uncompacted_fish_df.copy()
+    survey_data_df.loc[survey_data_df.index[:3], "Survey_ID"] = None
+
+    compact_df = compact_survey_data(survey_data_df)
+
+    assert compact_df.memory_usage(deep=True).sum() < survey_data_df.memory_usage(deep=True).sum() / 2
+    assert isinstance(compact_df["Species"].dtype, pd.CategoricalDtype)
+    assert compact_df["Size"].dtype == np.float32
+    assert compact_df["Total"].dtype.itemsize < survey_data_df["Total"].dtype.itemsize
+    for column in ["Date", "Site", "Zone", "Depth", "Species", "Size", "Total"]:
+        np.testing.assert_array_equal(
+            compact_df[column].to_numpy(dtype=object), survey_data_df[column].to_numpy(dtype=object)
+        )
+    # Survey_IDs become codes with one code per survey, and missing IDs stay missing
+    survey_ids = survey_data_df["Survey_ID"]
+    survey_codes = compact_df["Survey_ID"]
+    assert survey_codes.isna().tolist() == survey_ids.isna().tolist()
+    assert survey_codes.nunique() == survey_ids.nunique()
+    assert (survey_codes.groupby(survey_ids).nunique() == 1).all()
+
+    # The compact dtypes survive the Parquet cache
+    compact_df.to_parquet(tmp_path / "compact.parquet")
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / "compact.parquet"), compact_df)
+
+
+def test_compacting_leaves_the_metrics_unchanged(uncompacted_fish_df):
+    compact_df = compact_survey_data(uncompacted_fish_df)
+
+    results = []
+    for survey_data_df in [uncompacted_fish_df, compact_df]:
+        dives = determine_number_of_dives_per_period(survey_data_df, "seasonal")
+        results_df = calculate_group_metrics(survey_data_df, dives, "seasonal", "fish")
+        results.append(results_df.astype({"Site": str}))
+
+    pd.testing.assert_frame_equal(results[0], results[1])
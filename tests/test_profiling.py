@@ -0,0 +1,85 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from profiling import (
+    PROFILE_ENV_VAR,
+    drain_profile_records,
+    profile_stage,
+    profile_summary,
+    write_profile_trace,
+)
+
+ALLOCATED_BYTES = 8 * 1024**2
+
+
+@profile_stage
+def inner_stage(survey_data_df: pd.DataFrame) -> pd.DataFrame:
+    # Allocate a known amount of memory, freed before returning
+    allocated = np.ones(ALLOCATED_BYTES // 8)
+    del allocated
+    return survey_data_df.head(3)
+
+
+@profile_stage
+def outer_stage(survey_data_df: pd.DataFrame) -> tuple:
+    return inner_stage(survey_data_df), inner_stage(survey_data_df.head(5))
+
+
+@pytest.fixture(autouse=True)
+def clean_records():
+    drain_profile_records()
+    yield
+    drain_profile_records()
+    # Profiling starts tracemalloc, which would slow down every later test
+    tracemalloc.stop()
+
+
+def test_disabled_profiling_records_nothing(monkeypatch):
+    monkeypatch.delenv(PROFILE_ENV_VAR, raising=False)
+
+    head_df, _ = outer_stage(pd.DataFrame({"Total": range(10)}))
+
+    assert head_df["Total"].tolist() == [0, 1, 2]
+    assert drain_profile_records() == []
+
+
+def test_profiled_stages_record_nesting_rows_and_memory(monkeypatch, tmp_path):
+    monkeypatch.setenv(PROFILE_ENV_VAR, "1")
+
+    outer_stage(pd.DataFrame({"Total": range(10)}))
+
+    records = drain_profile_records()
+    assert [(record["stage"], record["parent"], record["depth"]) for record in records] == [
+        ("inner_stage", "outer_stage", 1),
+        ("inner_stage", "outer_stage", 1),
+        ("outer_stage", None, 0),
+    ]
+    assert [(record["rows_in"], record["rows_out"]) for record in records] == [(10, 3), (5, 3), (10, 3)]
+    # The inner stages' peaks are folded into the outer stage's
+    for record in records:
+        assert record["peak_traced_bytes"] >= ALLOCATED_BYTES
+        assert record["wall_seconds"] >= 0
+
+    summary_df = profile_summary(records)
+    assert summary_df.loc["inner_stage", "calls"] == 2
+    assert summary_df.loc["inner_stage", "rows_in"] == 15
+
+    trace_file_url = write_profile_trace(str(tmp_path / "trace.json"), records)
+    with open(trace_file_url) as trace_file:
+        trace_events = json.load(trace_file)["traceEvents"]
+    assert [event["name"] for event in trace_events] == ["inner_stage", "inner_stage", "outer_stage"]
+    assert trace_events[0]["args"]["rows_out"] == 3
+
+
+def test_time_only_profiling_skips_memory(monkeypatch):
+    monkeypatch.setenv(PROFILE_ENV_VAR, "time")
+
+    inner_stage(pd.DataFrame({"Total": range(10)}))
+
+    (record,) = drain_profile_records()
+    assert record["peak_traced_bytes"] is None
+    assert record["rows_out"] == 3
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+import results_store
+from results_store import list_stored_sites, read_results_store, write_results_store
+from utils import parse_period_label
+
+
+@pytest.fixture(autouse=True)
+def results_store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(results_store, "RESULTS_STORE_DIR", str(tmp_path / "results"))
+
+
+def seasonal_results(rows: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        "Period": [parse_period_label(label, "seasonal") for label, _, _ in rows],
+        "Site": [site for _, site, _ in rows],
+        "Total Density": [density for _, _, density in rows],
+    })
+
+
+def test_rewriting_the_store_drops_stale_sites_and_periods():
+    write_results_store(seasonal_results([
+        ("Winter 23/24", "Andulay MPA", 1.0),
+        ("Spring 2024", "Andulay MPA", 2.0),
+        ("Winter 23/24", "Zamboanguita", 3.0),
+    ]), "seasonal", "fish")
+
+    manifest = write_results_store(seasonal_results([
+        ("Winter 23/24", "Andulay MPA", 4.0),
+    ]), "seasonal", "fish")
+
+    assert {entry["site"]: entry["status"] for entry in manifest} == {
+        "Andulay MPA": "written",
+        "Zamboanguita": "removed",
+    }
+    assert list_stored_sites("fish", "seasonal") == ["Andulay MPA"]
+    stored_results_df = read_results_store("fish", "seasonal")
+    assert stored_results_df["Period"].astype(str).tolist() == ["Winter 23/24"]
+    assert stored_results_df["Total Density"].tolist() == [4.0]
+
+
+def test_partial_write_keeps_the_other_sites():
+    write_results_store(seasonal_results([
+        ("Winter 23/24", "Andulay MPA", 1.0),
+        ("Winter 23/24", "Zamboanguita", 3.0),
+    ]), "seasonal", "fish")
+
+    write_results_store(seasonal_results([
+        ("Winter 23/24", "Andulay MPA", 4.0),
+    ]), "seasonal", "fish", remove_stale_sites=False)
+
+    stored_results_df = read_results_store("fish", "seasonal")
+    assert stored_results_df.set_index("Site")["Total Density"].to_dict() == {
+        "Andulay MPA": 4.0,
+        "Zamboanguita": 3.0,
+    }
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from constants import load_biomass_coeffs
+from fish_and_inverts_shared_metrics import (
+    build_species_class_table,
+    calculate_biomass,
+    calculate_class_totals,
+)
+from species_resolver import SpeciesResolver, match_species_positions, normalise_species_name
+
+FISH_BIOMASS_COEFFS = "data/constants/biomass_coeffs_fish.csv"
+
+
+@pytest.fixture
+def resolver():
+    return SpeciesResolver(["Snapper - One-Spot", "Snapper - Two-Spot", "Grouper", "Grouper - Barramundi"])
+
+
+def test_normalise_species_name_ignores_case_punctuation_and_hyphen_spacing():
+    assert normalise_species_name("Snapper - One-Spot") == "snapper - one spot"
+    assert normalise_species_name("SNAPPER -One spot") == "snapper - one spot"
+    assert normalise_species_name("‘Snapper - One-spot’") == "snapper - one spot"
+
+
+def test_resolve_aliases_and_parent_fallback(resolver):
+    assert resolver.resolve("Snapper - One-spot") == "Snapper - One-Spot"
+    assert "snapper - two spot" in resolver
+    assert resolver.resolve("Grouper - Other") is None
+    assert resolver.resolve("Grouper - Other", parent_fallback=True) == "Grouper"
+    # A name that exists is never replaced by its parent
+    assert resolver.resolve("Grouper - Barramundi", parent_fallback=True) == "Grouper - Barramundi"
+    assert resolver.resolve("Wrasse - Other", parent_fallback=True) is None
+
+
+def test_suggest_ranks_near_matches(resolver):
+    suggestions = resolver.suggest("Grouper - Barramundi Cod")
+    assert suggestions[0][0] == "Grouper - Barramundi"
+    assert resolver.suggest("Zzzz") == []
+    assert "did you mean 'Snapper - One-Spot'" in resolver.describe_missing(["Snaper - One-Spot"])
+
+
+def test_match_species_positions_resolves_only_missing_names():
+    vocabulary = pd.Index(["Grouper", "Snapper - One-Spot"])
+    positions = match_species_positions(
+        vocabulary, ["Snapper - One-Spot", "snapper - one spot", "Grouper - Other", "Nothing", np.nan],
+        parent_fallback=True,
+    )
+    assert positions.tolist() == [1, 1, 0, -1, -1]
+
+
+def test_calculate_biomass_uses_alias_and_parent_coefficients():
+    biomass_coeffs = load_biomass_coeffs(FISH_BIOMASS_COEFFS).to_frame()
+    daily_data_df = pd.DataFrame({
+        "Species": ["Grouper - Peacock", "GROUPER - PEACOCK", "Grouper - Madeup"],
+        "Size": [10.0, 10.0, 20.0],
+        "Total": [1, 2, 3],
+    })
+
+    biomass = calculate_biomass(daily_data_df, FISH_BIOMASS_COEFFS)["Total Biomass"].to_numpy()
+
+    peacock = biomass_coeffs.loc["Grouper - Peacock"]
+    grouper = biomass_coeffs.loc["Grouper"]
+    expected_biomass = [
+        1 * peacock["Coeff_a"] * 10.0 ** peacock["Coeff_b"],
+        2 * peacock["Coeff_a"] * 10.0 ** peacock["Coeff_b"],
+        3 * grouper["Coeff_a"] * 20.0 ** grouper["Coeff_b"],
+    ]
+    np.testing.assert_allclose(biomass, expected_biomass)
+
+
+def test_calculate_biomass_suggests_names_for_missing_species():
+    daily_data_df = pd.DataFrame({"Species": ["Snaper - One-Spot"], "Size": [10.0], "Total": [1]})
+    with pytest.raises(ValueError, match="did you mean 'Snapper - One-Spot'"):
+        calculate_biomass(daily_data_df, FISH_BIOMASS_COEFFS)
+
+
+def test_class_totals_count_aliased_species():
+    species_class_table = build_species_class_table("fish", ["carnivore"])
+    daily_data_df = pd.DataFrame({
+        "Period": [1, 1, 1],
+        "Site": ["Antulang"] * 3,
+        "Species": ["Barracuda", "BARRACUDA", "Not A Fish"],
+        "Total": [1.0, 2.0, 4.0],
+    })
+
+    totals = calculate_class_totals(daily_data_df, species_class_table)
+
+    assert totals.loc[(1, "Antulang"), "Total Density"] == 7.0
+    assert totals.loc[(1, "Antulang"), "Carnivore Density"] == 3.0
@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+import pandas as pd
+import pytest
+
+from dive_effort import build_dive_index, count_dives
+from utils import PERIODS, add_periods, determine_number_of_dives_per_period, write_file_if_changed
+
+
+def make_dives_df() -> pd.DataFrame:
+    return pd.DataFrame({
+        "Date": pd.to_datetime(["2024-03-02", "2024-03-02", "2024-06-10", "2024-12-01", "2025-01-15"]),
+        "Site": ["Andulay MPA", "Andulay MPA", "Andulay MPA", "Antulang", "Antulang"],
+        "Survey_ID": ["a1", "a2", "a3", "b1", "b2"],
+    })
+
+
+def test_add_periods_does_not_mutate_its_input():
+    dives_df = make_dives_df()
+    original_df = dives_df.copy()
+
+    with_periods_df = add_periods(dives_df, "seasonal")
+
+    pd.testing.assert_frame_equal(dives_df, original_df)
+    assert "Period" in with_periods_df.columns
+
+
+def test_determine_number_of_dives_per_period_does_not_mutate_its_input():
+    dives_df = make_dives_df()
+    original_df = dives_df.copy()
+
+    dives = determine_number_of_dives_per_period(dives_df, "seasonal")
+
+    pd.testing.assert_frame_equal(dives_df, original_df)
+    # Spring 2024 has two dives at Andulay MPA, and Winter 24/25 spans the new year
+    assert dives.tolist() == [2, 1, 2]
+
+
+def test_count_dives_matches_determine_number_of_dives_per_period():
+    dives_df = make_dives_df()
+    for period in PERIODS:
+        pd.testing.assert_series_equal(
+            count_dives(build_dive_index(dives_df), period),
+            determine_number_of_dives_per_period(dives_df, period),
+            check_names=False,
+        )
+
+
+def test_write_file_if_changed_skips_unchanged_content(tmp_path):
+    file_url = str(tmp_path / "site.csv")
+
+    assert write_file_if_changed(file_url, "Period,Site\n")["status"] == "written"
+    os.utime(file_url, ns=(0, 0))
+    manifest = write_file_if_changed(file_url, b"Period,Site\n")
+
+    assert manifest == {
+        "path": file_url,
+        "sha256": hashlib.sha256(b"Period,Site\n").hexdigest(),
+        "status": "unchanged",
+    }
+    assert os.stat(file_url).st_mtime_ns == 0
+
+    assert write_file_if_changed(file_url, "Period,Site,Total\n")["status"] == "written"
+    with open(file_url) as written_file:
+        assert written_file.read() == "Period,Site,Total\n"
+    assert os.listdir(tmp_path) == ["site.csv"]
+
+
+def test_write_file_if_changed_keeps_the_old_file_when_a_write_fails(tmp_path, monkeypatch):
+    file_url = str(tmp_path / "site.csv")
+    write_file_if_changed(file_url, "old")
+
+    def fail_to_replace(source, destination):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail_to_replace)
+    with pytest.raises(OSError, match="disk full"):
+        write_file_if_changed(file_url, "new")
+
+    with open(file_url) as old_file:
+        assert old_file.read() == "old"
+    # The temporary file is cleaned up
+    assert os.listdir(tmp_path) == ["site.csv"]
@@ -0,0 +1,262 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from fish_and_inverts_shared_metrics import calculate_biomass
+from pipeline import GROUPS, check_all_constants_exist, read_and_pre_process
+from profiling import profile_stage
+from rollup import build_daily_cube
+from dive_effort import build_dive_index
+from utils import PERIODS, create_daily_df, period_ordinals, save_site_dataframes
+
+UNCERTAINTY_DIR = "data/uncertainty"
+
+DEFAULT_REPLICATES = 2000
+DEFAULT_CONFIDENCE = 0.95
+
+# The columns that keep every dive apart in the per dive cube
+DIVE_KEYS = ["Survey_ID", "Date", "Site"]
+
+# Upper bound on the dives drawn per chunk of bootstrap work, which bounds each
+# worker's memory (a draw is an int64 index and a float64 count)
+MAX_CHUNK_DRAWS = 2**22
+
+
+@profile_stage
+def build_dive_cube(pre_processed_df: pd.DataFrame, group: str, include_biomass: bool = False) -> pd.DataFrame:
+    """
+    Build the cube of a group per dive instead of per day: the numerator of every
+    metric summed per Survey_ID, Date and Site. A period's metric is the mean of these
+    over the period's dives, which is what the bootstrap resamples.
+
+    Parameters:
+    pre_processed_df (pd.DataFrame): The pre-processed survey data, with Survey_ID.
+    group (str): Either fish, inverts or subs.
+    include_biomass (bool): Whether to include invert biomass.
+
+    Returns:
+    pd.DataFrame: One row per Survey_ID, Date and Site with one column per metric.
+    """
+    if "Survey_ID" not in pre_processed_df.columns:
+        raise ValueError(
+            "The dive cube needs the pre-processed survey data with Survey_ID, not daily aggregates."
+        )
+    dive_daily_df = create_daily_df(pre_processed_df, group, keys=DIVE_KEYS)
+    if group == "fish" or (group == "inverts" and include_biomass):
+        dive_daily_df = calculate_biomass(dive_daily_df, f"data/constants/biomass_coeffs_{group}.csv")
+    return build_daily_cube(dive_daily_df, group, include_biomass, keys=DIVE_KEYS)
+
+
+def _bootstrap_chunk(dive_values: np.ndarray, replicates: int, quantiles: list, seed: np.random.SeedSequence) -> np.ndarray:
+    # dive_values holds the (group x dive x metric) values of groups with the same
+    # number of dives, so one set of index arrays resamples all of them at once
+    group_count, dive_count, _ = dive_values.shape
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, dive_count, size=(group_count * replicates, dive_count))
+
+    # Count how often each dive is drawn in each replicate, so a replicate's mean is a
+    # matrix product instead of gathering (group x replicate x dive x metric) values
+    replicate_offsets = np.arange(group_count * replicates)[:, np.newaxis] * dive_count
+    draw_counts = np.bincount(
+        (replicate_offsets + draws).ravel(), minlength=group_count * replicates * dive_count
+    ).reshape(group_count, replicates, dive_count)
+    replicate_means = np.matmul(draw_counts, dive_values) / dive_count
+    return np.quantile(replicate_means, quantiles, axis=1)
+
+
+@profile_stage
+def bootstrap_intervals(
+    dive_cube: pd.DataFrame,
+    dive_index: pd.DataFrame,
+    period: str,
+    replicates: int = DEFAULT_REPLICATES,
+    confidence: float = DEFAULT_CONFIDENCE,
+    seed: int = 0,
+    max_workers: int = None,
+) -> pd.DataFrame:
+    """
+    Estimate percentile bootstrap confidence intervals for every metric by resampling
+    the dives (Survey_IDs) within each Period and Site with replacement.
+
+    The dives of each Period and Site are summed once, then groups with the same
+    number of dives are resampled together in chunks, spread over worker processes.
+    Each chunk gets its own random stream from the seed, so the intervals are the same
+    however many workers there are.
+
+    Parameters:
+    dive_cube (pd.DataFrame): The cube from build_dive_cube.
+    dive_index (pd.DataFrame): The dives from dive_effort.build_dive_index, so dives
+    without any records still count as zeros.
+    period (str): One of utils.PERIODS.
+    replicates (int): Number of bootstrap replicates per Period and Site.
+    confidence (float): The confidence level of the intervals, between 0 and 1.
+    seed (int): Seed of the random number generator.
+    max_workers (int, optional): Number of worker processes. Defaults to the number of
+    CPUs. With 1 everything runs in this process.
+
+    Returns:
+    pd.DataFrame: Period (as ordinals), Site, the number of Dives and, for every metric,
+    its estimate and "<metric> Lower" and "<metric> Upper" bounds, ordered by Period and Site.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError(f"The confidence must be between 0 and 1, got {confidence}.")
+    if replicates < 1:
+        raise ValueError(f"At least one replicate is needed, got {replicates}.")
+    metric_columns = list(dive_cube.columns.drop(DIVE_KEYS))
+
+    # Sum each dive's values per period, with the same dives count_dives counts
+    dive_keys = ["Period", "Site", "Survey_ID"]
+    dive_totals = dive_cube[metric_columns].groupby(
+        [period_ordinals(dive_cube["Date"], period).rename("Period"), dive_cube["Site"], dive_cube["Survey_ID"]],
+        observed=True,
+    ).sum()
+    dives = pd.MultiIndex.from_frame(
+        pd.DataFrame({
+            "Period": period_ordinals(dive_index["Date"], period),
+            "Site": dive_index["Site"],
+            "Survey_ID": dive_index["Survey_ID"],
+        }).dropna().drop_duplicates()
+    ).sort_values()
+    dive_totals = dive_totals.reindex(dives, fill_value=0.0)
+    dive_totals.index.names = dive_keys
+    values = dive_totals.to_numpy(dtype=float)
+
+    # Position of each Period and Site's first dive and its number of dives
+    group_codes = dive_totals.index.droplevel("Survey_ID")
+    group_starts = np.flatnonzero(~group_codes.duplicated())
+    dive_counts = np.diff(np.append(group_starts, len(values)))
+    groups = group_codes[group_starts]
+
+    estimates = np.add.reduceat(values, group_starts, axis=0) / dive_counts[:, np.newaxis]
+    lower = np.empty_like(estimates)
+    upper = np.empty_like(estimates)
+
+    # Split the groups into chunks of the same number of dives
+    chunks = []
+    for dive_count in np.unique(dive_counts):
+        same_size = np.flatnonzero(dive_counts == dive_count)
+        chunk_size = max(1, MAX_CHUNK_DRAWS // (replicates * dive_count))
+        for first in range(0, len(same_size), chunk_size):
+            chunks.append(same_size[first:first + chunk_size])
+
+    alpha = 1 - confidence
+    quantiles = [alpha / 2, 1 - alpha / 2]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    job_args = [
+        (
+            values[group_starts[chunk][:, np.newaxis] + np.arange(dive_counts[chunk[0]])],
+            replicates,
+            quantiles,
+            chunk_seed,
+        )
+        for chunk, chunk_seed in zip(chunks, seeds)
+    ]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1 or len(job_args) == 1:
+        chunk_intervals = [_bootstrap_chunk(*args) for args in job_args]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            chunk_intervals = list(executor.map(_bootstrap_chunk, *zip(*job_args)))
+    for chunk, (chunk_lower, chunk_upper) in zip(chunks, chunk_intervals):
+        lower[chunk] = chunk_lower
+        upper[chunk] = chunk_upper
+
+    intervals_df = groups.to_frame(index=False)
+    intervals_df["Dives"] = dive_counts
+    for position, metric in enumerate(metric_columns):
+        intervals_df[metric] = estimates[:, position]
+        intervals_df[f"{metric} Lower"] = lower[:, position]
+        intervals_df[f"{metric} Upper"] = upper[:, position]
+    return intervals_df
+
+
+def run_uncertainty(
+    survey_data_file_url: str,
+    group: str,
+    periods: list,
+    include_biomass: bool = False,
+    replicates: int = DEFAULT_REPLICATES,
+    confidence: float = DEFAULT_CONFIDENCE,
+    seed: int = 0,
+    max_workers: int = None,
+) -> dict:
+    """
+    Read and pre-process a group's export, then save bootstrap confidence intervals of
+    its metrics for each period, one file per site under data/uncertainty.
+
+    Parameters:
+    survey_data_file_url (str): Path to the survey export CSV file.
+    group (str): Either fish, inverts or subs.
+    periods (list): The periods to produce intervals for, any of utils.PERIODS.
+    include_biomass (bool): Whether to calculate invert biomass metrics.
+    replicates (int): Number of bootstrap replicates per Period and Site.
+    confidence (float): The confidence level of the intervals.
+    seed (int): Seed of the random number generator.
+    max_workers (int, optional): Number of worker processes.
+
+    Returns:
+    dict: The intervals of each period.
+    """
+    # The bootstrap needs the individual dives, so the export is read in full
+    pre_processed_df, _ = read_and_pre_process(survey_data_file_url, group)
+    check_all_constants_exist(pre_processed_df, group, include_biomass)
+    dive_index = build_dive_index(pre_processed_df)
+    dive_cube = build_dive_cube(pre_processed_df, group, include_biomass)
+
+    intervals = {}
+    for period in periods:
+        intervals[period] = bootstrap_intervals(
+            dive_cube, dive_index, period, replicates, confidence, seed, max_workers
+        )
+        save_site_dataframes(intervals[period], period, group, output_dir=UNCERTAINTY_DIR)
+    return intervals
+
+
+if __name__ == "__main__":
+    from main import DEFAULT_SURVEY_DATA_FILE_URLS
+
+    parser = argparse.ArgumentParser(
+        description=f"Estimate bootstrap confidence intervals of the metrics per site and period "
+        f"and save them to {UNCERTAINTY_DIR}."
+    )
+    for group in GROUPS:
+        parser.add_argument(
+            f"--{group}-input",
+            default=DEFAULT_SURVEY_DATA_FILE_URLS[group],
+            help=f"Path to the {group} survey export CSV file (default: %(default)s)",
+        )
+    parser.add_argument(
+        "--groups", nargs="+", choices=GROUPS, default=GROUPS,
+        help="Groups to estimate intervals for (default: all)",
+    )
+    parser.add_argument(
+        "--periods", nargs="+", choices=PERIODS, default=["seasonal"],
+        help="Periods to estimate intervals for (default: seasonal)",
+    )
+    parser.add_argument(
+        "--include-invert-biomass", action="store_true",
+        help="Calculate invert biomass metrics (needs biomass_coeffs_inverts.csv to be filled in)",
+    )
+    parser.add_argument(
+        "--replicates", type=int, default=DEFAULT_REPLICATES,
+        help="Number of bootstrap replicates per period and site (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--confidence", type=float, default=DEFAULT_CONFIDENCE,
+        help="Confidence level of the intervals (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: %(default)s)")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of worker processes (default: the number of CPUs)",
+    )
+    args = parser.parse_args()
+
+    for group in args.groups:
+        run_uncertainty(
+            getattr(args, f"{group}_input"), group, args.periods, args.include_invert_biomass,
+            args.replicates, args.confidence, args.seed, args.workers,
+        )
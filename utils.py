@@ -1,70 +1,224 @@
-import pandas as pd
-import re
+import contextlib
+import hashlib
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from profiling import profile_stage
 
+OUTPUT_DIR = "data/output"
 
+# The survey groups, each with its own export and metrics
+GROUPS = ["fish", "inverts", "subs"]
+
+
+@profile_stage
 def determine_number_of_dives_per_period(
     survey_data_by_day_df: pd.DataFrame, period: str
 ) -> pd.DataFrame:
     """
-    Determine the number of dives per day for each site.
+    Determine the number of dives per period for each site. The input is left
+    unchanged. Passing the dive effort index (dive_effort.build_dive_index) instead
+    of the full survey data gives the same counts without scanning every observation.
 
     Parameters:
-    survey_data_df (pd.DataFrame): The DataFrame containing all fish data.
+    survey_data_df (pd.DataFrame): The DataFrame containing all fish data, or its dives.
+    period (str): One of PERIODS.
 
     Returns:
-    pd.DataFrame: The DataFrame with the number of dives per day for each site.
+    pd.DataFrame: The DataFrame with the number of dives per period for each site.
     """
-    survey_data_by_day_df = add_periods(survey_data_by_day_df, period)
-    survey_data_by_day_df = survey_data_by_day_df.groupby(["Period", "Site"])["Survey_ID"].nunique()
-    return survey_data_by_day_df
+    periods = period_ordinals(survey_data_by_day_df["Date"], period).rename("Period")
+    return survey_data_by_day_df.groupby([periods, "Site"], observed=True)["Survey_ID"].nunique()
+
+def normalise_by_dives(totals, dives_df: pd.Series):
+    """
+    Normalise (Period, Site) totals by the number of dives, aligning on the index so
+    the whole Series, or every column of a DataFrame, is divided in one vector operation.
+
+    Parameters:
+    totals (pd.Series or pd.DataFrame): Aggregated totals indexed by (Period, Site).
+    dives_df (pd.Series): The number of dives per (Period, Site), as returned by
+    determine_number_of_dives_per_period.
+
+    Returns:
+    pd.Series or pd.DataFrame: The totals divided by the number of dives, indexed by
+    (Period, Site).
+    """
+    return totals.div(dives_df.reindex(totals.index), axis=0)
+
+
+def add_metric_to_results(
+    results_df: pd.DataFrame, metric: pd.Series, name: str, loc: int = None
+) -> pd.DataFrame:
+    """
+    Add a (Period, Site) indexed metric to the results DataFrame, matching rows on
+    Period and Site rather than position. Combinations without a value are set to 0.
+
+    Parameters:
+    results_df (pd.DataFrame): The DataFrame with one row per Period and Site.
+    metric (pd.Series): The metric values indexed by (Period, Site).
+    name (str): The name of the metric column.
+    loc (int, optional): Column position to insert the metric at. Appended if None.
+
+    Returns:
+    pd.DataFrame: The results DataFrame with the metric column added.
+    """
+    keys = pd.MultiIndex.from_frame(results_df[["Period", "Site"]])
+    values = metric.reindex(keys).fillna(0).to_numpy()
+    results_df = results_df.copy()
+    if loc is None:
+        results_df[name] = values
+    else:
+        results_df.insert(loc, name, values)
+    return results_df
 
 def add_periods(time_df: pd.DataFrame, period: str) -> pd.DataFrame:
     """
-    Determine the period for each survey based on the date.
+    Determine the period for each survey based on the date. Periods are stored as
+    integer ordinals (see period_ordinals) so grouping, sorting and joins work on
+    integers; labels are only created on output by label_periods.
 
     Parameters:
     time_df (pd.DataFrame): Any dataframe containing a 'Date' column (will be used for 
     fish survey data and dive data.
+    period (str): One of PERIODS.
 
     Returns:
-    pd.DataFrame: The DataFrame with the period for each survey.
+    pd.DataFrame: A copy of the DataFrame with the period for each survey.
     """
+    return time_df.assign(Period=period_ordinals(time_df["Date"], period))
 
-    def map_date_to_season(date: pd.Timestamp) -> str:
-        """
-        Map a date to a season label, e.g., 'Spring 2016' or 'Winter 2017/2018'.
+# The periods results can be aggregated by
+PERIODS = ["daily", "monthly", "seasonal", "annual"]
 
-        Parameters:
-        date (pd.Timestamp): The date to map.
+# Seasons in ordinal order within a season year, which starts in March
+SEASON_NAMES = ["Spring", "Summer", "Autumn", "Winter"]
 
-        Returns:
-        str: The season label.
-        """
-        month = date.month
-        year = date.year
+def period_ordinals(dates: pd.Series, period: str) -> pd.Series:
+    """
+    Map dates to integer period ordinals that sort chronologically.
 
-        if month in [12, 1, 2]:
-            # Winter spans two years
-            if month == 12:
-                season = f"Winter {str(year)[-2:]}/{str(year+1)[-2:]}"
-            else:
-                season = f"Winter {str(year-1)[-2:]}/{str(year)[-2:]}"
-        elif month in [3, 4, 5]:
-            season = f"Spring {year}"
-        elif month in [6, 7, 8]:
-            season = f"Summer {year}"
-        else:
-            season = f"Autumn {year}"
-        return season
+    Daily ordinals are days since 1970-01-01 and annual ordinals are the year.
+    Monthly ordinals are year * 12 + (month - 1). Seasonal ordinals are
+    year * 4 + season, where seasons run Spring (Mar-May), Summer (Jun-Aug),
+    Autumn (Sep-Nov) and Winter (Dec-Feb), and a winter belongs to the year of
+    its December.
+
+    Parameters:
+    dates (pd.Series): The dates to map.
+    period (str): One of PERIODS.
 
+    Returns:
+    pd.Series: The integer period ordinal of each date.
+    """
+    if period == "daily":
+        days = dates.to_numpy().astype("datetime64[D]").astype("int64")
+        return pd.Series(days, index=dates.index, name=dates.name)
+    elif period == "annual":
+        return dates.dt.year.astype("int32")
+    months_since_year_zero = dates.dt.year.astype("int32") * 12 + dates.dt.month.astype("int32") - 1
     if period == "monthly":
-        time_df["Period"] = time_df["Date"].dt.to_period("M")
+        return months_since_year_zero
+    elif period == "seasonal":
+        # Counting months from March puts each season's three months next to each other
+        return (months_since_year_zero - 2) // 3
+    raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}.")
+
+def period_label(ordinal: int, period: str) -> str:
+    """
+    Create the human readable label of a period ordinal, e.g. '2024-12-03' for daily,
+    '2024-12' for monthly and '2024' for annual periods, or 'Spring 2024' and
+    'Winter 24/25' for seasonal periods.
+
+    Parameters:
+    ordinal (int): The period ordinal, as returned by period_ordinals.
+    period (str): One of PERIODS.
+
+    Returns:
+    str: The period label.
+    """
+    if period == "daily":
+        return str(np.datetime64(int(ordinal), "D"))
+    elif period == "monthly":
+        year, month = divmod(int(ordinal), 12)
+        return f"{year}-{month + 1:02d}"
     elif period == "seasonal":
-        time_df["Period"] = time_df["Date"].map(map_date_to_season)
-    return time_df
+        year, season = divmod(int(ordinal), 4)
+        if SEASON_NAMES[season] == "Winter":
+            # Winter spans two years
+            return f"Winter {str(year)[-2:]}/{str(year + 1)[-2:]}"
+        return f"{SEASON_NAMES[season]} {year}"
+    elif period == "annual":
+        return str(int(ordinal))
+    raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}.")
 
-def create_daily_df(all_survey_data_df: pd.DataFrame, group: str) -> pd.DataFrame:
+def parse_period_label(label: str, period: str) -> int:
+    """
+    Convert a period label written by period_label back into its ordinal.
+
+    Parameters:
+    label (str): The period label, e.g. '2024-12', 'Spring 2024' or 'Winter 24/25'.
+    period (str): One of PERIODS.
+
+    Returns:
+    int: The period ordinal.
+    """
+    if period == "daily":
+        return int(np.datetime64(label, "D").astype("int64"))
+    elif period == "monthly":
+        year, month = label.split("-")
+        return int(year) * 12 + int(month) - 1
+    elif period == "seasonal":
+        season, years = label.split(" ")
+        # Winter labels only carry the last two digits of the year of their December
+        year = 2000 + int(years.split("/")[0]) if season == "Winter" else int(years)
+        return year * 4 + SEASON_NAMES.index(season)
+    elif period == "annual":
+        return int(label)
+    raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}.")
+
+def as_period_ordinal(period_value, period: str) -> int:
+    """
+    Accept a period either as a label written by period_label or as an ordinal.
+
+    Parameters:
+    period_value (str or int): The period label, e.g. 'Spring 2024', or its ordinal.
+    period (str): One of PERIODS.
+
+    Returns:
+    int: The period ordinal.
+    """
+    if isinstance(period_value, str):
+        return parse_period_label(period_value, period)
+    return int(period_value)
+
+def label_periods(ordinals: pd.Series, period: str) -> pd.Series:
+    """
+    Convert period ordinals into an ordered categorical of period labels, labelling
+    each distinct period once.
+
+    Parameters:
+    ordinals (pd.Series): The period ordinals.
+    period (str): One of PERIODS.
+
+    Returns:
+    pd.Series: Ordered categorical period labels with the same index as the input.
+    """
+    codes, unique_ordinals = pd.factorize(ordinals, sort=True)
+    labels = [period_label(ordinal, period) for ordinal in unique_ordinals]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=labels, ordered=True),
+        index=ordinals.index,
+        name=ordinals.name,
+    )
+
+@profile_stage
+def create_daily_df(
+    all_survey_data_df: pd.DataFrame, group: str, keys: tuple = ("Date", "Site")
+) -> pd.DataFrame:
     """
     Aggregate all fish survey data to create a dataframe that shows the total biomass
     and number of fish spotted for each fish category of each size seen on each day at
@@ -72,6 +226,8 @@ def create_daily_df(all_survey_data_df: pd.DataFrame, group: str) -> pd.DataFram
 
     all_fish_survey_data_df (pd.DataFrame): The DataFrame containing all fish data
     at indivudual survey level.
+    keys (tuple): The columns to aggregate per besides the category and size, e.g.
+    ("Survey_ID", "Date", "Site") to keep every dive apart.
 
     Returns:
     pd.DataFrame: A DataFrame containing the total biomass and number of fish spotted
@@ -79,18 +235,19 @@ def create_daily_df(all_survey_data_df: pd.DataFrame, group: str) -> pd.DataFram
     """
     if group != "subs":
         aggregated_df = (
-            all_survey_data_df.groupby(["Date", "Site", "Species", "Size"])
+            all_survey_data_df.groupby([*keys, "Species", "Size"], observed=True)
             .agg({"Total": "sum"})
             .reset_index()
         )
     else:
         aggregated_df = (
-            all_survey_data_df.groupby(["Date", "Site", "Group", "Status"])
+            all_survey_data_df.groupby([*keys, "Group", "Status"], observed=True)
             .agg({"Total": "sum"})
             .reset_index()
         )
     return aggregated_df
 
+@profile_stage
 def prepare_results_df(survey_data_df: pd.DataFrame) -> pd.DataFrame:
     """
     Extract a DataFrame with one row for each unique combination of Period and Site.
@@ -107,46 +264,122 @@ def prepare_results_df(survey_data_df: pd.DataFrame) -> pd.DataFrame:
     return unique_combinations
 
 
+# Number of site files written at once by save_site_dataframes
+DEFAULT_WRITE_WORKERS = 8
+
 # Create separate DataFrames for each site and save them as CSV files
-def save_site_dataframes(daily_fish_results_df: pd.DataFrame, period: str, group: str) -> None:
+@profile_stage
+def save_site_dataframes(
+    daily_fish_results_df: pd.DataFrame,
+    period: str,
+    group: str,
+    max_workers: int = DEFAULT_WRITE_WORKERS,
+    output_dir: str = OUTPUT_DIR,
+) -> list:
     """
-    Create separate DataFrames for each site and save them as CSV files.
+    Create separate DataFrames for each site and save them as CSV files. Files are
+    written concurrently and atomically, and files whose content hasn't changed are
+    left untouched.
 
     Parameters:
-    daily_fish_results_df (pd.DataFrame): The DataFrame containing daily fish results.
+    daily_fish_results_df (pd.DataFrame): The DataFrame containing the results of any group.
+    period (str): One of PERIODS.
+    group (str): Either fish, inverts or subs.
+    max_workers (int): Number of files to write at once.
+    output_dir (str): The directory the group/period/site files are saved under.
+
+    Returns:
+    list: A manifest with the site, file path, content hash and whether the file was
+    "written" or "unchanged", for each site.
     """
-    # Order columns by season and year
-    daily_fish_results_df["sort_key"] = daily_fish_results_df["Period"].apply(period_sort_key)
-    daily_fish_results_df = daily_fish_results_df.sort_values("sort_key").drop(columns="sort_key")
+    # Order rows chronologically, then turn the period ordinals into labels
+    daily_fish_results_df = daily_fish_results_df.sort_values("Period", kind="stable")
+    daily_fish_results_df["Period"] = label_periods(daily_fish_results_df["Period"], period)
 
     # Round all values for 2 decimal places
     daily_fish_results_df = daily_fish_results_df.round(2)
 
-    output_dir = "data/output"
     if not os.path.exists(f"{output_dir}/{group}/{period}"):
         os.makedirs(f"{output_dir}/{group}/{period}")
-    for site, site_df in daily_fish_results_df.groupby("Site"):
+
+    def save_site_dataframe(site_and_df: tuple) -> dict:
+        site, site_df = site_and_df
         site_filename = f"{output_dir}/{group}/{period}/{site}.csv"
-        site_df.to_csv(site_filename, index=False)
-        print(f"Saved {site_filename}")
-
-
-def period_sort_key(period_str):
-    # Match e.g. "Winter 17/18", "Autumn 2018", etc.
-    match = re.match(r"(\w+)\s+(\d{2,4})(?:/(\d{2}))?", period_str)
-    if not match:
-        return (9999, 99)  # Put unrecognized at end
-
-    season, year1, year2 = match.groups()
-    # Convert to full year
-    year1 = int(year1) if len(year1) == 4 else 2000 + int(year1)
-    if year2:
-        year2 = 2000 + int(year2)
-        year = year1  # Use the first year for sorting
-    else:
-        year = year1
+        site_manifest = write_file_if_changed(site_filename, site_df.to_csv(index=False))
+        return {"site": site, **site_manifest}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        manifest = list(
+            executor.map(save_site_dataframe, daily_fish_results_df.groupby("Site", observed=True))
+        )
+    # Report from this thread, so lines from concurrent writes can't interleave
+    for site_manifest in manifest:
+        if site_manifest["status"] == "written":
+            print(f"Saved {site_manifest['path']}")
+
+    unchanged = sum(site_manifest["status"] == "unchanged" for site_manifest in manifest)
+    if unchanged:
+        print(f"Skipped {unchanged} unchanged {group} {period} site files")
+    return manifest
+
+
+def load_site_results(sites, period: str, group: str) -> pd.DataFrame:
+    """
+    Load the stored results of the given sites, with Period converted back to ordinals.
+
+    Parameters:
+    sites (iterable): The sites to load. Sites without a results file are skipped.
+    period (str): One of PERIODS.
+    group (str): Either fish, inverts or subs.
+
+    Returns:
+    pd.DataFrame: The stored results of the sites, or an empty DataFrame if there are none.
+    """
+    site_results = []
+    for site in sites:
+        site_filename = f"{OUTPUT_DIR}/{group}/{period}/{site}.csv"
+        if os.path.exists(site_filename):
+            site_results.append(pd.read_csv(site_filename))
+    if not site_results:
+        return pd.DataFrame(columns=["Period", "Site"])
+
+    stored_results_df = pd.concat(site_results, ignore_index=True)
+    stored_results_df["Period"] = stored_results_df["Period"].map(
+        lambda label: parse_period_label(label, period)
+    )
+    return stored_results_df
+
+
+def write_file_if_changed(file_url: str, content) -> dict:
+    """
+    Write text or bytes to a file atomically (via a temporary file that is renamed
+    into place), unless the file already has exactly this content.
+
+    Parameters:
+    file_url (str): Path to the file.
+    content (str or bytes): The text (written as UTF-8) or bytes to write.
+
+    Returns:
+    dict: The file path, the SHA-256 of the content and whether the file was
+    "written" or "unchanged".
+    """
+    content_bytes = content.encode("utf-8") if isinstance(content, str) else content
+    content_hash = hashlib.sha256(content_bytes).hexdigest()
+
+    if os.path.exists(file_url):
+        with open(file_url, "rb") as existing_file:
+            if hashlib.sha256(existing_file.read()).hexdigest() == content_hash:
+                return {"path": file_url, "sha256": content_hash, "status": "unchanged"}
 
-    # Assign season order: Winter=0, Spring=1, Summer=2, Autumn=3
-    season_order = {"Winter": 4, "Spring": 1, "Summer": 2, "Autumn": 3}
-    s_order = season_order.get(season, 99)
-    return (year, s_order)
+    # Unique per process and thread so concurrent writers never share a temporary file
+    temporary_file_url = f"{file_url}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary_file_url, "wb") as temporary_file:
+            temporary_file.write(content_bytes)
+        os.replace(temporary_file_url, file_url)
+    except BaseException:
+        # The temporary file may never have been created, which mustn't hide the error
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_file_url)
+        raise
+    return {"path": file_url, "sha256": content_hash, "status": "written"}